@@ -0,0 +1,309 @@
+"""A compact binary archive format for saved Pages, read through mmap.
+
+An archive is laid out as a header followed by these sections, every
+number in which is little-endian:
+
+    rows      one fixed-size record per Item (its ID, numbers and
+              references into the string pool), in the order the Items
+              are rendered: each page's main Item, its poll options, and
+              then its comments
+    parents   the row of the parent of each row, or -1 (int32 each)
+    depths    the depth of each row, which is 0 for main Items and poll
+              options, and the length of the lineage for comments
+              (uint16 each)
+    index     (ID, row) pairs sorted by ID, to find Items by ID
+    pages     one record per Page: its number, whether it has a next
+              page, its type and its range of rows
+    strings   the UTF-8 text of every string, each stored once
+
+Opening an archive only reads the header. Rows are decoded when they're
+asked for, and searching runs over the string pool itself, so a saved
+thread with tens of thousands of comments can be reopened, searched and
+re-rendered (at any width) a page at a time.
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+import bisect
+import mmap
+import re
+import struct
+
+from page import Page, NewsPage, PostPage, CommentPage, DEFAULT_WIDTH
+from pages import Pages
+from items import Item
+
+MAGIC = b'RHNA'
+VERSION = 1
+# suffix of archive files, which the s action saves as an archive
+ARCHIVE_SUFFIX = '.hna'
+
+# magic, version, number of rows, number of pages, then the offsets of
+# the rows, parents, depths, index, pages and strings sections, and the
+# length of the strings section
+HEADER = struct.Struct('<4sHxxIIQQQQQQQ')
+# the string fields of a row, each stored as an (offset, length)
+# reference into the string pool
+STRING_FIELDS = ('type', 'user', 'title', 'url', 'sitebit', 'text', 'score_text')
+# ID, score, total comments, rank, parent ID, then the string references
+ROW = struct.Struct('<qiiiq' + 'II' * len(STRING_FIELDS))
+PARENT = struct.Struct('<i')
+DEPTH = struct.Struct('<H')
+INDEX_ENTRY = struct.Struct('<qI')
+# page number, first row, number of rows, page type, has next
+PAGE = struct.Struct('<IIIBBxx')
+
+# stands in for numbers that an Item doesn't have
+NO_NUMBER = -2 ** 31
+# the length of a reference to a string that an Item doesn't have
+NO_STRING = 0xFFFFFFFF
+
+PAGE_TYPES = {NewsPage: 0, PostPage: 1, CommentPage: 2}
+PAGE_CLASSES = {code: cls for cls, code in PAGE_TYPES.items()}
+
+class ArchiveError(Exception):
+    """Raised when a file isn't an archive that can be read."""
+    pass
+
+class ArchiveWriter(object):
+    """Builds up the sections of an archive from Pages."""
+
+    def __init__(self):
+        self.rows = bytearray()
+        self.parents = bytearray()
+        self.depths = bytearray()
+        self.pages = bytearray()
+        self.strings = bytearray()
+        self.ids: List[Tuple[int, int]] = []
+        self._string_refs: Dict[str, Tuple[int, int]] = {}
+        self.num_rows = 0
+
+    def add_string(self, s: Optional[str]) -> Tuple[int, int]:
+        """Add a string to the pool (once, no matter how often it's added), returning its reference."""
+        if s is None:
+            return (0, NO_STRING)
+        ref = self._string_refs.get(s, None)
+        if ref is None:
+            data = s.encode('utf-8')
+            ref = self._string_refs[s] = (len(self.strings), len(data))
+            self.strings += data
+        return ref
+
+    def add_row(self, item: Item, parent: int, depth: int, rank: int = None) -> int:
+        """Add an Item as a row, returning its row number."""
+        content = item.get_content() or {}
+        score = content.get('score', None)
+        numbers = [
+            score if isinstance(score, int) else NO_NUMBER,
+            content.get('total_comments', None),
+            rank,
+            content.get('parent', None),
+        ]
+        numbers = [NO_NUMBER if n is None else n for n in numbers]
+        strings = [content.get(field, None) for field in STRING_FIELDS[:-1]]
+        # poll options have scores like '12 points', which are kept as is
+        strings.append(score if isinstance(score, str) else None)
+        refs = [x for s in strings for x in self.add_string(s)]
+        self.rows += ROW.pack(item.get_id(), *numbers, *refs)
+        self.parents += PARENT.pack(parent)
+        self.depths += DEPTH.pack(depth)
+        self.ids.append((item.get_id(), self.num_rows))
+        self.num_rows += 1
+        return self.num_rows - 1
+
+    def add_page(self, pg: Page):
+        """Add a Page, and every Item on it."""
+        first_row = self.num_rows
+        if isinstance(pg, NewsPage):
+            for item_id, rank in pg.ranks.items():
+                self.add_row(pg.items[item_id], -1, 0, rank)
+        else:
+            main_row = self.add_row(pg.item, -1, 0)
+            for part in pg.item.get_parts() or []:
+                self.add_row(part, main_row, 0)
+            rows = {}
+            for comment_id, lineage in (pg.comments or {}).items():
+                parent = rows.get(lineage[-2][0], main_row) if len(lineage) > 1 else main_row
+                rows[comment_id] = self.add_row(lineage[-1][1], parent, len(lineage))
+        self.pages += PAGE.pack(pg.pg_number, first_row, self.num_rows - first_row,
+            PAGE_TYPES[type(pg)], bool(pg.has_next))
+
+    def to_bytes(self) -> bytes:
+        """Lay the sections out after the header."""
+        index = b''.join(INDEX_ENTRY.pack(item_id, row) for item_id, row in sorted(self.ids))
+        sections = [self.rows, self.parents, self.depths, index, self.pages, self.strings]
+        offsets = []
+        offset = HEADER.size
+        for section in sections:
+            offsets.append(offset)
+            offset += len(section)
+        header = HEADER.pack(MAGIC, VERSION, self.num_rows, len(self.pages) // PAGE.size,
+            *offsets, len(self.strings))
+        return header + b''.join(sections)
+
+def save(pgs: Pages, path: str):
+    """Save Pages as an archive at path."""
+    writer = ArchiveWriter()
+    for pg in pgs.pages:
+        writer.add_page(pg)
+    with open(path, 'wb') as f:
+        f.write(writer.to_bytes())
+
+class Archive(object):
+    """A saved archive of Pages, read through mmap."""
+    path: str = None
+    num_rows: int = None
+    num_pages: int = None
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < HEADER.size:
+            raise ArchiveError('{} is too short to be an archive'.format(path))
+        (magic, version, self.num_rows, self.num_pages, self._rows_off, self._parents_off, self._depths_off,
+            self._index_off, self._pages_off, self._strings_off, self._strings_len) = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise ArchiveError('{} is not a version {} archive'.format(path, VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.num_rows
+
+    def close(self):
+        self._mmap.close()
+
+    def get_string(self, offset: int, length: int) -> Optional[str]:
+        """Get a string from the pool by its reference."""
+        if length == NO_STRING:
+            return None
+        start = self._strings_off + offset
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def get_parent(self, row: int) -> int:
+        """Get the row of the parent of a row, or -1."""
+        return PARENT.unpack_from(self._mmap, self._parents_off + row * PARENT.size)[0]
+
+    def get_depth(self, row: int) -> int:
+        return DEPTH.unpack_from(self._mmap, self._depths_off + row * DEPTH.size)[0]
+
+    def get_id(self, row: int) -> int:
+        return struct.unpack_from('<q', self._mmap, self._rows_off + row * ROW.size)[0]
+
+    def get_item(self, row: int) -> Item:
+        """Decode a row into an Item."""
+        item_id, score, total_comments, rank, parent, *refs = ROW.unpack_from(self._mmap, self._rows_off + row * ROW.size)
+        content = {}
+        for i, field in enumerate(STRING_FIELDS):
+            value = self.get_string(refs[2 * i], refs[2 * i + 1])
+            if value is not None:
+                content[field] = value
+        score_text = content.pop('score_text', None)
+        if score != NO_NUMBER:
+            content['score'] = score
+        elif score_text is not None:
+            content['score'] = score_text
+        if total_comments != NO_NUMBER:
+            content['total_comments'] = total_comments
+        if parent != NO_NUMBER:
+            content['parent'] = parent
+        return Item(item_id, content=content)
+
+    def get_rank(self, row: int) -> Optional[int]:
+        rank = struct.unpack_from('<i', self._mmap, self._rows_off + row * ROW.size + 16)[0]
+        return rank if rank != NO_NUMBER else None
+
+    def find(self, item_id: int) -> Optional[int]:
+        """Find the row of the Item with the given ID, or None if it isn't in the archive."""
+        lo, hi = 0, self.num_rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_id, row = INDEX_ENTRY.unpack_from(self._mmap, self._index_off + mid * INDEX_ENTRY.size)
+            if mid_id < item_id:
+                lo = mid + 1
+            elif mid_id > item_id:
+                hi = mid
+            else:
+                return row
+        return None
+
+    def get_page_info(self, page: int) -> Tuple[int, int, int, type, bool]:
+        """Get the number, first row, number of rows, type and whether there's a next page of a Page."""
+        pg_number, first_row, num_rows, page_type, has_next = PAGE.unpack_from(self._mmap,
+            self._pages_off + page * PAGE.size)
+        return pg_number, first_row, num_rows, PAGE_CLASSES[page_type], bool(has_next)
+
+    def get_page(self, page: int) -> Page:
+        """Decode the Items of a single Page back into a Page."""
+        pg_number, first_row, num_rows, page_class, has_next = self.get_page_info(page)
+        rows = range(first_row, first_row + num_rows)
+        if page_class is NewsPage:
+            ranks, items = OrderedDict(), OrderedDict()
+            for row in rows:
+                item = self.get_item(row)
+                items[item.get_id()] = item
+                ranks[item.get_id()] = self.get_rank(row)
+            return NewsPage(pg_number, has_next, ranks, items)
+
+        main_item = self.get_item(first_row)
+        parts = []
+        comments = OrderedDict()
+        lineages = {first_row: []}
+        for row in rows[1:]:
+            item = self.get_item(row)
+            if self.get_depth(row) == 0:
+                parts.append(item)
+                continue
+            lineage = lineages[self.get_parent(row)] + [(item.get_id(), item)]
+            lineages[row] = lineage
+            comments[item.get_id()] = lineage
+        if parts:
+            main_item.content['parts'] = parts
+        return page_class(pg_number, has_next, item=main_item, comments=comments or None)
+
+    def iter_pages(self) -> Iterator[Page]:
+        """Decode the Pages one at a time."""
+        for page in range(self.num_pages):
+            yield self.get_page(page)
+
+    def get_pages(self) -> Pages:
+        """Decode every Page."""
+        return Pages(list(self.iter_pages()))
+
+    def render(self, width: int = DEFAULT_WIDTH) -> Iterator[str]:
+        """Render the Pages as text wrapped to width, one Page at a time."""
+        for pg in self.iter_pages():
+            yield '(page {}):\n{}\n'.format(pg.pg_number, pg.render(width))
+
+    def search(self, text: str, fields: Tuple[str, ...] = ('text', 'title', 'user')) -> List[int]:
+        """Get the rows with text in any of fields, ignoring (ASCII) case."""
+        needle = text.encode('utf-8')
+        # a lookahead finds overlapping matches too, so one that runs over
+        # the end of a string can't hide one starting in the next string
+        pattern = re.compile(b'(?=' + re.escape(needle) + b')', re.IGNORECASE)
+        pool = memoryview(self._mmap)[self._strings_off:self._strings_off + self._strings_len]
+        # find the matches in the string pool first, then the rows whose
+        # strings they fall inside of, without decoding any rows. Every
+        # match is found, so if the first one at or after the start of a
+        # string runs past its end, so does every later one.
+        hits = [m.start() for m in pattern.finditer(pool)]
+        pool.release()
+        if not hits:
+            return []
+        field_nums = [STRING_FIELDS.index(field) for field in fields]
+        matches = []
+        for row in range(self.num_rows):
+            refs = ROW.unpack_from(self._mmap, self._rows_off + row * ROW.size)[5:]
+            for i in field_nums:
+                offset, length = refs[2 * i], refs[2 * i + 1]
+                if length == NO_STRING:
+                    continue
+                first = bisect.bisect_left(hits, offset)
+                if first < len(hits) and hits[first] + len(needle) <= offset + length:
+                    matches.append(row)
+                    break
+        return matches
@@ -0,0 +1,256 @@
+"""Asyncio versions of the functions in pages, built on a fetch -> parse -> ingest pipeline.
+
+Many thread loads can share a single PagePipeline (and so a single event
+loop), rather than each needing a thread of its own:
+
+    async with PagePipeline(item_db) as pipeline:
+        threads = await asyncio.gather(*[get_post_pages_by_id(i, pipeline) for i in item_ids])
+
+Requests are made with aiohttp if it's installed. Without it, they're
+made with requests on a small, bounded pool of threads instead.
+"""
+from typing import Callable, Dict, List, Tuple
+from concurrent.futures import Executor, ThreadPoolExecutor
+import asyncio
+import math
+import time
+
+from page import Page, NewsPage, extract_page, extract_ranks
+from pages import Pages, ITEMS_PER_NEWS_PAGE
+from itemdb import ItemDB, item_db as shared_item_db
+from items import Item
+import common
+from common import request_html, NO_CACHE_HEADERS
+from metrics import metrics
+from profiler import profiler
+from scheduler import scheduler
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# number of requests in flight at once, and of pages being parsed at once
+DEFAULT_FETCHERS = 8
+DEFAULT_PARSERS = 2
+# the most pages waiting between each pair of stages, so that a fast
+# stage can't run far ahead of a slow one
+DEFAULT_QUEUE_SIZE = 8
+
+def get_page_items(pg: Page) -> List[Item]:
+    """Get every Item on a Page."""
+    if isinstance(pg, NewsPage):
+        return list(pg.items.values())
+    items = [pg.item]
+    if pg.comments is not None:
+        items.extend(lineage[-1][1] for lineage in pg.comments.values())
+    return items
+
+def intern_page(pg: Page, item_db: ItemDB):
+    """Intern every Item on a Page in item_db, swapping the live Items in for any that aren't already."""
+    live = {}
+    for item in get_page_items(pg):
+        # Items parsed on threads are interned in the shared ItemDB
+        # already, so only those parsed elsewhere (i.e. on a pool of
+        # processes) or meant for another ItemDB are interned here
+        db_item = item_db.get_item(item.get_id())
+        if db_item is not item:
+            db_item = item_db.intern(item)
+        if db_item is not item:
+            live[item.get_id()] = db_item
+    if not live:
+        return
+    if isinstance(pg, NewsPage):
+        for item_id, item in live.items():
+            pg.items[item_id] = item
+        return
+    pg.item = live.get(pg.item.get_id(), pg.item)
+    if pg.comments is not None:
+        pg.comments = {comment_id: [(item_id, live.get(item_id, item)) for item_id, item in lineage]
+            for comment_id, lineage in pg.comments.items()}
+
+def parse_page(url: str, html: str) -> Page:
+    """Extract the Page with the given HTML, attributing its stages to url."""
+    with profiler.page(url):
+        return extract_page(html)
+
+class PagePipeline(object):
+    """Fetches, parses and ingests pages in stages connected by bounded queues.
+
+    Fetchers take URLs off of the first queue and put the HTML of each
+    page on the second. Parsers extract Pages from that HTML in an
+    executor and put them on the third, off of which every Item on each
+    Page is interned in item_db (the shared one, unless another is given)
+    before on_page (i.e. a renderer) is called.
+    """
+    item_db: ItemDB = None
+    on_page: Callable[[Page], None] = None
+
+    def __init__(self, item_db: ItemDB = None, on_page: Callable[[Page], None] = None,
+        fetchers: int = DEFAULT_FETCHERS, parsers: int = DEFAULT_PARSERS,
+        queue_size: int = DEFAULT_QUEUE_SIZE, executor: Executor = None):
+        self.item_db = item_db if item_db is not None else shared_item_db
+        self.on_page = on_page
+        self.fetchers = fetchers
+        self.parsers = parsers
+        self.queue_size = queue_size
+        self._executor = executor
+        self._own_executor = executor is None
+        self._io_executor = None
+        self._session = None
+        self._tasks: List[asyncio.Task] = []
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """Start the tasks running each stage."""
+        if self._own_executor:
+            self._executor = ThreadPoolExecutor(max_workers=self.parsers)
+        if aiohttp is not None:
+            self._session = aiohttp.ClientSession(headers=NO_CACHE_HEADERS)
+        else:
+            self._io_executor = ThreadPoolExecutor(max_workers=self.fetchers)
+        self._urls = asyncio.Queue(self.queue_size)
+        self._htmls = asyncio.Queue(self.queue_size)
+        self._pages = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.ensure_future(self._fetch_worker()) for _ in range(self.fetchers)]
+        self._tasks += [asyncio.ensure_future(self._parse_worker()) for _ in range(self.parsers)]
+        self._tasks.append(asyncio.ensure_future(self._ingest_worker()))
+
+    async def close(self):
+        """Stop every stage, cancelling any pages still in the pipeline."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for future in list(self._in_flight.values()):
+            future.cancel()
+        self._in_flight.clear()
+        if self._session is not None:
+            await self._session.close()
+        if self._io_executor is not None:
+            self._io_executor.shutdown(wait=False)
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def load(self, url: str) -> Page:
+        """Fetch, parse and ingest the page at url, returning its Page."""
+        # loads of the same URL at the same time share a single trip
+        # through the pipeline
+        future = self._in_flight.get(url, None)
+        if future is None:
+            future = self._in_flight[url] = asyncio.get_event_loop().create_future()
+            future.add_done_callback(lambda _: self._in_flight.pop(url, None))
+            # blocks while the pipeline is full
+            await self._urls.put((url, future))
+        return await asyncio.shield(future)
+
+    async def fetch_html(self, url: str) -> str:
+        """Fetch the HTML at url, within the shared rate limit."""
+        await scheduler.acquire_async()
+        if self._session is None:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self._io_executor, request_html, url)
+
+        start = time.perf_counter()
+        async with self._session.get(url) as r:
+            data = await r.read()
+            html = data.decode(r.get_encoding())
+        metrics.record_response('html', r.status, len(data))
+        if profiler.active:
+            profiler.record('get_html', time.perf_counter() - start)
+        return html
+
+    async def parse(self, fn: Callable, *args):
+        """Await fn(*args), run in the executor used to parse pages."""
+        return await asyncio.get_event_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _fetch_worker(self):
+        while True:
+            url, future = await self._urls.get()
+            try:
+                html = await self.fetch_html(url)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            await self._htmls.put((url, html, future))
+
+    async def _parse_worker(self):
+        while True:
+            url, html, future = await self._htmls.get()
+            try:
+                pg = await self.parse(parse_page, url, html)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            await self._pages.put((pg, future))
+
+    async def _ingest_worker(self):
+        while True:
+            pg, future = await self._pages.get()
+            try:
+                intern_page(pg, self.item_db)
+                if self.on_page is not None:
+                    self.on_page(pg)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(pg)
+
+async def run_in_pipeline(fn: Callable, pipeline: PagePipeline, *args):
+    """Await fn(*args, pipeline), starting a short-lived pipeline for it if one isn't given."""
+    if pipeline is not None:
+        return await fn(*args, pipeline)
+    async with PagePipeline() as pipeline:
+        return await fn(*args, pipeline)
+
+async def get_post_pages_by_id(item_id: int, pipeline: PagePipeline = None) -> Pages:
+    """Get Post Pages based on an Item ID."""
+    return await run_in_pipeline(_get_post_pages_by_id, pipeline, item_id)
+
+async def _get_post_pages_by_id(item_id: int, pipeline: PagePipeline) -> Pages:
+    url = common.HN_ITEMS_URL + '?id={}'.format(item_id)
+    pages = []
+    pg = await pipeline.load(url)
+    pages.append(pg)
+    while(pg.has_next):
+        newurl = url + '&p={}'.format(pg.pg_number + 1)
+        pg = await pipeline.load(newurl)
+        pages.append(pg)
+
+    return Pages(pages)
+
+async def get_post_by_rank(rank: int, pipeline: PagePipeline = None) -> Tuple[int, str]:
+    """Get information (title, ID) about a post by rank."""
+    return await run_in_pipeline(_get_post_by_rank, pipeline, rank)
+
+async def _get_post_by_rank(rank: int, pipeline: PagePipeline) -> Tuple[int, str]:
+    # calculate page to visit based on the rank
+    #   (there are 30 results/page)
+    page_num = int(math.ceil(rank / ITEMS_PER_NEWS_PAGE))
+
+    url = common.HN_NEWS_URL + '?p={}'.format(page_num)
+    # only the ranks are needed, so skip the rest of the pipeline
+    html = await pipeline.fetch_html(url)
+    ranks = await pipeline.parse(extract_ranks, html)
+    return ranks[rank]
+
+async def get_news_pages_by_num(page_nums: List[int], pipeline: PagePipeline = None) -> Pages:
+    """Get News Pages indicated by a list of numbers."""
+    return await run_in_pipeline(_get_news_pages_by_num, pipeline, page_nums)
+
+async def _get_news_pages_by_num(page_nums: List[int], pipeline: PagePipeline) -> Pages:
+    # the pages don't depend on each other, so load them all at once
+    urls = [common.HN_NEWS_URL + '?p={}'.format(page_num) for page_num in page_nums]
+    pages = await asyncio.gather(*[pipeline.load(url) for url in urls])
+    return Pages(list(pages))
@@ -0,0 +1 @@
+"""Benchmarks and budget checks for rich-hn, run with `python -m benchmarks.<name>`."""
@@ -0,0 +1,139 @@
+"""Check that every Item extracted from overlapping Pages is interned as one live object.
+
+Run with `python -m benchmarks.interning`. A post is extracted next to
+the page of one of its comments and the news page linking to it (from
+the saved fixtures), and a synthetic thread is extracted twice, the
+second time with its comments edited and its first comment deleted.
+Every comment and post on more than one of those Pages must be the very
+same Item on each of them, carrying exactly the content it was last
+extracted with (looking up ranks on a news page mustn't change it), each
+Page must keep its own comments, and once the Pages are dropped none of
+their Items may be left in the shared ItemDB, or the check exits
+non-zero.
+"""
+from typing import Dict, List
+import gc
+import os
+import sys
+
+import items
+from items import Item
+from itemdb import item_db
+from page import Page, NewsPage, extract_page, extract_ranks
+from benchmarks.suite import FIXTURES_PATH, get_fixture_item_json
+from benchmarks.synthetic import post_page, thread_pages
+
+SYNTHETIC_POST_ID = 7
+SYNTHETIC_COMMENTS = 2000
+# threads extracted and then dropped, and the comments in each
+DROPPED_THREADS = 5
+DROPPED_COMMENTS = 500
+
+def read_fixture(filename: str) -> Page:
+    with open(os.path.join(FIXTURES_PATH, filename)) as f:
+        return extract_page(f.read())
+
+def page_items(pg: Page) -> Dict[int, List[Item]]:
+    """Get every Item on a Page by ID, including those only there as the ancestors of comments."""
+    found: Dict[int, List[Item]] = {}
+    if isinstance(pg, NewsPage):
+        for item_id, item in pg.items.items():
+            found.setdefault(item_id, []).append(item)
+        return found
+    found.setdefault(pg.item.get_id(), []).append(pg.item)
+    for lineage in (pg.comments or {}).values():
+        for item_id, item in lineage:
+            found.setdefault(item_id, []).append(item)
+    return found
+
+def check_identity(pgs: List[Page]) -> List[int]:
+    """Get the IDs of the Items that aren't the same object everywhere they're found, and aren't the live one."""
+    found: Dict[int, List[Item]] = {}
+    for pg in pgs:
+        for item_id, copies in page_items(pg).items():
+            found.setdefault(item_id, []).extend(copies)
+    return sorted(item_id for item_id, copies in found.items()
+        if any(item is not item_db.get_item(item_id) for item in copies))
+
+def delete_comment(html: str, comment_id: int) -> str:
+    """Get the HTML of a page with a comment deleted, as HN shows it (no user and no text)."""
+    start = html.index('id="{}"'.format(comment_id))
+    end = html.index('</td></tr></table></td></tr>', start)
+    row = html[start:end]
+    user_start = row.index('<a href="user?id=')
+    row = row[:user_start] + row[row.index('</a>', user_start) + len('</a>'):]
+    row = row[:row.index('<span class="commtext')] + '<span></span>' + row[row.index('<div class="reply">'):]
+    return html[:start] + row + html[end:]
+
+def main() -> int:
+    # polls on the news page are typed through the API, so read their
+    # JSON from the fixtures rather than the network
+    items.get_item_json_by_id = get_fixture_item_json
+    failures = []
+
+    post = read_fixture('item_link_post.html')
+    comment = read_fixture('comment_page.html')
+    news = read_fixture('news.html')
+    shared = (set(page_items(post)) & set(page_items(comment))) | (set(page_items(post)) & set(page_items(news)))
+    mismatched = check_identity([post, comment, news])
+    print('fixtures: {} Items on more than one Page, {} not interned'.format(len(shared), len(mismatched)))
+    if not shared or mismatched:
+        failures.append('fixtures')
+
+    # looking up a post by rank only reads part of each news Item, which
+    # mustn't take anything away from the live Items
+    before = {item_id: dict(item.get_content()) for item_id, item in news.items.items()}
+    with open(os.path.join(FIXTURES_PATH, 'news.html')) as f:
+        extract_ranks(f.read())
+    changed = [item_id for item_id, item in news.items.items() if item.get_content() != before[item_id]]
+    print('ranks: {} news Items changed by looking up ranks'.format(len(changed)))
+    if changed:
+        failures.append('ranks')
+
+    first = extract_page(post_page(SYNTHETIC_POST_ID, SYNTHETIC_COMMENTS, seed=0))
+    # the same comments, with different text, and the first one deleted
+    deleted_id = next(iter(first.comments))
+    second_html = post_page(SYNTHETIC_POST_ID, SYNTHETIC_COMMENTS, seed=1)
+    second_text = {comment_id: lineage[-1][1].get_text()
+        for comment_id, lineage in extract_page(second_html).comments.items()}
+    second = extract_page(delete_comment(second_html, deleted_id))
+    mismatched = check_identity([first, second])
+    deleted = first.comments[deleted_id][-1][1]
+    stale = [comment_id for comment_id, lineage in first.comments.items()
+        if comment_id != deleted_id and lineage[-1][1].get_text() != second_text[comment_id]]
+    if deleted.get_text() is not None or deleted.get_user() is not None:
+        stale.append(deleted_id)
+    print('synthetic: {} comments extracted twice, {} not interned, {} not updated in place'.format(
+        len(second.comments), len(mismatched), len(stale)))
+    if mismatched or stale:
+        failures.append('synthetic')
+
+    # every Page of a thread keeps its own comments, rather than those of
+    # the Page extracted last
+    thread = [extract_page(html) for html in thread_pages(SYNTHETIC_POST_ID + 1, 600)]
+    mixed = [pg.pg_number for pg in thread if set(pg.comments) & set().union(
+        *(other.comments for other in thread if other is not pg))]
+    shared_post = all(pg.item is thread[0].item for pg in thread) and thread[0].item.get_kids() is None
+    print('thread: {} Pages, {} with comments of other Pages'.format(len(thread), len(mixed)))
+    if mixed or not shared_post:
+        failures.append('thread')
+
+    # nothing but the Pages keeps their Items alive
+    dropped = [extract_page(post_page(SYNTHETIC_POST_ID + 2 + n, DROPPED_COMMENTS, seed=n))
+        for n in range(DROPPED_THREADS)]
+    dropped_ids = set().union(*(page_items(pg) for pg in dropped))
+    del dropped
+    gc.collect()
+    left = [item_id for item_id in dropped_ids if item_db.get_item(item_id) is not None]
+    print('dropped: {} Items on {} dropped Pages, {} still live'.format(len(dropped_ids), DROPPED_THREADS, len(left)))
+    if left:
+        failures.append('dropped')
+
+    if failures:
+        print('FAIL: Items on overlapping Pages aren\'t interned ({})'.format(', '.join(failures)))
+        return 1
+    print('OK: every Item on overlapping Pages is one live object')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
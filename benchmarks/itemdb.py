@@ -0,0 +1,105 @@
+"""Stress test of many threads ingesting overlapping Items into an ItemDB.
+
+Run with `python -m benchmarks.itemdb`. Every thread adds a version of
+the same set of Items, each with a 'kids' dict holding a key of its own,
+so an insert or update lost to a race shows up as a missing key. The
+throughput of add_item and of the batched add_all_items is reported for
+each number of threads, and the check exits non-zero if anything was lost.
+"""
+from typing import List, Tuple
+import argparse
+import sys
+import threading
+import time
+
+from itemdb import ItemDB
+from items import Item
+
+DEFAULT_THREADS = '1,2,4,8,16'
+DEFAULT_ITEMS = 20000
+# every Item is added by this many of the threads
+DEFAULT_OVERLAP = 4
+BATCH_SIZE = 250
+# seconds between thread switches, far shorter than the interpreter's
+# default so that races between writers actually happen
+SWITCH_INTERVAL = 1e-6
+
+def make_items(thread_num: int, num_items: int, num_threads: int, overlap: int) -> List[Item]:
+    """Get the Items a thread adds, which overlap with those of the next overlap - 1 threads."""
+    items = []
+    for item_id in range(num_items):
+        # each Item goes to overlap consecutive threads, starting from
+        # a thread picked by its ID
+        if (thread_num - item_id) % num_threads < overlap:
+            items.append(Item(item_id, content={
+                'score': thread_num,
+                'kids': {(item_id, thread_num): thread_num},
+            }))
+    return items
+
+def ingest(db: ItemDB, items: List[Item], batched: bool):
+    if batched:
+        for start in range(0, len(items), BATCH_SIZE):
+            db.add_all_items(items[start:start + BATCH_SIZE])
+    else:
+        for item in items:
+            db.add_item(item)
+
+def check(db: ItemDB, num_items: int, num_threads: int, overlap: int) -> int:
+    """Return the number of Items missing from db, or missing an update."""
+    lost = 0
+    for item_id in range(num_items):
+        item = db.get_item(item_id)
+        expected = {(item_id, t) for t in range(num_threads) if (t - item_id) % num_threads < min(overlap, num_threads)}
+        if item is None or set(item.content['kids']) != expected:
+            lost += 1
+    return lost
+
+def run(num_threads: int, num_items: int, overlap: int, batched: bool) -> Tuple[float, int]:
+    """Ingest from num_threads threads at once, returning the Items added per second and the number lost."""
+    db = ItemDB()
+    per_thread = [make_items(t, num_items, num_threads, overlap) for t in range(num_threads)]
+    barrier = threading.Barrier(num_threads + 1)
+
+    def worker(items: List[Item]):
+        barrier.wait()
+        ingest(db, items, batched)
+
+    threads = [threading.Thread(target=worker, args=(items,)) for items in per_thread]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    added = sum(len(items) for items in per_thread)
+    return added / elapsed, check(db, num_items, num_threads, overlap)
+
+def parse_args(args=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Stress test concurrent ingestion into an ItemDB.')
+    parser.add_argument('--threads', default=DEFAULT_THREADS, help='comma separated numbers of threads')
+    parser.add_argument('--items', type=int, default=DEFAULT_ITEMS, help='number of distinct Items')
+    parser.add_argument('--overlap', type=int, default=DEFAULT_OVERLAP, help='number of threads adding each Item')
+    return parser.parse_args(args)
+
+def main(args=None) -> int:
+    args = parse_args(args)
+    sys.setswitchinterval(SWITCH_INTERVAL)
+    lost_total = 0
+    print('{:>8} {:>22} {:>22} {:>8}'.format('threads', 'add_item (items/s)', 'add_all_items (items/s)', 'lost'))
+    for num_threads in [int(n) for n in args.threads.split(',') if n]:
+        single_rate, single_lost = run(num_threads, args.items, args.overlap, batched=False)
+        batch_rate, batch_lost = run(num_threads, args.items, args.overlap, batched=True)
+        lost_total += single_lost + batch_lost
+        print('{:>8} {:>22.0f} {:>22.0f} {:>8}'.format(num_threads, single_rate, batch_rate,
+            single_lost + batch_lost))
+
+    if lost_total:
+        print('FAIL: {} Items lost an insert or update'.format(lost_total))
+        return 1
+    print('OK: no Items lost an insert or update')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""End-to-end load test of fetching pages from a local stand-in for HN.
+
+Run with `python -m benchmarks.loadtest --latency 0.1 --workers 8`. The
+stand-in server from benchmarks.server is started on a free port, and
+get_post_pages_by_id and get_news_pages_by_num are pointed at it, so the
+numbers include real HTTP round trips with the injected latency.
+"""
+from typing import Callable, Dict, List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+
+import common
+import async_pages
+import pages
+from scheduler import scheduler
+from benchmarks.server import StandInHN, DEFAULT_THREAD_COMMENTS
+from benchmarks.suite import get_git_revision
+
+# a saved item page, and synthetic threads that span several pages
+FIXTURE_POST_ID = 26235118
+SYNTHETIC_POST_IDS = [1, 2, 3, 4]
+NEWS_PAGE_NUMS = [1, 2, 3]
+DEFAULT_DURATION = 5.0
+DEFAULT_WORKERS = 4
+
+def time_to_first_page(fn: Callable) -> float:
+    """Return the time, in seconds, until fn has a Pages object ready to read."""
+    start = time.perf_counter()
+    pgs = fn()
+    pgs.get_current_page()
+    elapsed = time.perf_counter() - start
+    if isinstance(pgs, pages.LazyPages):
+        pgs.close()
+    return elapsed
+
+def run_load(name: str, fn: Callable, stand_in: StandInHN, workers: int, duration: float) -> Dict:
+    """Call fn from workers threads for duration seconds, returning the throughput."""
+    deadline = time.perf_counter() + duration
+    requests_before = stand_in.request_count
+
+    def worker() -> List[int]:
+        calls = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                fn()
+                calls += 1
+            except Exception:
+                # i.e. an injected error page that couldn't be extracted
+                errors += 1
+        return [calls, errors]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        counts = list(executor.map(lambda _: worker(), range(workers)))
+    elapsed = time.perf_counter() - start
+    calls = sum(c for c, _ in counts)
+    errors = sum(e for _, e in counts)
+    http_requests = stand_in.request_count - requests_before
+    return OrderedDict([
+        ('name', name),
+        ('workers', workers),
+        ('seconds', elapsed),
+        ('calls', calls),
+        ('errors', errors),
+        ('calls_per_sec', calls / elapsed),
+        ('requests', http_requests),
+        ('requests_per_sec', http_requests / elapsed),
+    ])
+
+def run_async_load(name: str, stand_in: StandInHN, concurrency: int, duration: float) -> Dict:
+    """Load threads concurrently on a single event loop for duration seconds, returning the throughput."""
+    async def load() -> int:
+        calls = 0
+        deadline = time.perf_counter() + duration
+        async with async_pages.PagePipeline() as pipeline:
+            while time.perf_counter() < deadline:
+                await asyncio.gather(*[async_pages.get_post_pages_by_id(SYNTHETIC_POST_IDS[i % len(SYNTHETIC_POST_IDS)],
+                    pipeline) for i in range(concurrency)])
+                calls += concurrency
+        return calls
+
+    requests_before = stand_in.request_count
+    start = time.perf_counter()
+    calls = asyncio.run(load())
+    elapsed = time.perf_counter() - start
+    http_requests = stand_in.request_count - requests_before
+    return OrderedDict([
+        ('name', name),
+        ('workers', concurrency),
+        ('seconds', elapsed),
+        ('calls', calls),
+        ('errors', 0),
+        ('calls_per_sec', calls / elapsed),
+        ('requests', http_requests),
+        ('requests_per_sec', http_requests / elapsed),
+    ])
+
+def parse_args(args=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Load test fetching pages from a local stand-in for HN.')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='seconds the latency varies by, either way')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail with a 503')
+    parser.add_argument('--rate-limit', type=float, default=None, help='requests per second before responding with 429s')
+    parser.add_argument('--thread-comments', type=int, default=DEFAULT_THREAD_COMMENTS,
+        help='number of comments on each synthetic thread')
+    parser.add_argument('--client-rate', type=float, default=None,
+        help='requests per second the app itself is limited to (unlimited by default)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='number of concurrent readers')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+        help='seconds to run each throughput test for')
+    parser.add_argument('--out', default='loadtest_results.json', help='where to write the JSON results')
+    return parser.parse_args(args)
+
+def main(args=None) -> int:
+    args = parse_args(args)
+    stand_in = StandInHN(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, thread_comments=args.thread_comments)
+    results = OrderedDict([('time_to_first_page', OrderedDict()), ('throughput', [])])
+    with stand_in:
+        common.set_base_urls(stand_in.base_url, stand_in.api_base_url)
+        scheduler.configure(rate=args.client_rate)
+        print('Stand-in for HN at {} ({:.0f} ms latency, {} comments per synthetic thread)\n'.format(
+            stand_in.base_url, args.latency * 1000, args.thread_comments))
+
+        # warm up the server's cache of synthetic threads so it isn't timed
+        for post_id in SYNTHETIC_POST_IDS:
+            stand_in.get_item_html(post_id, 1)
+
+        print('{:<45} {:>12}'.format('time to first page', 'time (ms)'))
+        first_page_cases = [
+            ('get_post_pages_by_id[fixture]', lambda: pages.get_post_pages_by_id(FIXTURE_POST_ID)),
+            ('get_post_pages_by_id[synthetic]', lambda: pages.get_post_pages_by_id(SYNTHETIC_POST_IDS[0])),
+            ('get_post_pages_by_id[synthetic, lazy]',
+                lambda: pages.get_post_pages_by_id(SYNTHETIC_POST_IDS[0], lazy=True)),
+            ('get_news_pages_by_num[1]', lambda: pages.get_news_pages_by_num([1])),
+        ]
+        for name, fn in first_page_cases:
+            elapsed = time_to_first_page(fn)
+            results['time_to_first_page'][name] = elapsed
+            print('{:<45} {:>12.1f}'.format(name, elapsed * 1000))
+
+        print('\n{:<45} {:>10} {:>10} {:>12} {:>8}'.format('throughput', 'calls/s', 'reqs/s', 'requests', 'errors'))
+        n = [0]
+        def next_post_pages():
+            n[0] += 1
+            return pages.get_post_pages_by_id(SYNTHETIC_POST_IDS[n[0] % len(SYNTHETIC_POST_IDS)])
+        throughput_cases = [
+            ('get_post_pages_by_id', next_post_pages),
+            ('get_news_pages_by_num', lambda: pages.get_news_pages_by_num(NEWS_PAGE_NUMS)),
+        ]
+        for name, fn in throughput_cases:
+            r = run_load(name, fn, stand_in, args.workers, args.duration)
+            results['throughput'].append(r)
+            print('{:<45} {:>10.2f} {:>10.2f} {:>12} {:>8}'.format(name, r['calls_per_sec'],
+                r['requests_per_sec'], r['requests'], r['errors']))
+        # the same number of concurrent thread loads, on one event loop
+        r = run_async_load('async_pages.get_post_pages_by_id', stand_in, args.workers, args.duration)
+        results['throughput'].append(r)
+        print('{:<45} {:>10.2f} {:>10.2f} {:>12} {:>8}'.format(r['name'], r['calls_per_sec'],
+            r['requests_per_sec'], r['requests'], r['errors']))
+        status_counts = dict(stand_in.status_counts)
+
+    output = OrderedDict([
+        ('meta', OrderedDict([
+            ('revision', get_git_revision()),
+            ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('latency', args.latency),
+            ('jitter', args.jitter),
+            ('error_rate', args.error_rate),
+            ('rate_limit', args.rate_limit),
+            ('client_rate', args.client_rate),
+            ('requests_coalesced', scheduler.requests_coalesced),
+            ('thread_comments', args.thread_comments),
+            ('status_counts', status_counts),
+        ])),
+        ('results', results),
+    ])
+    with open(args.out, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('\nSaved results at: {}'.format(args.out))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""Check that the memory used to extract a page stays within budget.
+
+Run with `python -m benchmarks.memory`; exits with a non-zero status if
+any budget is exceeded.
+"""
+from typing import Tuple
+import gc
+import sys
+import tracemalloc
+
+from page import extract_page
+from benchmarks.synthetic import post_page
+
+# budgets are relative to the size of the HTML of the page being extracted,
+# plus a fixed allowance so small pages aren't dominated by noise: the peak
+# covers everything allocated while extracting, and the retained memory is
+# whatever is still held by the Page afterwards. Once the Page is dropped,
+# no more than the fixed allowance may be left (i.e. by the Items interned
+# from it).
+PEAK_BUDGET = 6.0
+RETAINED_BUDGET = 2.0
+ALLOWANCE = 256 * 1024
+
+COMMENT_COUNTS = [10, 100, 500, 2000]
+
+def measure_extraction(html: str) -> Tuple[int, int, int]:
+    """Return the peak and retained memory, in bytes, of extracting a page, and what's left once it's dropped."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        pg = extract_page(html)
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        del pg
+        gc.collect()
+        left = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return peak - base, retained - base, left - base
+
+def main() -> int:
+    # extract a page once up front so one-time costs (imports, compiled
+    # regexes, etc.) aren't counted against the first page
+    extract_page(post_page(1, 1))
+
+    failures = 0
+    print('{:>9} {:>10} {:>10} {:>7} {:>10} {:>7} {:>10}'.format(
+        'comments', 'html', 'peak', 'ratio', 'retained', 'ratio', 'left'))
+    for num_comments in COMMENT_COUNTS:
+        html = post_page(1, num_comments)
+        peak, retained, left = measure_extraction(html)
+        peak_ratio = peak / len(html)
+        retained_ratio = retained / len(html)
+        print('{:>9} {:>10} {:>10} {:>7.2f} {:>10} {:>7.2f} {:>10}'.format(
+            num_comments, len(html), peak, peak_ratio, retained, retained_ratio, left))
+        if peak > PEAK_BUDGET * len(html) + ALLOWANCE or \
+            retained > RETAINED_BUDGET * len(html) + ALLOWANCE or left > ALLOWANCE:
+            failures += 1
+    if failures:
+        print('{} page(s) went over the memory budget (peak {}x, retained {}x, left {} bytes)'.format(
+            failures, PEAK_BUDGET, RETAINED_BUDGET, ALLOWANCE))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""Benchmark extracting news pages, run with `python -m benchmarks.news`."""
+from typing import Callable
+import sys
+import timeit
+
+from page import extract_page, extract_news_page, extract_ranks
+from benchmarks.synthetic import news_page
+
+import bs4
+
+# a regular news page, and a synthetic one with 100x as many items
+ITEM_COUNTS = [30, 3000]
+REPEATS = 5
+
+def best_of(fn: Callable, number: int) -> float:
+    """Return the best time, in seconds, of a single call of fn."""
+    return min(timeit.repeat(fn, number=number, repeat=REPEATS)) / number
+
+def main() -> int:
+    print('{:>6} {:>12} {:>12} {:>12} {:>12}'.format(
+        'items', 'soup (ms)', 'engine (ms)', 'ranks (ms)', 'page (ms)'))
+    for num_items in ITEM_COUNTS:
+        html = news_page(num_items)
+        soup = bs4.BeautifulSoup(html, 'html.parser')
+        itemlist_table = soup.find('table', attrs={'class': 'itemlist'})
+        # keep the number of calls per timing roughly the same amount of work
+        number = max(1, 300 // num_items)
+
+        soup_time = best_of(lambda: bs4.BeautifulSoup(html, 'html.parser').decompose(), number)
+        engine_time = best_of(lambda: extract_news_page(itemlist_table), number)
+        ranks_time = best_of(lambda: extract_ranks(itemlist_table), number)
+        page_time = best_of(lambda: extract_page(html), number)
+        print('{:>6} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}'.format(num_items,
+            soup_time * 1000, engine_time * 1000, ranks_time * 1000, page_time * 1000))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Benchmark of rendering very large threads on a pool of processes, against rendering them serially.
+
+Run with `python -m benchmarks.render`. For each thread size, a synthetic
+thread split over pages of 250 comments (so 5000 comments is a 20 page
+Pages object) is rendered with Pages.render and with a ParallelRenderer,
+and both times are reported. The parallel render must give exactly the
+text of the serial one, or the check exits non-zero.
+"""
+import argparse
+import sys
+import time
+
+from page import extract_page
+from pages import Pages
+from parallel_render import ParallelRenderer, DEFAULT_CHUNK_SIZE
+from benchmarks.synthetic import thread_pages
+
+DEFAULT_SIZES = '1000,5000,20000'
+DEFAULT_DEPTH = 8
+WIDTH = 80
+
+def run(pgs: Pages, renderer: ParallelRenderer) -> bool:
+    start = time.perf_counter()
+    serial = pgs.render(WIDTH)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = renderer.render(pgs, WIDTH)
+    parallel_time = time.perf_counter() - start
+
+    num_comments = sum(len(pg.comments or {}) for pg in pgs.pages)
+    print('{:>8} {:>6} {:>12.1f} {:>14.1f} {:>8.2f}x'.format(num_comments, len(pgs.pages),
+        serial_time * 1000, parallel_time * 1000, serial_time / parallel_time))
+    return parallel == serial
+
+def parse_args(args=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark rendering large threads on a pool of processes.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma separated numbers of comments')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help='deepest level of nesting')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (defaults to one per CPU)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='comments per chunk')
+    return parser.parse_args(args)
+
+def main(args=None) -> int:
+    args = parse_args(args)
+    mismatched = []
+    # every size goes through the pool, however small
+    with ParallelRenderer(args.workers, args.chunk_size, min_comments=0) as renderer:
+        start = time.perf_counter()
+        renderer.start()
+        print('started {} worker(s) in {:.1f} ms'.format(renderer.workers, (time.perf_counter() - start) * 1000))
+        print('{:>8} {:>6} {:>12} {:>14} {:>9}'.format('comments', 'pages', 'serial (ms)', 'parallel (ms)',
+            'speedup'))
+        for size in [int(n) for n in args.sizes.split(',') if n]:
+            pgs = Pages([extract_page(html) for html in thread_pages(1, size, args.depth)])
+            if not run(pgs, renderer):
+                mismatched.append(size)
+
+    if mismatched:
+        print('FAIL: rendering in parallel differs from rendering serially for {} comments'.format(mismatched))
+        return 1
+    print('OK: rendering in parallel matches rendering serially')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
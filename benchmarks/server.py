@@ -0,0 +1,233 @@
+"""A local stand-in for HN and the HN API, with injected latency, errors and rate limiting.
+
+Run it on its own with `python -m benchmarks.server --port 8000 --latency 0.2`,
+then point the reader at it:
+
+    RICH_HN_BASE_URL=http://127.0.0.1:8000/ RICH_HN_API_BASE_URL=http://127.0.0.1:8000/v0/ python mvp.py
+"""
+from typing import Dict, List
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import argparse
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from benchmarks.synthetic import news_page, post_page, thread_pages
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURES_API_PATH = os.path.join(FIXTURES_PATH, 'api')
+
+# how many comments the synthetic threads served for unknown item IDs have
+DEFAULT_THREAD_COMMENTS = 500
+NEWS_PAGES = 20
+FIXTURE_SECOND_PAGE_COMMENTS = 50
+
+API_ITEM_PATH = re.compile(r'^/v0/item/(\d+)\.json$')
+
+def load_item_fixtures() -> Dict[int, str]:
+    """Load the HTML of every saved item page, by the ID of its main item."""
+    fixtures = {}
+    for filename in sorted(os.listdir(FIXTURES_PATH)):
+        if filename.endswith('.html') and not filename.startswith('news'):
+            with open(os.path.join(FIXTURES_PATH, filename)) as f:
+                html = f.read()
+            # the first 'athing' on an item page is its main item
+            match = re.search(r"class='athing' id='(\d+)'", html)
+            fixtures[int(match.group(1))] = html
+    return fixtures
+
+class StandInHN(object):
+    """Serves saved and synthetic HN pages and API data over HTTP."""
+    # seconds added to every response, give or take up to jitter seconds
+    latency: float = None
+    jitter: float = None
+    # fraction of requests that fail with a 503
+    error_rate: float = None
+    # requests per second allowed before responding with a 429, or None
+    rate_limit: float = None
+    thread_comments: int = None
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+        jitter: float = 0.0, error_rate: float = 0.0, rate_limit: float = None,
+        thread_comments: int = DEFAULT_THREAD_COMMENTS, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.thread_comments = thread_comments
+        self.status_counts = Counter()
+        self.bytes_sent = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent_requests = deque()
+        self._item_fixtures = load_item_fixtures()
+        with open(os.path.join(FIXTURES_PATH, 'news.html')) as f:
+            self._news_fixture = f.read()
+
+        self._httpd = ThreadingHTTPServer((host, port), StandInHNHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stand_in = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        """The URL to use in place of HN's."""
+        host, port = self._httpd.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    @property
+    def api_base_url(self) -> str:
+        """The URL to use in place of the HN API's."""
+        return self.base_url + 'v0/'
+
+    @property
+    def request_count(self) -> int:
+        """The number of requests served so far."""
+        return sum(self.status_counts.values())
+
+    def start(self):
+        """Start serving requests on a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def admit(self) -> int:
+        """Decide whether to serve a request, returning the status code to respond with."""
+        with self._lock:
+            now = time.monotonic()
+            if self.rate_limit is not None:
+                # allow at most rate_limit requests in any one second window
+                while self._recent_requests and now - self._recent_requests[0] > 1.0:
+                    self._recent_requests.popleft()
+                if len(self._recent_requests) >= self.rate_limit:
+                    return 429
+                self._recent_requests.append(now)
+            if self._rng.random() < self.error_rate:
+                return 503
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        time.sleep(delay)
+        return 200
+
+    def record(self, status: int, num_bytes: int):
+        """Record that a response was sent."""
+        with self._lock:
+            self.status_counts[status] += 1
+            self.bytes_sent += num_bytes
+
+    def get_news_html(self, pg_num: int) -> str:
+        """Get the HTML of a news page."""
+        if pg_num == 1:
+            return self._news_fixture
+        return news_page(30, pg_num=pg_num, has_next=pg_num < NEWS_PAGES, seed=pg_num)
+
+    def get_item_html(self, item_id: int, pg_num: int) -> str:
+        """Get the HTML of a page of an item, or None if there's no such page."""
+        if pg_num == 1 and item_id in self._item_fixtures:
+            return self._item_fixtures[item_id]
+        pages = self._get_thread_pages(item_id)
+        if pg_num <= len(pages):
+            return pages[pg_num - 1]
+        if pg_num == 2 and item_id in self._item_fixtures:
+            # saved pages can link to a second page, which has to be made
+            # up even when the synthetic threads only have the one page
+            return post_page(item_id, FIXTURE_SECOND_PAGE_COMMENTS, pg_num=pg_num, seed=item_id)
+        return None
+
+    def get_item_json(self, item_id: int) -> dict:
+        """Get the API data of an item."""
+        path = os.path.join(FIXTURES_API_PATH, '{}.json'.format(item_id))
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        return {'id': item_id, 'type': 'story', 'by': 'op', 'score': 120,
+            'title': 'Synthetic post {}'.format(item_id), 'descendants': self.thread_comments}
+
+    @functools.lru_cache(maxsize=64)
+    def _get_thread_pages(self, item_id: int) -> List[str]:
+        return thread_pages(item_id, self.thread_comments, seed=item_id)
+
+class StandInHNHandler(BaseHTTPRequestHandler):
+    """Handles requests to the stand-in HN server."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        status = stand_in.admit()
+        if status != 200:
+            self.respond(status, 'text/html; charset=utf-8', 'Sorry.')
+            return
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        pg_num = int(params.get('p', ['1'])[0])
+        api_match = API_ITEM_PATH.match(url.path)
+        if url.path == '/news':
+            self.respond(200, 'text/html; charset=utf-8', stand_in.get_news_html(pg_num))
+        elif url.path == '/item' and 'id' in params:
+            html = stand_in.get_item_html(int(params['id'][0]), pg_num)
+            if html is None:
+                self.respond(404, 'text/html; charset=utf-8', 'No such item.')
+            else:
+                self.respond(200, 'text/html; charset=utf-8', html)
+        elif api_match is not None:
+            data = stand_in.get_item_json(int(api_match.group(1)))
+            self.respond(200, 'application/json; charset=utf-8', json.dumps(data))
+        else:
+            self.respond(404, 'text/html; charset=utf-8', 'Unknown.')
+
+    def respond(self, status: int, content_type: str, body: str):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.stand_in.record(status, len(data))
+
+    def log_message(self, format, *args):
+        # keep the output of benchmarks readable
+        pass
+
+def parse_args(args=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for HN and the HN API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='seconds the latency varies by, either way')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail with a 503')
+    parser.add_argument('--rate-limit', type=float, default=None, help='requests per second before responding with 429s')
+    parser.add_argument('--thread-comments', type=int, default=DEFAULT_THREAD_COMMENTS,
+        help='number of comments on the synthetic threads served for unknown item IDs')
+    return parser.parse_args(args)
+
+def main(args=None):
+    args = parse_args(args)
+    stand_in = StandInHN(args.host, args.port, args.latency, args.jitter, args.error_rate,
+        args.rate_limit, args.thread_comments)
+    print('Serving a stand-in for HN at {} (API at {})'.format(stand_in.base_url, stand_in.api_base_url))
+    try:
+        stand_in._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stand_in._httpd.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Check that the reader starts up within its time budget.
+
+Run with `python -m benchmarks.startup`. Importing mvp is timed in fresh
+interpreters with `python -X importtime`, the same breakdown that's
+useful for finding out what to blame when the budget is exceeded, and
+the check fails if the best time is over budget or if any of the heavy
+dependencies only needed to fetch and parse pages are imported.
+"""
+from typing import Dict, Tuple
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# milliseconds importing mvp can take, at best, before the check fails
+DEFAULT_BUDGET_MS = 50.0
+RUNS = 5
+# modules that should only be imported once a page is fetched
+DEFERRED_MODULES = ('pages', 'page', 'items', 'stream', 'common', 'bs4', 'requests', 'colorama')
+
+def import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    """Import module in a fresh interpreter, returning the self and cumulative microseconds of each import."""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        capture_output=True, text=True, cwd=REPO_PATH, check=True)
+    times = {}
+    for line in out.stderr.splitlines():
+        # lines look like: "import time:   self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+def process_time(code: str) -> float:
+    """Return the wall clock time, in seconds, of running code in a fresh interpreter."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=REPO_PATH, check=True)
+    return time.perf_counter() - start
+
+def parse_args(args=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Check that the reader starts up within its time budget.')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+        help='milliseconds importing mvp can take at best')
+    parser.add_argument('--runs', type=int, default=RUNS, help='number of fresh interpreters to time')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to list')
+    return parser.parse_args(args)
+
+def main(args=None) -> int:
+    args = parse_args(args)
+    runs = [import_times('mvp') for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times['mvp'][1])
+    best_ms = best['mvp'][1] / 1000
+
+    print('Slowest imports (cumulative, best of {} runs):'.format(args.runs))
+    for name, (_, cumulative_us) in sorted(best.items(), key=lambda nt: nt[1][1], reverse=True)[:args.top]:
+        print('{:<40} {:>10.2f} ms'.format(name, cumulative_us / 1000))
+
+    bare = min(process_time('pass') for _ in range(args.runs))
+    full = min(process_time('import mvp') for _ in range(args.runs))
+    print('\nInterpreter startup: {:.1f} ms, with mvp imported: {:.1f} ms'.format(bare * 1000, full * 1000))
+
+    failed = False
+    deferred = [m for m in DEFERRED_MODULES if m in best]
+    if deferred:
+        print('FAIL: imported at startup, rather than on first fetch: {}'.format(', '.join(deferred)))
+        failed = True
+    status = 'FAIL' if best_ms > args.budget_ms else 'OK'
+    print('{}: importing mvp took {:.2f} ms (budget {:.0f} ms)'.format(status, best_ms, args.budget_ms))
+    return 1 if failed or status == 'FAIL' else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""Benchmark suite for extracting and rendering pages.
+
+Run with `python -m benchmarks.suite`. Every benchmark is run against the
+saved pages in benchmarks/fixtures and against synthetic threads, and the
+results are written as JSON so that runs can be compared with each other:
+
+    python -m benchmarks.suite --out before.json
+    python -m benchmarks.suite --out after.json --compare before.json
+"""
+from typing import Callable, Dict, List, Tuple
+from collections import OrderedDict
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import items
+from items import extract_comment_tree_ds, extract_lineage
+from page import extract_page, prettify_string
+from benchmarks.synthetic import thread_pages
+
+import bs4
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURES_API_PATH = os.path.join(FIXTURES_PATH, 'api')
+
+# how long, in seconds, each timing should take at minimum
+MIN_TIMING = 0.2
+REPEATS = 3
+
+DEFAULT_SIZES = '1000,10000'
+DEFAULT_DEPTH = 8
+# a benchmark has regressed if it got slower or uses more memory than this
+DEFAULT_THRESHOLD = 1.2
+
+def get_fixture_item_json(item_id: int) -> dict:
+    """Return the saved API JSON data of the item with the given ID."""
+    with open(os.path.join(FIXTURES_API_PATH, '{}.json'.format(item_id))) as f:
+        return json.load(f)
+
+def load_fixtures() -> Dict[str, str]:
+    """Load the HTML of every saved page, by name."""
+    fixtures = OrderedDict()
+    for filename in sorted(os.listdir(FIXTURES_PATH)):
+        if filename.endswith('.html'):
+            with open(os.path.join(FIXTURES_PATH, filename)) as f:
+                fixtures[filename[:-len('.html')]] = f.read()
+    return fixtures
+
+def best_time(fn: Callable) -> float:
+    """Return the best time, in seconds, of a single call of fn."""
+    start = time.perf_counter()
+    fn()
+    first = time.perf_counter() - start
+    # slow benchmarks (i.e. huge synthetic threads) are only run once
+    if first >= MIN_TIMING:
+        return first
+
+    number = max(1, int(MIN_TIMING / max(first, 1e-9)))
+    best = first
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def peak_memory(fn: Callable) -> int:
+    """Return the peak memory, in bytes, allocated during a single call of fn."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak - base
+
+def run_benchmark(name: str, fn: Callable, units: int, unit: str) -> Dict:
+    """Time fn and measure its peak memory, returning the result."""
+    seconds = best_time(fn)
+    peak = peak_memory(fn)
+    return OrderedDict([
+        ('name', name),
+        ('seconds', seconds),
+        ('ops_per_sec', 1 / seconds if seconds else None),
+        ('unit', unit),
+        ('units_per_sec', units / seconds if seconds else None),
+        ('peak_bytes', peak),
+    ])
+
+def page_benchmarks(label: str, html: str) -> List[Tuple[str, Callable, int, str]]:
+    """Get the benchmarks to run against the HTML of a single page."""
+    benchmarks = []
+    pg = extract_page(html)
+    comments = getattr(pg, 'comments', None) or {}
+    num_units = len(comments) if comments else len(getattr(pg, 'items', None) or {}) or 1
+    unit = 'comments' if comments else 'items'
+    benchmarks.append(('extract_page[{}]'.format(label), lambda: extract_page(html),
+        num_units, unit))
+
+    soup = bs4.BeautifulSoup(html, 'html.parser')
+    comment_tree_table = soup.find('table', attrs={'class' : 'comment-tree'})
+    if comment_tree_table is not None and comments:
+        comment_tree_ds = extract_comment_tree_ds(comment_tree_table)
+        main_item_id = pg.item.get_id()
+        benchmarks.append(('extract_comment_tree_ds[{}]'.format(label),
+            lambda: extract_comment_tree_ds(comment_tree_table), len(comments), 'comments'))
+        benchmarks.append(('extract_lineage[{}]'.format(label),
+            lambda: extract_lineage(main_item_id, comment_tree_ds), len(comments), 'comments'))
+
+        texts = [(lineage[-1][1].get_text(), '  ' * len(lineage)) for lineage in comments.values()]
+        benchmarks.append(('prettify_string[{}]'.format(label),
+            lambda: [prettify_string(text, ind) for text, ind in texts], len(texts), 'comments'))
+
+    benchmarks.append(('{}.__str__[{}]'.format(type(pg).__name__, label), lambda: str(pg),
+        num_units, unit))
+    return benchmarks
+
+def get_git_revision() -> str:
+    """Get the revision of the checked out code, if it can be found."""
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(FIXTURES_PATH))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results: List[Dict], previous: Dict, threshold: float) -> int:
+    """Print how results compare to a previous run, returning the number of regressions."""
+    previous_results = {r['name']: r for r in previous['results']}
+    regressions = 0
+    print('\nCompared with {} ({}):'.format(previous['meta'].get('revision'), previous['meta'].get('timestamp')))
+    print('{:<55} {:>10} {:>10}'.format('benchmark', 'time', 'peak'))
+    for r in results:
+        p = previous_results.get(r['name'], None)
+        if p is None:
+            continue
+        time_ratio = r['seconds'] / p['seconds']
+        peak_ratio = r['peak_bytes'] / p['peak_bytes'] if p['peak_bytes'] else 1.0
+        regressed = time_ratio > threshold or peak_ratio > threshold
+        regressions += regressed
+        print('{:<55} {:>9.2f}x {:>9.2f}x{}'.format(r['name'], time_ratio, peak_ratio,
+            '  REGRESSED' if regressed else ''))
+    return regressions
+
+def parse_args(args=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark extracting and rendering pages.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+        help='comma separated sizes, in comments, of the synthetic threads (up to 50000)')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH,
+        help='maximum depth of the comment trees of the synthetic threads')
+    parser.add_argument('--filter', default=None, help='only run benchmarks whose name matches this regex')
+    parser.add_argument('--out', default='bench_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', default=None, metavar='PATH',
+        help='compare against the JSON results of a previous run, exiting non-zero on regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+        help='ratio over the previous run at which a benchmark counts as regressed')
+    return parser.parse_args(args)
+
+def main(args=None) -> int:
+    args = parse_args(args)
+    # the benchmarks run offline, so serve API requests (i.e. resolving
+    # the type of polls) from the saved JSON data instead
+    items.get_item_json_by_id = get_fixture_item_json
+
+    inputs = list(load_fixtures().items())
+    for size in [int(s) for s in args.sizes.split(',') if s]:
+        # a single page holding the whole thread, rather than HN's usual
+        # pages, so the benchmarks show how each stage scales
+        html = thread_pages(1, size, max_depth=args.depth, comments_per_page=size)[0]
+        inputs.append(('synthetic-{}'.format(size), html))
+
+    results = []
+    print('{:<55} {:>12} {:>22} {:>12}'.format('benchmark', 'time (ms)', 'throughput', 'peak (KiB)'))
+    for label, html in inputs:
+        for name, fn, units, unit in page_benchmarks(label, html):
+            if args.filter is not None and re.search(args.filter, name) is None:
+                continue
+            r = run_benchmark(name, fn, units, unit)
+            results.append(r)
+            print('{:<55} {:>12.3f} {:>22} {:>12.1f}'.format(name, r['seconds'] * 1000,
+                '{:.0f} {}/s'.format(r['units_per_sec'], unit), r['peak_bytes'] / 1024))
+
+    output = OrderedDict([
+        ('meta', OrderedDict([
+            ('revision', get_git_revision()),
+            ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('bs4', bs4.__version__),
+            ('sizes', args.sizes),
+            ('depth', args.depth),
+        ])),
+        ('results', results),
+    ])
+    with open(args.out, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('\nSaved results at: {}'.format(args.out))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(results, previous, args.threshold):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
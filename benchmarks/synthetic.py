@@ -0,0 +1,129 @@
+"""Generators for synthetic HN pages, laid out like the HTML served by HN."""
+from typing import List
+import random
+
+# HN indents each level of a comment tree by this many pixels
+INDENT_WIDTH = 40
+# roughly how many comments HN puts on each page of a thread
+COMMENTS_PER_PAGE = 250
+
+def page_top() -> str:
+    """Get the HTML of the header shared by every page on HN."""
+    return ('<html><head><title>Hacker News</title></head><body><center><table id="hnmain">'
+        '<tr><td bgcolor="#ff6600"><table><tr><td><span class="pagetop"><b class="hnname">'
+        '<a href="news">Hacker News</a></b> | <a href="newest">new</a></span></td></tr></table></td></tr>'
+        '<tr id="pagespace" title="" style="height:10px"></tr>')
+
+def page_bottom(more_href: str = None) -> str:
+    """Get the HTML of the footer shared by every page on HN."""
+    more = '<a href="{}" class="morelink" rel="next">More</a>'.format(more_href) if more_href else ''
+    return '{}</table></center></body></html>'.format(more)
+
+def comment_row(comment_id: int, depth: int, user: str, text: str) -> str:
+    """Get the HTML of a single row of a comment tree."""
+    return ('<tr class="athing comtr" id="{0}"><td><table border="0"><tr>'
+        '<td class="ind"><img src="s.gif" height="1" width="{1}"></td>'
+        '<td valign="top" class="votelinks"><center><a id="up_{0}" href="vote?id={0}&amp;how=up">'
+        '<div class="votearrow" title="upvote"></div></a></center></td>'
+        '<td class="default"><div style="margin-top:2px; margin-bottom:-10px;"><span class="comhead">'
+        '<a href="user?id={2}" class="hnuser">{2}</a> <span class="age"><a href="item?id={0}">1 hour ago</a></span> '
+        '<span id="unv_{0}"></span><span class="par"></span> <span class="storyon"></span></span></div><br>'
+        '<div class="comment"><span class="commtext c00">{3}</span>'
+        '<div class="reply"><p><font size="1"><u><a href="reply?id={0}">reply</a></u></font></div></div>'
+        '</td></tr></table></td></tr>\n').format(comment_id, depth * INDENT_WIDTH, user, text)
+
+def comment_text(comment_id: int, rng: random.Random) -> str:
+    """Get the text of a comment, with italics, a link and a second paragraph."""
+    words = ' '.join('word{}'.format(rng.randint(0, 999)) for _ in range(rng.randint(5, 60)))
+    return ('Comment {} says <i>hello</i> and links '
+        '<a href="https://example.com/x" rel="nofollow">https://example.com/x</a><p>{}').format(comment_id, words)
+
+def post_page(post_id: int, num_comments: int, max_depth: int = 4, pg_num: int = 1,
+    has_next: bool = False, seed: int = 0, first_comment: int = 0) -> str:
+    """Get the HTML of a page of a story post with a randomly shaped comment tree."""
+    rng = random.Random(seed)
+    s = page_top()
+    s += ('<tr><td><table class="fatitem" border="0">'
+        '<tr class="athing" id="{0}"><td align="right" valign="top" class="title"><span class="rank"></span></td>'
+        '<td valign="top" class="votelinks"><center><a id="up_{0}" href="vote?id={0}&amp;how=up">'
+        '<div class="votearrow"></div></a></center></td>'
+        '<td class="title"><a href="https://example.com/{0}" class="storylink">Synthetic post {0}</a>'
+        '<span class="sitebit comhead"> (<a href="from?site=example.com"><span class="sitestr">example.com</span></a>)</span></td></tr>'
+        '<tr><td colspan="2"></td><td class="subtext"><span class="score" id="score_{0}">120 points</span> by '
+        '<a href="user?id=op" class="hnuser">op</a> <span class="age"><a href="item?id={0}">3 hours ago</a></span> '
+        '<span id="unv_{0}"></span> | <a href="hide?id={0}">hide</a> | <a href="item?id={0}">{1}&nbsp;comments</a></td></tr>'
+        '<tr style="height:2px"></tr><tr><td colspan="2"></td><td><form method="post" action="comment">'
+        '<textarea name="text"></textarea></form></td></tr>'
+        '</table><br><br><table border="0" class="comment-tree">\n').format(post_id, num_comments)
+
+    # comments can be at most one level deeper than the comment before them
+    depth = 0
+    for n in range(num_comments):
+        comment_id = post_id * 100000 + first_comment + n + 1
+        user = 'user{}'.format(rng.randint(0, 500))
+        s += comment_row(comment_id, depth, user, comment_text(comment_id, rng))
+        depth = rng.randint(0, min(depth + 1, max_depth))
+    s += '</table></td></tr>'
+
+    more_href = 'item?id={}&amp;p={}'.format(post_id, pg_num + 1) if has_next else None
+    return s + page_bottom(more_href)
+
+def thread_pages(post_id: int, num_comments: int, max_depth: int = 4,
+    comments_per_page: int = COMMENTS_PER_PAGE, seed: int = 0) -> List[str]:
+    """Get the HTML of every page of a story post with num_comments comments in total."""
+    pages = []
+    for first_comment in range(0, max(num_comments, 1), comments_per_page):
+        count = min(comments_per_page, num_comments - first_comment)
+        pg_num = first_comment // comments_per_page + 1
+        has_next = first_comment + count < num_comments
+        pages.append(post_page(post_id, count, max_depth, pg_num, has_next, seed + pg_num, first_comment))
+    return pages
+
+def news_item_rows(item_id: int, rank: int, kind: str, num_comments: int, score: int) -> str:
+    """Get the HTML of the rows of a single item on a news page."""
+    votelinks = ('<td valign="top" class="votelinks"><center><a id="up_{0}" href="vote?id={0}&amp;how=up&amp;goto=news">'
+        '<div class="votearrow" title="upvote"></div></a></center></td>').format(item_id)
+    sitebit = ('<span class="sitebit comhead"> (<a href="from?site=example.com">'
+        '<span class="sitestr">example.com</span></a>)</span>')
+    if kind == 'job':
+        # jobs posts have no votelinks, score, user or comments
+        title = 'Synthetic Co. (YC S21) is hiring engineers'
+        s = ('<tr class="athing" id="{0}"><td align="right" valign="top" class="title"><span class="rank">{1}.</span></td>'
+            '<td></td><td class="title"><a href="https://example.com/jobs/{0}" class="storylink">{2}</a>{3}</td></tr>'
+            '<tr><td colspan="2"></td><td class="subtext"><span class="age"><a href="item?id={0}">2 hours ago</a></span> | '
+            '<a href="hide?id={0}&amp;goto=news">hide</a></td></tr>').format(item_id, rank, title, sitebit)
+    else:
+        if kind == 'ask':
+            # Ask HN posts link back to HN, so they don't have a sitebit
+            title, url, sitebit = 'Ask HN: Synthetic question {}?'.format(item_id), 'item?id={}'.format(item_id), ''
+        else:
+            title, url = 'Synthetic story {}'.format(item_id), 'https://example.com/{}'.format(item_id)
+        points = '{} point{}'.format(score, '' if score == 1 else 's')
+        if num_comments == 0:
+            comments = 'discuss'
+        else:
+            comments = '{}&nbsp;comment{}'.format(num_comments, '' if num_comments == 1 else 's')
+        s = ('<tr class="athing" id="{0}"><td align="right" valign="top" class="title"><span class="rank">{1}.</span></td>'
+            '{2}<td class="title"><a href="{3}" class="storylink">{4}</a>{5}</td></tr>'
+            '<tr><td colspan="2"></td><td class="subtext"><span class="score" id="score_{0}">{6}</span> by '
+            '<a href="user?id=poster{0}" class="hnuser">poster{0}</a> <span class="age"><a href="item?id={0}">2 hours ago</a></span> '
+            '<span id="unv_{0}"></span> | <a href="hide?id={0}&amp;goto=news">hide</a> | '
+            '<a href="https://hn.algolia.com/?query=synthetic&amp;type=story">past</a> | '
+            '<a href="item?id={0}">{7}</a></td></tr>').format(item_id, rank, votelinks, url, title, sitebit, points, comments)
+    return s + '<tr class="spacer" style="height:5px"></tr>\n'
+
+def news_page(num_items: int = 30, pg_num: int = 1, has_next: bool = True, seed: int = 0) -> str:
+    """Get the HTML of a news page with a mix of stories, Ask HNs and jobs posts."""
+    rng = random.Random(seed)
+    s = page_top()
+    s += '<tr><td><table border="0" cellpadding="0" cellspacing="0" class="itemlist">\n'
+    first_rank = (pg_num - 1) * num_items + 1
+    for n in range(num_items):
+        kind = rng.choice(['story'] * 8 + ['ask', 'job'])
+        s += news_item_rows(30000000 + first_rank + n, first_rank + n, kind,
+            rng.choice([0, 1, rng.randint(2, 900)]), rng.randint(1, 2000))
+    s += '<tr class="morespace" style="height:10px"></tr>'
+    if has_next:
+        s += ('<tr><td colspan="2"></td><td class="title"><a href="news?p={}" class="morelink" rel="next">More</a>'
+            '</td></tr>').format(pg_num + 1)
+    return s + '</table></td></tr>' + page_bottom()
@@ -0,0 +1,91 @@
+"""Benchmark of rendering windows of a thread with a Viewport, against rendering it whole.
+
+Run with `python -m benchmarks.viewport`. For each thread size, the time
+to render the first window, to scroll through the thread a window at a
+time, to jump to random lines and to resize is reported next to the
+time to render the whole Page. Reading the whole thread window by window
+must give exactly the lines of rendering it whole, or the check exits
+non-zero.
+"""
+from typing import List
+import argparse
+import random
+import sys
+import time
+
+from page import Page, extract_page
+from pages import Pages
+from viewport import Viewport
+from benchmarks.synthetic import post_page
+
+DEFAULT_SIZES = '100,1000,5000'
+DEFAULT_DEPTH = 6
+WIDTH = 80
+HEIGHT = 40
+JUMPS = 200
+
+def read_all(vp: Viewport) -> List[str]:
+    """Read every line of the current Page by scrolling a window at a time."""
+    lines = []
+    while True:
+        window = vp.render().split('\n')
+        lines[vp.top:] = window
+        if vp.top + vp.height >= vp.view.num_lines:
+            return lines
+        vp.scroll(vp.height)
+
+def run(pg: Page) -> bool:
+    start = time.perf_counter()
+    full = pg.render(WIDTH).split('\n')[:-1]
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vp = Viewport(Pages([pg]), WIDTH, HEIGHT)
+    vp.render()
+    first_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lines = read_all(vp)
+    windows = max(len(full) // HEIGHT, 1)
+    scroll_time = (time.perf_counter() - start) / windows
+
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(JUMPS):
+        vp.jump_to_line(rng.randrange(vp.view.num_lines))
+        vp.render()
+    jump_time = (time.perf_counter() - start) / JUMPS
+
+    start = time.perf_counter()
+    vp.resize(WIDTH // 2)
+    vp.render()
+    resize_time = time.perf_counter() - start
+
+    print('{:>8} {:>8} {:>12.2f} {:>12.3f} {:>12.3f} {:>12.3f} {:>12.2f}'.format(len(pg.comments or {}), len(full),
+        full_time * 1000, first_time * 1000, scroll_time * 1000, jump_time * 1000, resize_time * 1000))
+    return lines[:len(full)] == full
+
+def parse_args(args=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Benchmark rendering windows of threads with a Viewport.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='comma separated numbers of comments')
+    parser.add_argument('--depth', type=int, default=DEFAULT_DEPTH, help='deepest level of nesting')
+    return parser.parse_args(args)
+
+def main(args=None) -> int:
+    args = parse_args(args)
+    print('{:>8} {:>8} {:>12} {:>12} {:>12} {:>12} {:>12}'.format('comments', 'lines', 'whole (ms)',
+        'first (ms)', 'scroll (ms)', 'jump (ms)', 'resize (ms)'))
+    mismatched = []
+    for size in [int(n) for n in args.sizes.split(',') if n]:
+        pg = extract_page(post_page(1, size, args.depth))
+        if not run(pg):
+            mismatched.append(size)
+
+    if mismatched:
+        print('FAIL: reading window by window differs from rendering whole for {} comments'.format(mismatched))
+        return 1
+    print('OK: reading window by window matches rendering whole')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""Bookmarks, with tags and snapshots of the bookmarked threads, kept in SQLite.
+
+Each bookmark can have a snapshot of its thread, saved as an archive (see
+archive.py) next to the DB, so it can be reopened without fetching it.
+Snapshots that get stale are refreshed in the background, a few at a time.
+"""
+from typing import TYPE_CHECKING, List, Optional, Tuple
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+# archive and pages (and with them bs4) are only imported once a
+# snapshot is saved or opened, since bookmarks are set up at startup
+if TYPE_CHECKING:
+    import archive
+    import pages
+
+# bookmarks listed per page
+PAGE_SIZE = 20
+# seconds after which a snapshot is stale
+SNAPSHOT_MAX_AGE = 6 * 60 * 60
+# stale snapshots refreshed per batch, and seconds between batches
+REFRESH_BATCH_SIZE = 5
+REFRESH_INTERVAL = 10 * 60
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS bookmarks
+        (id integer UNIQUE, title text, url text, created real, snapshot_time real);
+    CREATE INDEX IF NOT EXISTS bookmarks_created ON bookmarks (created);
+    CREATE INDEX IF NOT EXISTS bookmarks_snapshot_time ON bookmarks (snapshot_time);
+    CREATE TABLE IF NOT EXISTS bookmark_tags
+        (tag text, id integer, PRIMARY KEY (tag, id));
+    CREATE INDEX IF NOT EXISTS bookmark_tags_id ON bookmark_tags (id);
+'''
+
+class Bookmark(object):
+    """A bookmarked post."""
+    item_id: int = None
+    title: str = None
+    url: str = None
+    created: float = None
+    snapshot_time: float = None
+    tags: List[str] = None
+
+    def __init__(self, item_id: int, title: str, url: str, created: float = None,
+        snapshot_time: float = None, tags: List[str] = None):
+        self.item_id = item_id
+        self.title = title
+        self.url = url
+        self.created = created
+        self.snapshot_time = snapshot_time
+        self.tags = tags if tags is not None else []
+
+    def __str__(self):
+        s = '{} || {} || {}'.format(self.item_id, self.title, self.url)
+        if self.created:
+            s += ' || saved {}'.format(time.strftime('%Y-%m-%d %H:%M', time.localtime(self.created)))
+        if self.tags:
+            s += ' || ' + ', '.join('#' + tag for tag in self.tags)
+        if self.snapshot_time is None:
+            s += ' || (no snapshot)'
+        return s
+
+class BookmarkStore(object):
+    """The bookmarks in the SQLite DB at path, and their snapshots in snapshots_path.
+
+    A store's connection can only be used from the thread that opened it,
+    so other threads open stores of their own on the same path.
+    """
+    path: str = None
+    snapshots_path: str = None
+
+    def __init__(self, path: str, snapshots_path: str = None):
+        self.path = path
+        self.snapshots_path = snapshots_path if snapshots_path is not None else \
+            os.path.join(os.path.dirname(path), 'snapshots')
+        if not os.path.exists(self.snapshots_path):
+            os.makedirs(self.snapshots_path, exist_ok=True)
+        self.con = sqlite3.connect(path)
+        self._migrate()
+
+    def _migrate(self):
+        # bookmarks from before timestamps and snapshots only have an ID,
+        # a title and a URL
+        columns = [row[1] for row in self.con.execute(''' PRAGMA table_info(bookmarks) ''')]
+        with self.con:
+            for column in ('created', 'snapshot_time'):
+                if columns and column not in columns:
+                    self.con.execute(''' ALTER TABLE bookmarks ADD COLUMN {} real '''.format(column))
+            self.con.executescript(SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def __contains__(self, item_id: int):
+        return self.con.execute(''' SELECT 1 FROM bookmarks WHERE id = ? ''', (item_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self.count()
+
+    def add(self, item_id: int, title: str, url: str, tags: List[str] = (), pgs: 'pages.Pages' = None) -> bool:
+        """Bookmark a post (with a snapshot of its Pages, if given), returning False if it already was."""
+        try:
+            with self.con:
+                self.con.execute(''' INSERT INTO bookmarks VALUES (?, ?, ?, ?, NULL) ''',
+                    (item_id, title, url, time.time()))
+        except sqlite3.IntegrityError:
+            return False
+        self.tag(item_id, tags)
+        if pgs is not None:
+            self.save_snapshot(item_id, pgs)
+        return True
+
+    def remove(self, item_id: int) -> bool:
+        """Delete a bookmark and its snapshot, returning False if there wasn't one."""
+        with self.con:
+            removed = self.con.execute(''' DELETE FROM bookmarks WHERE id = ? ''', (item_id,)).rowcount
+            self.con.execute(''' DELETE FROM bookmark_tags WHERE id = ? ''', (item_id,))
+        if os.path.exists(self.snapshot_path(item_id)):
+            os.remove(self.snapshot_path(item_id))
+        return removed > 0
+
+    def tag(self, item_id: int, tags: List[str]):
+        """Add tags to a bookmark."""
+        with self.con:
+            self.con.executemany(''' INSERT OR IGNORE INTO bookmark_tags VALUES (?, ?) ''',
+                [(tag, item_id) for tag in tags])
+
+    def get(self, item_id: int) -> Optional[Bookmark]:
+        row = self.con.execute(''' SELECT id, title, url, created, snapshot_time FROM bookmarks WHERE id = ? ''',
+            (item_id,)).fetchone()
+        return self._with_tags([row])[0] if row is not None else None
+
+    def count(self, tag: str = None) -> int:
+        """Get the number of bookmarks (with a tag, if given)."""
+        if tag is None:
+            return self.con.execute(''' SELECT count(*) FROM bookmarks ''').fetchone()[0]
+        return self.con.execute(''' SELECT count(*) FROM bookmark_tags WHERE tag = ? ''', (tag,)).fetchone()[0]
+
+    def page(self, page_num: int = 1, tag: str = None, page_size: int = PAGE_SIZE) -> List[Bookmark]:
+        """Get a page of bookmarks (with a tag, if given), newest first."""
+        offset = (page_num - 1) * page_size
+        if tag is None:
+            rows = self.con.execute(''' SELECT id, title, url, created, snapshot_time FROM bookmarks
+                ORDER BY created DESC, id DESC LIMIT ? OFFSET ? ''', (page_size, offset))
+        else:
+            rows = self.con.execute(''' SELECT b.id, b.title, b.url, b.created, b.snapshot_time
+                FROM bookmark_tags t JOIN bookmarks b ON b.id = t.id WHERE t.tag = ?
+                ORDER BY b.created DESC, b.id DESC LIMIT ? OFFSET ? ''', (tag, page_size, offset))
+        return self._with_tags(rows.fetchall())
+
+    def _with_tags(self, rows: List[Tuple]) -> List[Bookmark]:
+        bkmks = [Bookmark(*row) for row in rows]
+        if bkmks:
+            by_id = {bkmk.item_id: bkmk for bkmk in bkmks}
+            tag_rows = self.con.execute(''' SELECT id, tag FROM bookmark_tags WHERE id IN ({}) ORDER BY tag '''.format(
+                ','.join('?' * len(by_id))), list(by_id))
+            for item_id, tag in tag_rows:
+                by_id[item_id].tags.append(tag)
+        return bkmks
+
+    def snapshot_path(self, item_id: int) -> str:
+        import archive
+        return os.path.join(self.snapshots_path, '{}{}'.format(item_id, archive.ARCHIVE_SUFFIX))
+
+    def save_snapshot(self, item_id: int, pgs: 'pages.Pages'):
+        """Save the Pages of a bookmarked post as its snapshot, replacing any older one."""
+        import archive
+        path = self.snapshot_path(item_id)
+        # written alongside and then moved into place, so a snapshot
+        # being opened is never half-written. Each save gets a file of its
+        # own, since the refresher and the reader can save the same
+        # snapshot at once.
+        fd, tmp_path = tempfile.mkstemp(dir=self.snapshots_path, prefix='{}-'.format(item_id), suffix='.tmp')
+        os.close(fd)
+        try:
+            archive.save(pgs, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        with self.con:
+            self.con.execute(''' UPDATE bookmarks SET snapshot_time = ? WHERE id = ? ''', (time.time(), item_id))
+
+    def open_snapshot(self, item_id: int) -> Optional['archive.Archive']:
+        """Open the snapshot of a bookmarked post, or return None if it doesn't have one."""
+        import archive
+        path = self.snapshot_path(item_id)
+        return archive.Archive(path) if os.path.exists(path) else None
+
+    def stale(self, max_age: float = SNAPSHOT_MAX_AGE, limit: int = REFRESH_BATCH_SIZE) -> List[int]:
+        """Get the IDs of the bookmarks whose snapshots are missing or older than max_age, stalest first."""
+        rows = self.con.execute(''' SELECT id FROM bookmarks WHERE snapshot_time IS NULL OR snapshot_time < ?
+            ORDER BY snapshot_time IS NOT NULL, snapshot_time LIMIT ? ''', (time.time() - max_age, limit))
+        return [row[0] for row in rows]
+
+class SnapshotRefresher(object):
+    """Refreshes stale snapshots in the background, a batch every interval."""
+    path: str = None
+    interval: float = None
+
+    def __init__(self, path: str, snapshots_path: str = None, max_age: float = SNAPSHOT_MAX_AGE,
+        batch_size: int = REFRESH_BATCH_SIZE, interval: float = REFRESH_INTERVAL):
+        self.path = path
+        self.snapshots_path = snapshots_path
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.interval = interval
+        self.refreshed = 0
+        self.failed = {}
+        self._stopped = threading.Event()
+        self._thread: threading.Thread = None
+
+    def start(self):
+        """Start refreshing on a daemon thread, first waiting out an interval."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='snapshot-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop refreshing, waiting for a snapshot in progress to be saved."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def refresh_batch(self, store: BookmarkStore) -> int:
+        """Refresh the stalest snapshots, returning the number refreshed."""
+        import pages
+        from scheduler import scheduler
+        refreshed = 0
+        # posts that failed to refresh are skipped, rather than holding
+        # up every batch after them
+        stale = [item_id for item_id in store.stale(self.max_age, self.batch_size + len(self.failed))
+            if item_id not in self.failed]
+        for item_id in stale[:self.batch_size]:
+            if self._stopped.is_set():
+                break
+            try:
+                with scheduler.background():
+                    pgs = pages.get_post_pages_by_id(item_id)
+                store.save_snapshot(item_id, pgs)
+                refreshed += 1
+                self.failed.pop(item_id, None)
+            except Exception as e:
+                self.failed[item_id] = e
+        self.refreshed += refreshed
+        return refreshed
+
+    def _run(self):
+        store = BookmarkStore(self.path, self.snapshots_path)
+        try:
+            while not self._stopped.wait(self.interval):
+                self.refresh_batch(store)
+        finally:
+            store.close()
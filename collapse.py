@@ -0,0 +1,158 @@
+"""Rendering threads with subtrees collapsed beyond a depth or number of replies.
+
+A collapsed subtree is shown as a "[+N replies]" stub, and none of its
+comments are formatted until it's expanded, so rendering a huge thread
+costs about as much as the comments that are actually shown.
+"""
+from typing import Dict, Iterator, List, Set, Tuple
+
+from page import Page, NewsPage, DEFAULT_WIDTH, render_comment
+from pages import Pages
+
+# deepest comments shown (top-level comments are at depth 1)
+DEFAULT_MAX_DEPTH = 3
+# most replies shown under each comment (top-level comments are never
+# collapsed, since they're what's usually being skimmed)
+DEFAULT_MAX_REPLIES = 5
+# stands in for the main Item of a Page among the comments' parents
+ROOT = -1
+
+def render_stub(parent_id: int, num_hidden: int, depth: int) -> str:
+    """Render the stub of collapsed replies to parent_id, indented as replies at depth would be."""
+    return '{}[+{} {}] e-{}\n\n'.format('  ' * depth, num_hidden, 'reply' if num_hidden == 1 else 'replies',
+        parent_id)
+
+class ThreadIndex(object):
+    """The shape of the comment tree of a Page: each comment's replies, and how many comments are under it."""
+    lineages: List = None
+    children: Dict[int, List[int]] = None
+    sizes: List[int] = None
+
+    def __init__(self, comments: Dict):
+        # comments are in pre-order, so each comment's subtree is the run
+        # of comments after it that are deeper than it
+        self.lineages = list(comments.values()) if comments else []
+        self.positions = {lineage[-1][0]: i for i, lineage in enumerate(self.lineages)}
+        self.children = {ROOT: []}
+        self.sizes = [1] * len(self.lineages)
+        for i, lineage in enumerate(self.lineages):
+            # a Page after the first can start partway down a subtree,
+            # whose ancestors aren't on it
+            parent = self.positions.get(lineage[-2][0], ROOT) if len(lineage) > 1 else ROOT
+            self.children.setdefault(parent, []).append(i)
+            self.children.setdefault(i, [])
+        for i in reversed(range(len(self.lineages))):
+            for child in self.children[i]:
+                self.sizes[i] += self.sizes[child]
+
+    def subtree_size(self, children: List[int]) -> int:
+        """Get the number of comments in the subtrees of a list of comments."""
+        return sum(self.sizes[child] for child in children)
+
+class CollapsedPage(object):
+    """A Page whose comment subtrees are collapsed beyond max_depth and max_replies unless expanded."""
+    pg: Page = None
+    max_depth: int = None
+    max_replies: int = None
+    expanded: Set[int] = None
+
+    def __init__(self, pg: Page, max_depth: int = DEFAULT_MAX_DEPTH, max_replies: int = DEFAULT_MAX_REPLIES):
+        self.pg = pg
+        self.max_depth = max_depth
+        self.max_replies = max_replies
+        # IDs of the comments whose replies are all shown
+        self.expanded = set()
+        self.index = ThreadIndex(getattr(pg, 'comments', None))
+        # rendered comments, by ID and width, so expanding a subtree
+        # only formats the comments that weren't shown already
+        self._rendered: Dict[Tuple[int, int], str] = {}
+
+    def __contains__(self, comment_id: int):
+        return comment_id in self.index.positions
+
+    def expand(self, comment_id: int):
+        """Show every reply to a comment."""
+        self.expanded.add(comment_id)
+
+    def collapse(self, comment_id: int):
+        """Go back to limiting the replies shown under a comment."""
+        self.expanded.discard(comment_id)
+
+    def visible(self) -> Iterator[Tuple]:
+        """Get what's shown, in order: ('comment', lineage) for comments and ('stub', parent ID, N, depth) for stubs."""
+        # (parent, depth of its replies, replies left to go through),
+        # walked depth first without recursing
+        main_id = self.pg.item.get_id()
+        stack = [(ROOT, 1, iter(self._shown(ROOT, main_id, 1)))]
+        while stack:
+            parent, depth, shown = stack[-1]
+            entry = next(shown, None)
+            if entry is None:
+                stack.pop()
+                continue
+            if entry[0] == 'stub':
+                yield entry
+                continue
+            i = entry[1]
+            lineage = self.index.lineages[i]
+            yield ('comment', lineage)
+            stack.append((i, depth + 1, iter(self._shown(i, lineage[-1][0], depth + 1))))
+
+    def _shown(self, parent: int, parent_id: int, depth: int) -> List[Tuple]:
+        """Get the replies to parent that are shown, followed by the stub of those that aren't."""
+        children = self.index.children.get(parent, [])
+        if parent == ROOT or parent_id in self.expanded:
+            shown = children
+        elif depth > self.max_depth:
+            shown = []
+        else:
+            shown = children[:self.max_replies]
+        entries = [('comment', i) for i in shown]
+        hidden = children[len(shown):]
+        if hidden:
+            entries.append(('stub', parent_id, self.index.subtree_size(hidden), depth))
+        return entries
+
+    def render(self, width: int = DEFAULT_WIDTH) -> str:
+        """Render this Page as text wrapped to width, with stubs in place of collapsed subtrees."""
+        if isinstance(self.pg, NewsPage):
+            return self.pg.render(width)
+        s = self.pg.render_item(width)
+        for entry in self.visible():
+            if entry[0] == 'stub':
+                s += render_stub(*entry[1:])
+                continue
+            lineage = entry[1]
+            key = (lineage[-1][0], width)
+            rendered = self._rendered.get(key, None)
+            if rendered is None:
+                rendered = self._rendered[key] = render_comment(lineage, width)
+            s += rendered
+        return s
+
+class CollapsedPages(object):
+    """Pages rendered with their comment subtrees collapsed."""
+    pgs: Pages = None
+
+    def __init__(self, pgs: Pages, max_depth: int = DEFAULT_MAX_DEPTH, max_replies: int = DEFAULT_MAX_REPLIES):
+        self.pgs = pgs
+        self.pages = [CollapsedPage(pg, max_depth, max_replies) for pg in pgs.pages]
+
+    def __str__(self):
+        return self.render()
+
+    def expand(self, comment_id: int) -> bool:
+        """Show every reply to a comment, returning False if it isn't on any of the Pages."""
+        found = False
+        for pg in self.pages:
+            if comment_id in pg:
+                pg.expand(comment_id)
+                found = True
+        return found
+
+    def render(self, width: int = DEFAULT_WIDTH) -> str:
+        """Render every Page as text wrapped to width."""
+        s = ''
+        for p in self.pages:
+            s += '(page {}):\n{}\n'.format(p.pg.pg_number, p.render(width))
+        return s
@@ -1,19 +1,76 @@
 """Functionality used for working with Items and Pages."""
+from typing import Iterator
+import codecs
+import os
+import time
+from metrics import metrics
+from profiler import profiler, timed
+from scheduler import scheduler
+
 import requests
 
-HN_BASE_URL = 'https://news.ycombinator.com/'
+# The base URLs can be pointed somewhere other than HN (i.e. a local
+# stand-in server) with environment variables or set_base_urls(). Use
+# them through this module (common.HN_ITEMS_URL) rather than importing
+# them, so that changes to them are seen everywhere.
+HN_BASE_URL = os.environ.get('RICH_HN_BASE_URL', 'https://news.ycombinator.com/')
 HN_NEWS_URL = HN_BASE_URL + 'news'
 HN_ITEMS_URL = HN_BASE_URL + 'item'
 
-HN_API_BASE_URL = 'https://hacker-news.firebaseio.com/v0/'
+HN_API_BASE_URL = os.environ.get('RICH_HN_API_BASE_URL', 'https://hacker-news.firebaseio.com/v0/')
 HN_API_ITEMS_URL = HN_API_BASE_URL + 'item/'
 
+# size, in bytes, of the chunks read off of streamed responses
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# no caching here
+NO_CACHE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'Pragma': 'no-cache'
+}
+
+def set_base_urls(base_url: str = None, api_base_url: str = None):
+    """Point the HN site and/or HN API URLs at different base URLs."""
+    global HN_BASE_URL, HN_NEWS_URL, HN_ITEMS_URL, HN_API_BASE_URL, HN_API_ITEMS_URL
+    if base_url is not None:
+        HN_BASE_URL = base_url
+        HN_NEWS_URL = HN_BASE_URL + 'news'
+        HN_ITEMS_URL = HN_BASE_URL + 'item'
+    if api_base_url is not None:
+        HN_API_BASE_URL = api_base_url
+        HN_API_ITEMS_URL = HN_API_BASE_URL + 'item/'
+
 def get_html(url: str) -> str:
     """Gets the HTML of the content indicated by the URL."""
-    # no caching here
-    headers = {
-        'Cache-Control': 'no-cache',
-        'Pragma': 'no-cache'
-    }
-    r = requests.get(url, headers=headers)
-    return r.text
\ No newline at end of file
+    # requests for the same URL made at the same time share a response
+    return scheduler.fetch(url, lambda: request_html(url))
+
+@timed('get_html')
+def request_html(url: str) -> str:
+    """Requests the HTML of the content indicated by the URL, bypassing the scheduler."""
+    r = requests.get(url, headers=NO_CACHE_HEADERS)
+    metrics.record_response('html', r.status_code, len(r.content))
+    return r.text
+
+def stream_html(url: str, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """Gets the HTML of the content indicated by the URL in chunks, as it arrives."""
+    scheduler.acquire()
+    start = time.perf_counter()
+    num_bytes = 0
+    with requests.get(url, headers=NO_CACHE_HEADERS, stream=True) as r:
+        try:
+            # fail before anything is parsed, rather than streaming
+            # the HTML of an error page
+            r.raise_for_status()
+            # chunks can only be decoded if the response declares an encoding
+            decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')(errors='replace')
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                num_bytes += len(chunk)
+                yield decoder.decode(chunk)
+            yield decoder.decode(b'', final=True)
+        finally:
+            # recorded however the stream ends, including when it's
+            # closed before all of it has been read
+            metrics.record_response('html', r.status_code, num_bytes)
+            if profiler.active:
+                profiler.record('get_html', time.perf_counter() - start)
@@ -0,0 +1,184 @@
+"""Headless, resumable export of news pages and threads as JSON Lines."""
+from typing import Dict, Iterator, List, Set, TextIO, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sys
+import threading
+import time
+
+import pages
+from page import Page, NewsPage
+from items import Item
+from scheduler import scheduler
+
+DEFAULT_WORKERS = 8
+# suffix of the file listing the units of work an export has finished
+PROGRESS_SUFFIX = '.progress'
+
+def parse_page_nums(spec: str) -> List[int]:
+    """Parse page numbers like '1-5' or '1,3,7-9'."""
+    nums = []
+    for part in spec.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            if int(first) > int(last):
+                raise ValueError("Can't export the pages {!r}, {} comes after {}".format(part, first, last))
+            nums.extend(range(int(first), int(last) + 1))
+        elif part:
+            nums.append(int(part))
+    if not nums:
+        raise ValueError("Can't export {!r}, no pages or ids given".format(spec))
+    return nums
+
+def parse_export_spec(spec: str) -> Tuple[str, List[int]]:
+    """Parse what to export, like 'news:1-5' or 'item:26235118,26102455'."""
+    kind, _, values = spec.partition(':')
+    if kind not in ('news', 'item') or not values:
+        raise ValueError("Can't export {!r}, expected news:{{pages}} or item:{{ids}}".format(spec))
+    return kind, parse_page_nums(values)
+
+def item_record(item: Item, kind: str, **extra) -> Dict:
+    """Get the JSON-serializable record of an Item."""
+    record = {'kind': kind, 'id': item.get_id()}
+    for key, value in item.get_content().items():
+        if key == 'kids':
+            # comments get records of their own, which point at their parents
+            continue
+        if key == 'parts':
+            value = [dict(part.get_content(), id=part.get_id()) for part in value]
+        record[key] = value
+    record.update(extra)
+    return record
+
+def page_records(pg: Page) -> Iterator[Dict]:
+    """Get the records of every Item on a Page."""
+    if isinstance(pg, NewsPage):
+        for item_id, rank in pg.ranks.items():
+            yield item_record(pg.items[item_id], 'news_item', rank=rank, page=pg.pg_number)
+        return
+    main_id = pg.item.get_id()
+    # the main Item of a comment page is a comment itself
+    kind = 'comment' if pg.item.get_content().get('type') == 'comment' else 'post'
+    yield item_record(pg.item, kind, page=pg.pg_number)
+    if pg.comments is not None:
+        for lineage in pg.comments.values():
+            comment_id, comment = lineage[-1]
+            parent_id = lineage[-2][0] if len(lineage) > 1 else main_id
+            yield item_record(comment, 'comment', parent=parent_id, depth=len(lineage) - 1,
+                thread=main_id, page=pg.pg_number)
+
+class Exporter(object):
+    """Writes the records of the Items on pages to a JSON Lines file as they're fetched.
+
+    Each unit of work (a news page, or a whole thread) is written out in
+    one go once it's been fetched, and then recorded in a progress file
+    next to the output, so a run that's interrupted can be picked up
+    where it left off by running it again.
+    """
+    out_path: str = None
+    workers: int = None
+
+    def __init__(self, out_path: str, workers: int = DEFAULT_WORKERS):
+        self.out_path = out_path
+        self.workers = workers
+        self.progress_path = out_path + PROGRESS_SUFFIX
+        self.done: Set[str] = set()
+        self.failed: Dict[str, Exception] = {}
+        self.units_written = 0
+        self.units_skipped = 0
+        self.records_written = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self._thread_futures = []
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path) as f:
+                self.done = set(line.strip() for line in f if line.strip())
+
+    def export(self, kind: str, values: List[int], with_threads: bool = False):
+        """Export news pages (and optionally their threads) or threads by ID."""
+        with open(self.out_path, 'a') as out, open(self.progress_path, 'a') as progress, \
+            ThreadPoolExecutor(max_workers=self.workers) as executor:
+            self._out, self._progress = out, progress
+            if kind == 'item':
+                futures = [executor.submit(self._export_thread, item_id) for item_id in values]
+            else:
+                futures = [executor.submit(self._export_news_page, pg_num, executor, with_threads)
+                    for pg_num in values]
+            # the thread futures are submitted from inside of the news
+            # page ones, so wait for those first
+            for future in futures:
+                future.result()
+            for future in self._thread_futures:
+                future.result()
+
+    def _export_news_page(self, pg_num: int, executor: ThreadPoolExecutor, with_threads: bool):
+        key = 'news:{}'.format(pg_num)
+        try:
+            # news pages are fetched even when done, since their
+            # threads might not be
+            pg = pages.get_news_pages_by_num([pg_num]).get_current_page()
+        except Exception as e:
+            self.failed[key] = e
+            return
+        if key in self.done:
+            self._skip_unit()
+        else:
+            self._write_unit(key, page_records(pg))
+        if with_threads:
+            futures = [executor.submit(self._export_thread, item_id) for item_id in pg.ranks]
+            with self._lock:
+                self._thread_futures.extend(futures)
+
+    def _export_thread(self, item_id: int):
+        key = 'item:{}'.format(item_id)
+        if key in self.done:
+            self._skip_unit()
+            return
+        try:
+            with scheduler.background():
+                pgs = pages.get_post_pages_by_id(item_id)
+        except Exception as e:
+            self.failed[key] = e
+            return
+        self._write_unit(key, (record for pg in pgs.pages for record in page_records(pg)))
+
+    def _skip_unit(self):
+        with self._lock:
+            self.units_skipped += 1
+
+    def _write_unit(self, key: str, records: Iterator[Dict]):
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        with self._lock:
+            self._out.write(lines)
+            self._out.flush()
+            # only mark the unit done once its records are on disk
+            os.fsync(self._out.fileno())
+            self._progress.write(key + '\n')
+            self._progress.flush()
+            self.done.add(key)
+            self.units_written += 1
+            self.records_written += lines.count('\n')
+            self.bytes_written += len(lines.encode('utf-8'))
+
+def report(exporter: Exporter, elapsed: float) -> str:
+    """Get a summary of the throughput of an export."""
+    s = 'Exported {} records ({:.1f} KiB) from {} pages/threads in {:.2f}s'.format(exporter.records_written,
+        exporter.bytes_written / 1024, exporter.units_written, elapsed)
+    if exporter.units_skipped:
+        s += ', skipping {} already exported'.format(exporter.units_skipped)
+    s += '\n{:.1f} records/s, {:.1f} KiB/s, {:.2f} pages/threads/s, {} requests'.format(
+        exporter.records_written / elapsed, exporter.bytes_written / 1024 / elapsed,
+        exporter.units_written / elapsed, scheduler.requests_made)
+    for key, e in exporter.failed.items():
+        s += '\nFailed to export {}: {!r}'.format(key, e)
+    return s
+
+def run_export(kind: str, values: List[int], out_path: str, with_threads: bool = False,
+    workers: int = DEFAULT_WORKERS, report_file: TextIO = sys.stderr) -> int:
+    """Run an export, printing its throughput report, and return an exit code."""
+    exporter = Exporter(out_path, workers)
+    start = time.perf_counter()
+    exporter.export(kind, values, with_threads)
+    print(report(exporter, time.perf_counter() - start), file=report_file)
+    return 1 if exporter.failed else 0
@@ -1,21 +1,35 @@
-from typing import List
+from typing import TYPE_CHECKING, Dict, List
+import threading
+import weakref
 
-from items import Item
+# items imports the shared ItemDB to intern the Items it extracts, so
+# Item is only imported here for type checking
+if TYPE_CHECKING:
+    from items import Item
+
+# number of locks the Items are spread over by ID, so that writers only
+# contend when they're working on Items in the same stripe
+NUM_STRIPES = 16
 
 class ItemDB(object):
     """A DB for global Item state."""
     items: dict = None
 
-    def __init__(self, items: dict = None):
+    def __init__(self, items: dict = None, num_stripes: int = NUM_STRIPES):
         if items is None:
             self.items = {}
         else:
             self.items = items
+        # every write to an Item happens while holding the lock of its
+        # stripe, which makes check-then-insert and in-place updates of
+        # content atomic. Single reads and writes of the items dict are
+        # already atomic, so reads don't take a lock.
+        self._locks = [threading.Lock() for _ in range(num_stripes)]
 
     def __str__(self):
         s = ''
         if self.items is not None:
-            for item in self.items.values():
+            for item in list(self.items.values()):
                 s += '{} ({})\n'.format(item.get_title(), item.get_id())
         return s
     
@@ -24,39 +38,94 @@ class ItemDB(object):
 
     def delete_item(self, item_id: int):
         """Delete an Item by ID, returning True if successful and False if not."""
-        try:
-            del self.items[item_id]
-            return True
-        except KeyError:
-            return False
+        with self._get_lock(item_id):
+            try:
+                del self.items[item_id]
+                return True
+            except KeyError:
+                return False
 
-    def add_all_items(self, items: List[Item]):
+    def add_all_items(self, items: List['Item']):
+        """Add a batch of Items, taking the lock of each stripe only once."""
+        stripes: Dict[int, List['Item']] = {}
         for item in items:
-            self.add_item(item)
+            stripes.setdefault(item.get_id() % len(self._locks), []).append(item)
+        for stripe in sorted(stripes):
+            with self._locks[stripe]:
+                for item in stripes[stripe]:
+                    self._add_item(item)
+
+    def add_item(self, i: 'Item'):
+        with self._get_lock(i.get_id()):
+            self._add_item(i)
 
-    def add_item(self, i: Item):
+    def _add_item(self, i: 'Item'):
         if self.items.get(i.get_id(), None) is not None:
-            self.update_item(i)
+            self._update_item(i)
         else:
             self.items[i.get_id()] = i
 
-    def update_item(self, i: Item):
+    def intern(self, i: 'Item') -> 'Item':
+        """Get the one live Item with the ID of i, adding i if there isn't one yet and replacing its content with i's if there is."""
+        with self._get_lock(i.get_id()):
+            db_item = self.items.get(i.get_id(), None)
+            if db_item is None:
+                self.items[i.get_id()] = i
+                return i
+            self._replace_item(db_item, i)
+            return db_item
+
+    def _replace_item(self, db_item: 'Item', i: 'Item'):
+        # Unlike an update, a re-extracted Item is what the page shows now,
+        # so every field it has overwrites the live Item's, even when it's
+        # None (i.e. the text of a deleted comment), and a comment that's
+        # lost its user loses it here too. Fields it doesn't have at all
+        # (like the text of a post extracted from a news page) are kept.
+        content = dict(db_item.content)
+        for key, value in i.get_content().items():
+            if key == 'kids' and isinstance(value, dict) and isinstance(content.get(key), dict):
+                content[key] = {**content[key], **value}
+            else:
+                content[key] = value
+        if 'user' not in i.get_content():
+            content.pop('user', None)
+        # swapped in whole, as in _update_item
+        db_item.content = content
+
+    def _get_lock(self, item_id: int) -> threading.Lock:
+        return self._locks[item_id % len(self._locks)]
+
+    def update_item(self, i: 'Item'):
+        with self._get_lock(i.get_id()):
+            self._update_item(i)
+
+    def _update_item(self, i: 'Item'):
         # Use the ID of the passed in Item to locate the desired Item
         # in the items dictionary
-        db_item: Item = self.items[i.get_id()]
+        db_item: 'Item' = self.items[i.get_id()]
 
         # Loop over the content dictionary of the passed-in Item, and
         # for each key-value pair, update the existing Item's content
         # dictionary with that data. For dictionary members of content
         # like 'kids', make sure you don't overwrite the dictionary, but
-        # instead update it with the items in that dictionary. A lot of
+        # instead merge the items in that dictionary into it. A lot of
         # the other, non-dictionary fields in content should be overwritten
         # since they might correspond to quantitative things -- like number of
         # comments or number of points -- which need to be frequently updated.
+        # The updated content is swapped in whole, since the Item may be
+        # on Pages that are being read (or exported) by other threads.
+        content = dict(db_item.content)
         for key, value in i.get_content().items():
             if value is not None:
-                if key == 'kids':
-                    db_item.content.update(value)
+                if key == 'kids' and isinstance(value, dict) and isinstance(content.get(key), dict):
+                    # a new dict too, rather than changing the one readers
+                    # of the live Item may be holding
+                    content[key] = {**content[key], **value}
                 else:
-                    db_item.content[key] = value
+                    content[key] = value
+        db_item.content = content
 
+# every Item extracted from a page is interned in this ItemDB, so each ID
+# maps to one live Item, however many Pages it's on. Items are only held
+# weakly, so an Item is freed along with the last Page it's on.
+item_db = ItemDB(weakref.WeakValueDictionary())
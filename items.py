@@ -1,8 +1,13 @@
-from typing import Dict, Tuple, List
+from typing import Any, Dict, Tuple, List
 import re
 import html
 
-from common import get_html, HN_ITEMS_URL, HN_API_ITEMS_URL
+import common
+from common import get_html
+from itemdb import item_db
+from metrics import metrics
+from profiler import timed
+from scheduler import scheduler
 
 import bs4
 import requests
@@ -90,8 +95,16 @@ ITEM_TYPE = {
     'POLLOPT' : 'pollopt'
 }
 
+# names of the tags holding information in the rows of a post
+POST_ROW_TAGS = ('span', 'a', 'td')
+SUBTEXT_TAGS = ('span', 'a')
+
 # Extraction functions: here, we extract useful information from
 # the HTML or JSON obtained from the HN site directly or the HN API.
+# Anything these functions put into an Item's content must be a plain
+# Python value (str, int, etc.) rather than a bs4 object, since bs4
+# objects keep a reference to the entire soup they came from.
+@timed()
 def extract_comment_info(comment_tr: bs4.Tag) -> Dict:
     """Extract information from a comment on HN."""
     content = dict()
@@ -101,7 +114,7 @@ def extract_comment_info(comment_tr: bs4.Tag) -> Dict:
 
     user = comhead_span.find('a', attrs={'class' : 'hnuser'})
     if user is not None:
-        content['user'] = user.string
+        content['user'] = user.get_text()
 
     par_span = comhead_span.find('span', attrs={'class' : 'par'})
     if par_span.string is not None:
@@ -119,12 +132,14 @@ def extract_comment_info(comment_tr: bs4.Tag) -> Dict:
     commtext_span = comment_div.find('span', attrs={'class': 'commtext'})
     if commtext_span is None:
         text = comment_div.contents[0].string
+        text = str(text) if text is not None else None
     else:
         text = extract_item_text(commtext_span)
     content['text'] = text
 
     return content
 
+@timed()
 def extract_item_text(item_text_elmt: bs4.Tag) -> str:
     """Extract the text content of an item."""
     fins = ''
@@ -166,6 +181,7 @@ def extract_item_text(item_text_elmt: bs4.Tag) -> str:
     fins = fins.strip()
     return fins
 
+@timed()
 def extract_comment_tree_ds(comment_tree_table: bs4.Tag) -> Tuple[List[int], List[int],
     List[int], List[Item]]:
     """Generate data structures representing a comment tree."""
@@ -174,18 +190,9 @@ def extract_comment_tree_ds(comment_tree_table: bs4.Tag) -> Tuple[List[int], Lis
     ids = list()
     items = list()
     for comment in raw_comments:
-        # get indent, indicating nesting amount
-        img = comment.find('img', attrs={'src' : 's.gif'})
-        indent = int(img['width'])
+        indent, i = extract_comment_row(comment)
         indents.append(indent)
-
-        # get comment ID
-        comment_id = int(comment['id'])
-        ids.append(comment_id)
-
-        # get comment content and create an Item with it
-        content = extract_comment_info(comment)
-        i = Item(comment_id, content=content)
+        ids.append(i.get_id())
         items.append(i)
 
     # a sorted list of unique indents, used to help us determine
@@ -194,6 +201,19 @@ def extract_comment_tree_ds(comment_tree_table: bs4.Tag) -> Tuple[List[int], Lis
 
     return ids, indents, sorted_indents, items
 
+@timed()
+def extract_comment_row(comment_tr: bs4.Tag) -> Tuple[int, Item]:
+    """Extract the indent and Item of a row in a comment tree."""
+    # get indent, indicating nesting amount
+    img = comment_tr.find('img', attrs={'src' : 's.gif'})
+    indent = int(img['width'])
+
+    # get comment ID, content and create an Item with it
+    comment_id = int(comment_tr['id'])
+    content = extract_comment_info(comment_tr)
+    return indent, item_db.intern(Item(comment_id, content=content))
+
+@timed()
 def extract_comment_tree(item_id: int, comment_tree_ds: Tuple[List[int], List[int],
     List[int], List[Item]]) -> Dict:
     """Extracts the comment tree for a given item."""
@@ -203,6 +223,7 @@ def extract_comment_tree(item_id: int, comment_tree_ds: Tuple[List[int], List[in
 
     return comment_lineage
 
+@timed()
 def extract_lineage(p_id: int, partial_tree_ds: Tuple[List[int], List[int],
     List[int], List[Item]]) -> Dict[int, List]:
     """Extract comment lineage."""
@@ -259,67 +280,101 @@ def extract_lineage(p_id: int, partial_tree_ds: Tuple[List[int], List[int],
     
     return comment_lineage
 
-def extract_post_item_main(post_tr: bs4.Tag) -> Dict:
-    """Extract the information from the main/header content of a post."""              
+@timed()
+def extract_post_item_main(post_tr: bs4.Tag, resolve_type: bool = True) -> Dict:
+    """Extract the information from the main/header content of a post."""
+    _, content = extract_post_item_row(post_tr, resolve_type)
+    return content
+
+@timed()
+def extract_post_item_row(post_tr: bs4.Tag, resolve_type: bool = True) -> Tuple[Any, Dict]:
+    """Extract the rank and main/header content of a post in a single pass over its row."""
     content = dict()
     item_id = int(post_tr['id'])
-  
-    # get post title, associated links, if present
-    story_a = post_tr.find('a', attrs={'class': 'storylink'})
-    if story_a is not None:
-        url = story_a['href']
-        title = story_a.string
-        content['url'] = url
-        content['title'] = title
+    rank = ''
+    title = ''
+    site_bit = ''
+    votelink_present = False
+
+    # Visit every tag of interest in the row once, rather than searching
+    # the row again for each piece of information. Walking the descendants
+    # directly is a lot cheaper than having bs4 match them with find_all().
+    for tag in post_tr.descendants:
+        if tag.name not in POST_ROW_TAGS:
+            continue
+        tag_class = tag.get('class')
+        if tag_class is None:
+            continue
+        elif tag.name == 'span':
+            if tag_class[0] == 'rank':
+                # get rank, if it exists (posts don't have one outside of news pages)
+                rank = int(tag.string.split('.')[0]) if tag.string else ''
+            elif tag_class[0] == 'sitestr':
+                # get sitebit description beside main site title, if it exists
+                site_bit = tag.get_text()
+        elif tag.name == 'a':
+            if tag_class[0] == 'storylink':
+                # get post title, associated links, if present
+                title = tag.get_text()
+                content['url'] = tag['href']
+                content['title'] = title
+        elif tag_class[0] == 'votelinks':
+            # see if votelinks are present, indicating if post is a jobs post or not
+            votelink_present = True
 
-    # get sitebit description beside main site title, if it exists
-    sitebit_space = post_tr.find('span', attrs={'class': 'sitestr'})
-    site_bit = sitebit_space.string if sitebit_space is not None else ''
     content['sitebit'] = site_bit
     sitebit_present = bool(site_bit)
 
-    # see if votelinks are present, indicating if post is a jobs post or not
-    votelinks = post_tr.find('td', attrs={'class': 'votelinks'})
-    votelink_present = True if votelinks is not None else False
+    # resolving the type of some posts (i.e. polls) requires a call to the API,
+    # so callers that don't need the type can skip it
+    if resolve_type:
+        content['type'] = extract_item_type(item_id, title, votelink_present,
+            sitebit_present)
 
-    content['type'] = extract_item_type(item_id, title, votelink_present,
-        sitebit_present)
-
-    return content
+    return rank, content
 
+@timed()
 def extract_post_item_subtext(post_td: bs4.Tag) -> Tuple[int, Dict]:
     """Extract information from the subtext of a post."""
     content = dict()
-
-    # get the score/points, if it exists
-    score_span = post_td.find('span', attrs={'class' : 'score'})
     score = ''
-    if score_span is not None:
-        score_string = score_span.string
-        # find 'point' in the score string
-        point_idx = score_string.find('points')
-        score = int(score_string[0:point_idx])
-    content['score'] = score
+    user = ''
+    item_id = None
+    item_href = None
+    item_a = []
+
+    # Visit every <span> and <a> in the subtext once, in document order
+    for tag in post_td.descendants:
+        if tag.name not in SUBTEXT_TAGS:
+            continue
+        tag_class = tag.get('class')
+        if tag.name == 'span':
+            if tag_class is None:
+                continue
+            elif tag_class[0] == 'score':
+                # get the score/points, if it exists (example: "99 points" or "1 point")
+                score = int(tag.string.split('point')[0])
+            elif tag_class[0] == 'age':
+                # use the age of the post to get the ID of it for matching with main title
+                # example: href="item?id=3785593"
+                item_id = int(tag.a['href'].split('id=')[1])
+                item_href = 'item?id={}'.format(item_id)
+        elif tag_class is not None and tag_class[0] == 'hnuser':
+            # get the HN user, if it exists (it won't for jobs posts)
+            user = tag.get_text()
+        elif item_href is not None and tag.get('href') == item_href:
+            # the link in the age <span> and the comments link both point to the item
+            item_a.append(tag)
 
-    # get the HN user, if it exists (it won't for jobs posts)
-    user_a = post_td.find('a', attrs={'class' : 'hnuser'})
-    user = user_a.string if user_a is not None else ''
+    content['score'] = score
     content['user'] = user
 
-    # use the age of the post to get the ID of it for matching with main title
-    age_span = post_td.find('span', attrs={'class' : 'age'})
-    a_tag = age_span.find('a')
-    # example: href="item?id=3785593"
-    item_id = int(a_tag['href'].split('id=')[1])
-
     # get the number of comments
-    item_id_string = 'item?id={}'.format(item_id)
-    comment_a = post_td.find_all('a', attrs={'href' : item_id_string})
     # jobs posts don't have comments, so the tag will only have one <a>
-    if len(comment_a) == 1:
+    if len(item_a) <= 1:
         num_comments = 0
     else:
-        comments = comment_a[-1].string
+        comments = item_a[-1].string
         if comments == 'discuss':
             num_comments = 0
         else:
@@ -329,6 +384,7 @@ def extract_post_item_subtext(post_td: bs4.Tag) -> Tuple[int, Dict]:
 
     return item_id, content
 
+@timed()
 def extract_post_item_text(item_type: str, fatitem_table: bs4.Tag) -> str:
     """Extracts the text content of a post based on post type."""
     text = None
@@ -351,6 +407,7 @@ def extract_post_item_text(item_type: str, fatitem_table: bs4.Tag) -> str:
         # post did not have any text. So, we check if is_active is None or not
         if is_active is not None:
             text = None   
+        s.decompose()
 
         if item_type == ITEM_TYPE['POLL']:
             # we have a poll item, and expect >= 6 <tr> elements
@@ -365,7 +422,7 @@ def extract_post_item_text(item_type: str, fatitem_table: bs4.Tag) -> str:
                 item_id = int(points_tag['id'].split('_')[1])
 
                 content = {'text': polltext, 'score': score, 'type': ITEM_TYPE['POLLOPT']}
-                i = Item(item_id, content=content)
+                i = item_db.intern(Item(item_id, content=content))
                 pollopts.append(i)
     else:
         # no text content in this item, so
@@ -373,6 +430,7 @@ def extract_post_item_text(item_type: str, fatitem_table: bs4.Tag) -> str:
         pass
     return text, pollopts
 
+@timed()
 def extract_item_type(item_id: int, title: str , votelink_present: bool,
     sitebit_present: bool):
     """Extract the type of an item."""
@@ -399,11 +457,18 @@ def extract_item_type(item_id: int, title: str , votelink_present: bool,
 # the extraction functions
 def get_item_html_by_id(item_id: int) -> str:
     """Return the HTML content of the item with the given ID."""
-    post_url = HN_ITEMS_URL + '?id={}'.format(item_id)
+    post_url = common.HN_ITEMS_URL + '?id={}'.format(item_id)
     return get_html(post_url)
 
 def get_item_json_by_id(item_id: int) -> str:
     """Return the JSON data of the item with the given ID."""
-    url = HN_API_ITEMS_URL + '{}.json'.format(item_id)
-    p_data = requests.get(url).json()
+    url = common.HN_API_ITEMS_URL + '{}.json'.format(item_id)
+    return scheduler.fetch(url, lambda: request_item_json(url))
+
+@timed('get_item_json_by_id')
+def request_item_json(url: str) -> str:
+    """Request the JSON data at the given HN API URL, bypassing the scheduler."""
+    r = requests.get(url)
+    metrics.record_response('api', r.status_code, len(r.content))
+    p_data = r.json()
     return p_data
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""Runtime metrics (counters and latency histograms) that can be exported on demand."""
+from typing import Dict, List, Tuple
+from collections import OrderedDict
+import bisect
+import json
+import threading
+
+from profiler import profiler
+
+# upper bounds, in seconds, of the latency histogram buckets (the
+# same as the Prometheus client libraries' defaults)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# stages timed by the profiler that get a latency histogram
+OBSERVED_STAGES = (
+    'get_html',
+    'get_item_json_by_id',
+    'extract_page',
+    'Pages.render',
+    'NewsPage.render',
+    'PostPage.render',
+    'CommentPage.render',
+    'ParallelRenderer.render',
+)
+
+def format_labels(label_names: Tuple[str, ...], label_values: Tuple[str, ...], extra: str = '') -> str:
+    """Format labels the way they're written in the Prometheus text format."""
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value: float) -> str:
+    """Format a sample value the way it's written in the Prometheus text format."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter(object):
+    """A count that only goes up, kept separately for each combination of labels."""
+    name: str = None
+    help: str = None
+    label_names: Tuple[str, ...] = None
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        """Increase the count for the given labels by amount."""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        """Get the count for the given labels."""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def total(self) -> float:
+        """Get the count summed over every combination of labels."""
+        with self._lock:
+            return sum(self._values.values())
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    def to_prometheus(self) -> str:
+        s = '# HELP {} {}\n# TYPE {} counter\n'.format(self.name, self.help, self.name)
+        for key, value in self.samples():
+            s += '{}{} {}\n'.format(self.name, format_labels(self.label_names, key), format_value(value))
+        return s
+
+    def to_dict(self) -> Dict:
+        return OrderedDict([
+            ('type', 'counter'),
+            ('help', self.help),
+            ('samples', [OrderedDict([('labels', dict(zip(self.label_names, key))), ('value', value)])
+                for key, value in self.samples()]),
+        ])
+
+class Histogram(object):
+    """Counts of observed values by bucket, kept separately for each combination of labels."""
+    name: str = None
+    help: str = None
+    label_names: Tuple[str, ...] = None
+    buckets: Tuple[float, ...] = None
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # for each combination of labels, the (non-cumulative) count in
+        # each bucket (with one more for +Inf), the sum and the count
+        self._values: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        """Record an observed value for the given labels."""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key, None)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def get_sum(self, **labels) -> float:
+        """Get the sum of the values observed for the given labels."""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            entry = self._values.get(key, None)
+            return entry[1] if entry is not None else 0.0
+
+    def get_count(self, **labels) -> int:
+        """Get the number of values observed for the given labels."""
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            entry = self._values.get(key, None)
+            return entry[2] if entry is not None else 0
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], List[int], float, int]]:
+        """Get the cumulative bucket counts, sum and count for each combination of labels."""
+        samples = []
+        with self._lock:
+            values = sorted((key, list(entry[0]), entry[1], entry[2]) for key, entry in self._values.items())
+        for key, counts, total, count in values:
+            cumulative = []
+            running = 0
+            for c in counts:
+                running += c
+                cumulative.append(running)
+            samples.append((key, cumulative, total, count))
+        return samples
+
+    def to_prometheus(self) -> str:
+        s = '# HELP {} {}\n# TYPE {} histogram\n'.format(self.name, self.help, self.name)
+        for key, cumulative, total, count in self.samples():
+            for bound, c in zip(self.buckets + (float('inf'),), cumulative):
+                le = 'le="{}"'.format(format_value(bound))
+                s += '{}_bucket{} {}\n'.format(self.name, format_labels(self.label_names, key, le), c)
+            labels = format_labels(self.label_names, key)
+            s += '{}_sum{} {}\n'.format(self.name, labels, format_value(total))
+            s += '{}_count{} {}\n'.format(self.name, labels, count)
+        return s
+
+    def to_dict(self) -> Dict:
+        samples = []
+        for key, cumulative, total, count in self.samples():
+            bounds = [format_value(b) for b in self.buckets + (float('inf'),)]
+            samples.append(OrderedDict([
+                ('labels', dict(zip(self.label_names, key))),
+                ('buckets', OrderedDict(zip(bounds, cumulative))),
+                ('sum', total),
+                ('count', count),
+            ]))
+        return OrderedDict([('type', 'histogram'), ('help', self.help), ('samples', samples)])
+
+class MetricsRegistry(object):
+    """Holds the application's metrics, and exports them as Prometheus text or JSON."""
+    enabled: bool = None
+
+    def __init__(self, prefix: str = 'rich_hn_'):
+        self.enabled = False
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.requests = self.counter(prefix + 'http_requests_total',
+            'HTTP requests made, by endpoint and status code.', ('endpoint', 'status'))
+        self.response_bytes = self.counter(prefix + 'http_response_bytes_total',
+            'Bytes received in HTTP response bodies, by endpoint.', ('endpoint',))
+        self.stage_seconds = self.histogram(prefix + 'stage_duration_seconds',
+            'How long fetching, parsing and rendering take, by stage.', ('stage',))
+        self.items_parsed = self.counter(prefix + 'items_parsed_total',
+            'Items extracted from pages, by page type.', ('page_type',))
+
+    def counter(self, name: str, help: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        """Create and register a Counter."""
+        return self._register(Counter(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Create and register a Histogram."""
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('A metric named {} is already registered'.format(metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def enable(self):
+        """Start collecting metrics."""
+        if not self.enabled:
+            self.enabled = True
+            profiler.add_hook(self.observe_stage)
+
+    def disable(self):
+        """Stop collecting metrics, keeping the ones collected so far."""
+        if self.enabled:
+            self.enabled = False
+            profiler.remove_hook(self.observe_stage)
+
+    def reset(self):
+        """Forget every value collected so far."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def observe_stage(self, stage_name: str, duration: float):
+        """Profiler hook recording the durations of the observed stages."""
+        if stage_name in OBSERVED_STAGES:
+            self.stage_seconds.observe(duration, stage=stage_name)
+
+    def record_response(self, endpoint: str, status: int, num_bytes: int):
+        """Record an HTTP response received from an endpoint (i.e. 'html' or 'api')."""
+        if self.enabled:
+            self.requests.inc(endpoint=endpoint, status=status)
+            self.response_bytes.inc(num_bytes, endpoint=endpoint)
+
+    def record_items_parsed(self, page_type: str, num_items: int):
+        """Record that num_items Items were extracted from a page."""
+        if self.enabled:
+            self.items_parsed.inc(num_items, page_type=page_type)
+
+    def get_items_per_second(self) -> float:
+        """Get the number of Items extracted per second spent extracting pages."""
+        seconds = self.stage_seconds.get_sum(stage='extract_page')
+        return self.items_parsed.total() / seconds if seconds else 0.0
+
+    def to_prometheus(self) -> str:
+        """Export every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(metric.to_prometheus() for metric in metrics)
+
+    def to_json(self) -> str:
+        """Export every metric, and the derived parse throughput, as JSON."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        data = OrderedDict((metric.name, metric.to_dict()) for metric in metrics)
+        data['items_parsed_per_second'] = self.get_items_per_second()
+        return json.dumps(data, indent=2)
+
+    def dump(self, path: str):
+        """Write every metric to path, as JSON if it ends with .json and as Prometheus text otherwise."""
+        with open(path, 'w') as f:
+            f.write(self.to_json() if path.endswith('.json') else self.to_prometheus())
+
+# The MetricsRegistry used throughout the application
+metrics = MetricsRegistry()
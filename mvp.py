@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
+from typing import TYPE_CHECKING
+import argparse
 import subprocess
 import tempfile
+import threading
 import os
-import sqlite3
+import shutil
+import sys
 
-import pages
-from page import NewsPage, PostPage, CommentPage
+import bookmarks
+from metrics import metrics
+from profiler import profiler
 
 # return code for errors
 ERROR_RC = -1
@@ -16,10 +21,17 @@ DATA_PATH = './data'
 TMPDIR_PATH = os.path.join(DATA_PATH, 'tmpdir')
 SAVED_FILES_PATH = os.path.join(DATA_PATH, 'saved_files')
 BOOKMARK_DB_PATH = os.path.join(DATA_PATH, 'bookmarks')
+BOOKMARK_DB_FILE = os.path.join(BOOKMARK_DB_PATH, 'bookmark.db')
+SERIES_DB_PATH = os.path.join(DATA_PATH, 'series')
 
-bookmarks = []
+# pages (and with it bs4, requests and colorama) is only imported once a
+# page is first fetched, so the menu shows up as quickly as possible
+if TYPE_CHECKING:
+    import archive
+    import pages
+    import prefetch
 
-def app_setup() -> sqlite3.Connection:
+def app_setup() -> bookmarks.BookmarkStore:
     """Sets up the directories and DB needed by the application."""
     # Initialize paths
     paths = [DATA_PATH, TMPDIR_PATH, SAVED_FILES_PATH, BOOKMARK_DB_PATH]
@@ -30,29 +42,75 @@ def app_setup() -> sqlite3.Connection:
         else:
             pass
 
-    # Initialize persisted (or load the existing) DB
-    con = sqlite3.connect(os.path.join(BOOKMARK_DB_PATH, 'bookmark.db'))
-    cur = con.cursor()
-    # Check to see if there is a table already by looking at count of tables with name == bookmarks
-    cur.execute(''' SELECT count(name) from sqlite_master WHERE type='table' AND name='bookmarks' ''')
-    if cur.fetchone()[0] == 1:
-        # the table exists, get any bookmarks that might
-        # already be in there
-        bkmk_ids = [bkmk_id[0] for bkmk_id in cur.execute(''' SELECT id FROM bookmarks ''')]
-        bookmarks.extend(bkmk_ids)
-    else:
-        # the table doesn't exist. Let's create it!
-        cur.execute(''' CREATE TABLE bookmarks
-                        (id integer UNIQUE, title text, url text) ''')
-        # commit the change
-        con.commit()
-    
-    # return the connection for later use
-    return con
+    # Initialize persisted (or load the existing) DB, which is
+    # queried as needed rather than loaded up front
+    return bookmarks.BookmarkStore(BOOKMARK_DB_FILE)
+
+def rate_limit(value: str) -> float:
+    """Parse --rate-limit, a number of requests per second above 0."""
+    from scheduler import check_rate
+    try:
+        return check_rate(float(value))
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def parse_args(args=None) -> argparse.Namespace:
+    """Parse the command line arguments of the application."""
+    parser = argparse.ArgumentParser(description='A CLI-based reader for Hacker News.')
+    parser.add_argument('--profile', action='store_true',
+        help='time each stage of fetching, parsing and rendering pages, and print a breakdown on quit')
+    parser.add_argument('--profile-dump', metavar='PATH',
+        help='with --profile, also dump cProfile stats of the slowest action to PATH')
+    parser.add_argument('--metrics', action='store_true',
+        help='collect request, latency and parsing metrics, which the m action prints')
+    parser.add_argument('--metrics-dump', metavar='PATH',
+        help='collect metrics and write them to PATH on quit (as JSON if PATH ends with .json, Prometheus text otherwise)')
+    parser.add_argument('--rate-limit', type=rate_limit, metavar='RATE',
+        help='make at most RATE requests per second to HN (and the HN API), with reading taking priority over prefetching')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='K',
+        help='while looking at a news page, prefetch the threads of its top K posts, printing the hit rate on quit')
+    parser.add_argument('--prefetch-by', choices=('rank', 'comments'), default='rank',
+        help='with --prefetch, pick the top K posts by rank or by number of comments')
+    parser.add_argument('--export', metavar='SPEC',
+        help='export without prompting, where SPEC is news:{pages} (i.e. news:1-5) or item:{ids}, and quit')
+    parser.add_argument('--with-threads', action='store_true',
+        help='with --export news:{pages}, also export every thread on those pages')
+    parser.add_argument('--out', metavar='PATH', default='export.jsonl',
+        help='JSON Lines file --export appends to (running the same export again resumes it)')
+    parser.add_argument('--workers', type=int, default=8, help='number of pages --export fetches at once')
+    return parser.parse_args(args)
 
 def main():
-    con = app_setup()
+    args = parse_args()
+    profiler.enabled = args.profile
+    profiler.cprofile = args.profile and args.profile_dump is not None
+    if args.metrics or args.metrics_dump is not None:
+        metrics.enable()
+    if args.rate_limit is not None:
+        from scheduler import scheduler
+        scheduler.configure(rate=args.rate_limit)
+
+    if args.export is not None:
+        import export
+        try:
+            kind, values = export.parse_export_spec(args.export)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        return export.run_export(kind, values, args.out, args.with_threads, args.workers)
+
+    bkmk_store = app_setup()
+    # keep the snapshots of bookmarked posts fresh in the background
+    refresher = bookmarks.SnapshotRefresher(BOOKMARK_DB_FILE)
+    refresher.start()
+    prefetcher = None
+    if args.prefetch > 0:
+        import prefetch
+        prefetcher = prefetch.Prefetcher(args.prefetch, args.prefetch_by)
     pgs = None
+    collapsed = None
+    watcher = None
+    series = None
 
     # Main loop
     while(True):
@@ -60,90 +118,296 @@ def main():
         "n: See the posts on the front page of Hacker News\n" +
         "n-{num_r},{num_k},...,{num_b}: See the posts on pages r, k,...,and b of Hacker News\n" +
         "i-{item_id}: Read item with ID={item_id}\n" +
+        "c-{item_id}: Read item with ID={item_id}, with long or deep threads collapsed\n" +
+        "e-{comment_id}: Expand the replies to a comment in the last collapsed item\n" +
         "r-{num}: Read the item with current rank={num} on the main Hacker News Page\n" + 
-        "s: Save the last read post\n" +
-        "b: Bookmark the last read post\n" +
-        "b-a: Examine all currently saved bookmarks\n" +
+        "s: Save the last read post (as an archive if its name ends with .hna)\n" +
+        "o-{filename}: Read a post saved as an archive\n" +
+        "o-{filename},{text}: Search a post saved as an archive for text\n" +
+        "b: Bookmark the last read post, saving a snapshot of it\n" +
+        "b-{tag},{tag}: Bookmark the last read post with tags\n" +
+        "b-a, b-a-{page}: Examine the saved bookmarks, newest first\n" +
+        "bt-{tag}, bt-{tag}-{page}: Examine the saved bookmarks with a tag\n" +
+        "bo-{item_id}: Read a bookmarked post from its snapshot\n" +
+        "w-{num}: Watch pages 1 to num of Hacker News in the background\n" +
+        "w: Print what's changed on the watched pages, and check them again now\n" +
+        "m: Print the metrics collected so far (with --metrics)\n" +
         "q: Quit the application\n" +
         "Desired Action: ")
 
-        pgs, rc = handle_input(usr_input, pgs)
+        last_pgs = pgs
+        with profiler.operation(usr_input.strip()):
+            pgs, rc = handle_input(usr_input, pgs, prefetcher)
+        if pgs is not last_pgs and hasattr(last_pgs, 'close'):
+            # stop prefetching the pages of a thread that's been left
+            last_pgs.close()
+        if prefetcher is not None and pgs is not last_pgs:
+            # start prefetching for a news page, or stop once the reader
+            # has moved on from one
+            prefetcher.show(pgs)
+        if pgs is not last_pgs and pgs is not None:
+            # every news page read adds to the score and comment histories,
+            # not just those the watcher fetches
+            from page import NewsPage
+            if pgs.page_type is NewsPage:
+                if series is None:
+                    import timeseries
+                    series = timeseries.SeriesStore.load(SERIES_DB_PATH)
+                for pg in pgs.pages:
+                    series.record_page(pg)
 
         if rc == 's':
             filename = input("You've indicated you want to save the most recently read post.\n" +
             "What name would you like to save it as?: ")
-            with open(os.path.join(SAVED_FILES_PATH, filename), 'w') as j:
-                print(pgs, file=j, flush=True)
-                print("Successfully saved the file at: {}!".format(j.name))
+            path = os.path.join(SAVED_FILES_PATH, filename)
+            import archive
+            if filename.endswith(archive.ARCHIVE_SUFFIX):
+                archive.save(pgs, path)
+                print("Successfully saved the archive at: {}!".format(path))
+            else:
+                with open(path, 'w') as j:
+                    print(pgs, file=j, flush=True)
+                    print("Successfully saved the file at: {}!".format(j.name))
+        elif rc == 'o':
+            import archive
+            filename, _, text = usr_input.strip()[len('o-'):].partition(',')
+            try:
+                a = archive.Archive(os.path.join(SAVED_FILES_PATH, filename))
+            except (OSError, archive.ArchiveError) as e:
+                print("Couldn't open the archive: {}".format(e))
+                continue
+            with a:
+                if text:
+                    rows = a.search(text)
+                    for row in rows:
+                        item = a.get_item(row)
+                        print('{} || {} || {}'.format(item.get_id(), item.get_user(),
+                            item.get_title() or (item.get_text() or '')[:80]))
+                    print("{} matches for {!r}".format(len(rows), text))
+                else:
+                    show_archive(a)
         elif rc == 'b':
+            if pgs is None or not hasattr(pgs.get_current_page(), 'item'):
+                print("Read a post first, then bookmark it.")
+                continue
             pg = pgs.get_current_page()
             pg_id = pg.item.get_id()
-            pg_title = pg.item.get_title()
-            pg_url = pg.item.get_url()
-
-            try:
-                cur = con.cursor()
-                cur.execute(''' INSERT INTO bookmarks VALUES (?, ?, ?) ''', (pg_id, pg_title, pg_url))
-                con.commit()
-                bookmarks.append(pg_id)
-            except sqlite3.IntegrityError:
+            values = usr_input.strip().split('-', 1)
+            tags = [tag.strip() for tag in values[1].split(',') if tag.strip()] if len(values) > 1 else []
+            if not bkmk_store.add(pg_id, pg.item.get_title(), pg.item.get_url(), tags, pgs):
                 # we've tried to add a previously existing bookmark (based on ID)
+                bkmk_store.tag(pg_id, tags)
                 print("\nPost with ID={} already bookmarked!".format(pg_id))
-        elif rc == 'b-a':
-            cur = con.cursor()
-            cur.execute(''' SELECT * FROM bookmarks ''')
-            bkmks = cur.fetchall()
-            for bkmk in bkmks:
-                s = '{} || {} || {}'.format(bkmk[0], bkmk[1], bkmk[2]) 
-                print(s)
+        elif rc in ('b-a', 'bt'):
+            values = usr_input.strip().split('-')
+            tag = values[1] if rc == 'bt' else None
+            page_num = int(values[2]) if len(values) > 2 else 1
+            for bkmk in bkmk_store.page(page_num, tag):
+                print(bkmk)
+            num_pages = max(-(-bkmk_store.count(tag) // bookmarks.PAGE_SIZE), 1)
+            print("(page {} of {})".format(page_num, num_pages))
+        elif rc == 'bo':
+            item_id = int(usr_input.split('-')[1])
+            a = bkmk_store.open_snapshot(item_id)
+            if a is None:
+                print("Post with ID={} has no snapshot yet. Use i-{} to read it.".format(item_id, item_id))
+            else:
+                with a:
+                    show_archive(a)
+        elif rc == 'w':
+            values = usr_input.strip().split('-')
+            if len(values) > 1 or watcher is None:
+                import watcher as watching
+                import timeseries
+                if watcher is not None:
+                    watcher.stop()
+                if series is None:
+                    series = timeseries.SeriesStore.load(SERIES_DB_PATH)
+                num_pages = int(values[1]) if len(values) > 1 else 1
+                watcher = watching.FrontPageWatcher(num_pages=num_pages, series=series)
+                watcher.start()
+                print("Watching pages 1 to {} of Hacker News. Use w to see what's changed.".format(num_pages))
+            else:
+                # only the changes since the last check are shown, rather
+                # than the pages in full
+                diffs = watcher.take_diffs()
+                for diff in diffs:
+                    print(diff, end='')
+                if not any(len(diff) for diff in diffs):
+                    print("Nothing's changed since the last check.")
+                rising = series.fastest_rising(5)
+                if rising:
+                    print("Rising fastest over the last hour:")
+                    for item_id, rate in rising:
+                        item = watcher.item_db.get_item(item_id)
+                        title = item.get_title() if item is not None else item_id
+                        print("  {:+.0f} points/hour: {}".format(rate, title))
+                if watcher.last_error is not None:
+                    print("The last check failed: {!r}".format(watcher.last_error))
+                print("Checking again now (then every {:.0f}s).".format(watcher.interval))
+                watcher.refresh()
+        elif rc == 'm':
+            if metrics.enabled:
+                print(metrics.to_prometheus())
+            else:
+                print("Metrics aren't being collected. Run with --metrics to collect them.")
         elif rc == QUIT_RC:
             # clean out the temporary file directory
             for filename in os.listdir(TMPDIR_PATH):
                 os.remove(os.path.join(TMPDIR_PATH, filename))
             
             # close the DB connection
-            con.close()
+            refresher.stop()
+            bkmk_store.close()
+
+            if watcher is not None:
+                watcher.stop()
+            if hasattr(pgs, 'close'):
+                pgs.close()
+            if prefetcher is not None:
+                prefetcher.close()
+                print(prefetcher.report())
+            if series is not None:
+                series.downsample()
+                series.save(SERIES_DB_PATH)
+
+            if profiler.enabled:
+                print(profiler.report())
+                if args.profile_dump is not None:
+                    print(profiler.dump_slowest(args.profile_dump))
+                    print("Saved cProfile stats of the slowest action at: {}".format(args.profile_dump))
+            if args.metrics_dump is not None:
+                metrics.dump(args.metrics_dump)
+                print("Saved metrics at: {}".format(args.metrics_dump))
             break
         elif rc == ERROR_RC:
             print("Invalid control sequence. Please try again. :)")
+        elif rc == 'c':
+            import collapse
+            collapsed = collapse.CollapsedPages(pgs)
+            show(collapsed, usr_input)
+        elif rc == 'e':
+            comment_id = int(usr_input.split('-')[1])
+            if collapsed is None or not collapsed.expand(comment_id):
+                print("Comment with ID={} isn't in the last collapsed item.".format(comment_id))
+            else:
+                show(collapsed, usr_input)
         else:
-            f, f_name = tempfile.mkstemp(suffix=".txt", dir=TMPDIR_PATH, prefix="hn-", text=True)
-            f = os.fdopen(f, mode='w')
+            show(pgs, usr_input)
+
+def show_archive(a: 'archive.Archive'):
+    """Render an archive into a pager, at the width of the terminal."""
+    f, f_name = tempfile.mkstemp(suffix=".txt", dir=TMPDIR_PATH, prefix="hn-", text=True)
+    with os.fdopen(f, mode='w') as f:
+        # rendered a page at a time
+        for rendered in a.render(shutil.get_terminal_size().columns):
+            f.write(rendered)
+    subprocess.run(['less', '-R', f_name])
+
+def show(pgs, usr_input: str):
+    """Render Pages (or anything else that renders like them) into a pager."""
+    import pages
+    f, f_name = tempfile.mkstemp(suffix=".txt", dir=TMPDIR_PATH, prefix="hn-", text=True)
+    f = os.fdopen(f, mode='w')
+    if isinstance(pgs, pages.LazyPages):
+        # only the first page is rendered before the pager opens, and the
+        # rest are appended as they're fetched (less shows them once it's
+        # scrolled past what was there), so long threads open as quickly
+        # as short ones
+        rest = pgs.iter_pages()
+        with profiler.operation('render ' + usr_input.strip()):
+            f.write(pgs.render_page(next(rest)))
+            f.flush()
+        stopped = threading.Event()
+        writer = threading.Thread(target=write_pages, args=(pgs, rest, f, stopped), daemon=True)
+        writer.start()
+        subprocess.run(['less', '-R', f_name])
+        stopped.set()
+        writer.join()
+    else:
+        with profiler.operation('render ' + usr_input.strip()):
             print(pgs, file=f, flush=True)
-            # Using less with -R in MVP to see colored output
-            subprocess.run(['less', '-R', f_name])
-            f.close()
+        # Using less with -R in MVP to see colored output
+        subprocess.run(['less', '-R', f_name])
+    f.close()
+
+def write_pages(pgs: 'pages.Pages', rest, f, stopped: threading.Event):
+    """Render the rest of the Pages into a file being paged, until they run out or stopped is set."""
+    try:
+        for pg in rest:
+            if stopped.is_set():
+                return
+            f.write(pgs.render_page(pg))
+            f.flush()
+        f.write('\n')
+    except Exception as e:
+        f.write("(Couldn't fetch the rest of the pages: {!r})\n".format(e))
+    f.flush()
 
-def handle_input(input: str, pgs: pages.Pages):
+def get_post_pages(item_id: int, prefetcher: 'prefetch.Prefetcher' = None, lazy: bool = False) -> 'pages.Pages':
+    """Get the Pages of a post, from the prefetcher if it has them (fetching them as they're read if lazy)."""
+    import pages
+    pgs = prefetcher.take(item_id) if prefetcher is not None else None
+    return pgs if pgs is not None else pages.get_post_pages_by_id(item_id, lazy=lazy)
+
+def handle_input(input: str, pgs: 'pages.Pages', prefetcher: 'prefetch.Prefetcher' = None):
     """Handle user input and return Pages and a return code."""
     rc = ''
     if input.strip().lower() == 'n':
+        import pages
         pgs = pages.get_news_pages_by_num([1])
     elif input.strip().lower() == 's':
         # save text version of a given page
         rc = 's'
-    elif input.strip().lower() == 'b':
-        # bookmark the ID and title of the last read post
-        rc = 'b'
-    elif input.strip().lower() == 'b-a':
-        # Examine all bookmarks
+    elif input.startswith('o') and len(input.split('-')) > 1:
+        # read or search a saved archive
+        rc = 'o'
+    elif input.strip().lower() == 'b-a' or input.startswith('b-a-'):
+        # examine a page of bookmarks
         rc = 'b-a'
+    elif input.startswith('bt-'):
+        # examine a page of bookmarks with a tag
+        rc = 'bt'
+    elif input.startswith('bo-'):
+        # read a bookmark from its snapshot
+        rc = 'bo'
+    elif input.strip().lower() == 'b' or input.startswith('b-'):
+        # bookmark the last read post, with any tags
+        rc = 'b'
+    elif input.strip().lower() == 'w' or (input.startswith('w') and len(input.split('-')) > 1):
+        # watch the front pages, or show what's changed on them
+        rc = 'w'
+    elif input.strip().lower() == 'm':
+        # print the metrics collected so far
+        rc = 'm'
     elif input.strip().lower() == 'q':
         # quit the program
         rc = QUIT_RC
     elif input.startswith('n') and len(input.split('-')) > 1:
+        import pages
         pg_nums = []
         values = input.split('-')[1]
         values = [int(v) for v in values.split(',')]
         pg_nums.extend(values)
         pgs = pages.get_news_pages_by_num(pg_nums)
     elif input.startswith('r') and len(input.split('-')) > 1:
+        import pages
         item_rank = int(input.split('-')[1])
-        post_id, _ = pages.get_post_by_rank(item_rank)
-        pgs = pages.get_post_pages_by_id(post_id)
+        # the rank may be on the news page being looked at
+        post_id = prefetcher.id_by_rank(item_rank) if prefetcher is not None else None
+        if post_id is None:
+            post_id, _ = pages.get_post_by_rank(item_rank)
+        pgs = get_post_pages(post_id, prefetcher, lazy=True)
+    elif input.startswith('c') and len(input.split('-')) > 1:
+        item_id = int(input.split('-')[1])
+        pgs = get_post_pages(item_id, prefetcher)
+        rc = 'c'
+    elif input.startswith('e') and len(input.split('-')) > 1:
+        # expand part of the last collapsed item
+        rc = 'e'
     elif input.startswith('i') and len(input.split('-')) > 1:
         item_id = int(input.split('-')[1])
-        pgs = pages.get_post_pages_by_id(item_id)
+        pgs = get_post_pages(item_id, prefetcher, lazy=True)
     else:
         # invalid control sequence
         rc = ERROR_RC
@@ -151,4 +415,4 @@ def handle_input(input: str, pgs: pages.Pages):
     return pgs, rc
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
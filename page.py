@@ -1,12 +1,16 @@
-from collections import OrderedDict
-from typing import Dict, Tuple, Any
+from collections import OrderedDict, deque
+from typing import Dict, List, Tuple, Any
 import textwrap
 import math
 import random
 
-from common import get_html, HN_NEWS_URL
-from items import Item, extract_post_item_main, extract_post_item_subtext, extract_post_item_text, \
-    extract_comment_info, extract_comment_tree, extract_comment_tree_ds, ITEM_TYPE
+from common import get_html
+from itemdb import item_db
+from items import Item, extract_post_item_main, extract_post_item_row, extract_post_item_subtext, extract_post_item_text, \
+    extract_comment_info, extract_comment_tree, ITEM_TYPE
+from stream import CommentRowParser, extract_streamed_tree_ds
+from metrics import metrics
+from profiler import timed, stage
 from tree import Tree
 
 import bs4
@@ -17,6 +21,8 @@ colorama.init(autoreset=True)
 COLORS = [Fore.CYAN, Fore.GREEN, Fore.RED, Fore.MAGENTA, Fore.YELLOW, Fore.BLUE]
 
 DEFAULT_PAGE_NUM = 1
+# width, in characters, text is wrapped to when it's rendered
+DEFAULT_WIDTH = 80
 
 class Page(object):
     """Represents a page on Hacker News."""
@@ -39,6 +45,11 @@ class NewsPage(Page):
         self.items = items
     
     def __str__(self):
+        return self.render()
+
+    @timed()
+    def render(self, width: int = DEFAULT_WIDTH) -> str:
+        """Render this Page as text (titles aren't wrapped, so width is unused)."""
         s = ''
         for item_id, rank in self.ranks.items():
             # pick a random color, seed with item ID so it's deterministic (thanks Sam)
@@ -61,18 +72,23 @@ class CommentPage(Page):
         self.comments = comments
 
     def __str__(self):
+        return self.render()
+
+    @timed()
+    def render(self, width: int = DEFAULT_WIDTH) -> str:
+        """Render this Page as text wrapped to width."""
+        s = self.render_item(width)
+        if self.comments is not None:
+            for lineage in self.comments.values():
+                s += render_comment(lineage, width)
+        return s
+
+    def render_item(self, width: int = DEFAULT_WIDTH) -> str:
+        """Render the main comment of this Page (without its replies) as text wrapped to width."""
         s = ''
         s += '{}:\n'.format(self.item.get_user())
-        main_comment = prettify_string(self.item.get_text(), '')
+        main_comment = prettify_string(self.item.get_text(), '', width)
         s += main_comment + '\n'
-        if self.comments is not None:
-            for lineage in self.comments.values():
-                comment = lineage[-1][1]
-                ind = '  ' * len(lineage)
-                s += Fore.BLUE + '{}{}'.format(ind, comment.get_user() + ':')
-                s += '\n'
-                pretty_comment = prettify_string(comment.get_text(), ind)
-                s += pretty_comment
         return s
 
 class PostPage(Page):
@@ -89,13 +105,26 @@ class PostPage(Page):
         self.comments = comments
 
     def __str__(self):
+        return self.render()
+
+    @timed()
+    def render(self, width: int = DEFAULT_WIDTH) -> str:
+        """Render this Page as text wrapped to width."""
+        s = self.render_item(width)
+        if self.comments is not None:
+            for lineage in self.comments.values():
+                s += render_comment(lineage, width)
+        return s
+
+    def render_item(self, width: int = DEFAULT_WIDTH) -> str:
+        """Render the post of this Page (without its comments) as text wrapped to width."""
         s = ''
         random.seed(self.item.get_id())
         color = COLORS[random.randint(0, len(COLORS) - 1)]
         s += '{}{}({}){}\n'.format(color, self.item.get_title(), self.item.get_id(), Fore.RESET)
         main_description = self.item.get_text()
         if main_description is not None:
-            pretty_description = prettify_string(main_description, '')
+            pretty_description = prettify_string(main_description, '', width)
             s += pretty_description
             s += '\n'
         parts = self.item.get_parts()
@@ -104,17 +133,23 @@ class PostPage(Page):
                 s += '\t' + pollitem.get_text() + '\n\t' + pollitem.get_score()
                 s += '\n\n'
             s += '\t===================================\n\n'
-        if self.comments is not None:
-            for lineage in self.comments.values():
-                comment = lineage[-1][1]
-                ind = '  ' * len(lineage)
-                s += Fore.BLUE + '{}{}'.format(ind, comment.get_user() + ':')
-                s += '\n'
-                pretty_comment = prettify_string(comment.get_text(), ind)
-                s += pretty_comment
         return s
 
-def prettify_string(text: str, ind: str, width=80) -> str:
+def render_comment(lineage: List[Tuple[int, Item]], width: int = DEFAULT_WIDTH) -> str:
+    """Render the comment at the end of a lineage, indented by its depth, as text wrapped to width."""
+    comment = lineage[-1][1]
+    return render_comment_text(comment.get_user(), comment.get_text(), len(lineage), width)
+
+def render_comment_text(user: str, text: str, depth: int, width: int = DEFAULT_WIDTH) -> str:
+    """Render a comment by user at depth as text wrapped to width."""
+    ind = '  ' * depth
+    s = Fore.BLUE + '{}{}'.format(ind, user + ':')
+    s += '\n'
+    s += prettify_string(text, ind, width)
+    return s
+
+@timed()
+def prettify_string(text: str, ind: str, width=DEFAULT_WIDTH) -> str:
     """Prettifies a string into a string justified by ind."""
     text_blobs = text.split('<p>')
     fins = ''
@@ -237,9 +272,42 @@ def prettify_string(text: str, ind: str, width=80) -> str:
 # The main extraction function: this function takes the
 # HTML representing any given page on HN and uses indicators
 # in the HTML to determine how to process the page.
+@timed()
 def extract_page(html: str) -> Page:
     """Process HTML of a page on HN and return a Page."""
-    soup = bs4.BeautifulSoup(html, 'html.parser')
+    # Cut the comment rows out of the page so that only the small
+    # skeleton that's left is turned into a soup. The rows are turned
+    # into soups one at a time later on, which keeps the peak memory
+    # used to extract a page with a lot of comments low.
+    comment_rows = deque()
+    if 'comtr' in html:
+        with stage('split_comment_rows'):
+            parser = CommentRowParser(keep_skeleton=True)
+            parser.feed(html)
+            parser.close()
+            html = parser.get_skeleton()
+            comment_rows = parser.rows
+    with stage('soup'):
+        soup = bs4.BeautifulSoup(html, 'html.parser')
+    try:
+        pg = extract_soup_page(soup, comment_rows)
+    finally:
+        # the Page only holds plain Python values, so tear down the
+        # soup now rather than waiting for the garbage collector
+        soup.decompose()
+    metrics.record_items_parsed(type(pg).__name__, count_page_items(pg))
+    return pg
+
+def count_page_items(pg: Page) -> int:
+    """Return the number of Items on a Page."""
+    if isinstance(pg, NewsPage):
+        return len(pg.items)
+    # the main item, and its comments
+    return 1 + len(pg.comments or {})
+
+@timed()
+def extract_soup_page(soup: bs4.BeautifulSoup, comment_rows: deque) -> Page:
+    """Process the soup of a page on HN (without its comment rows) and return a Page."""
     pg_num = extract_page_number(soup)
     has_next = has_next_page(soup)
 
@@ -258,19 +326,22 @@ def extract_page(html: str) -> Page:
     subtext_td = soup.find('td', attrs={'class': 'subtext'})
     is_comment_page = True if subtext_td is None else False
 
+    # pages without a comment tree have no comment rows to extract
+    comment_tree_table = soup.find('table', attrs={'class' : 'comment-tree'})
+    if comment_tree_table is None:
+        comment_rows = None
+
     if is_comment_page:
         # construct Comment Page object
         comment_tr = soup.find('tr', attrs={'class' : 'athing'})
-        comment_tree_table = soup.find('table', attrs={'class' : 'comment-tree'})
-        item, comment_tree = extract_comment_page(comment_tr, comment_tree_table)
+        item, comment_tree = extract_comment_page(comment_tr, comment_rows)
         return CommentPage(pg_num, has_next, item=item, comments=comment_tree)
     else:
         # construct Post Page object
         fatitem_table = soup.find('table', attrs={'class': 'fatitem'})
         post_tr = soup.find('tr', attrs={'class' : 'athing'})
         post_td = soup.find('td', attrs={'class' : 'subtext'})
-        comment_tree_table = soup.find('table', attrs={'class' : 'comment-tree'})
-        item, comment_tree = extract_post_page(fatitem_table, post_tr, post_td, comment_tree_table)
+        item, comment_tree = extract_post_page(fatitem_table, post_tr, post_td, comment_rows)
         return PostPage(pg_num, has_next, item=item, comments=comment_tree)
 
 # Extraction functions: these functions extract Items and information
@@ -278,6 +349,7 @@ def extract_page(html: str) -> Page:
 # corresponding to a given page on HN. To extract individual items,
 # a lot of these function call other, Item abstraction level functions
 # located in items.py
+@timed()
 def extract_page_number(s: bs4.BeautifulSoup):
     """Return the page number for a given page."""
     pagetop_span = s.find('span', attrs={'class': 'pagetop'})
@@ -292,6 +364,7 @@ def extract_page_number(s: bs4.BeautifulSoup):
         else:
             return DEFAULT_PAGE_NUM
 
+@timed()
 def has_next_page(s: bs4.BeautifulSoup):
     """Return boolean indicating if there is a next page or not."""
     more_a = s.find('a', attrs={'class': 'morelink'})
@@ -302,107 +375,120 @@ def has_next_page(s: bs4.BeautifulSoup):
         # there's a next page
         return True
 
-def extract_comment_page(comment_tr: bs4.Tag, comment_tree_table: bs4.Tag) -> Tuple[Item, Tree]:
+@timed()
+def extract_comment_page(comment_tr: bs4.Tag, comment_rows: deque) -> Tuple[Item, Tree]:
     """Process HTML for a comment page."""
 
     # extract main comment info
     main_item_id = int(comment_tr['id'])
     content = extract_comment_info(comment_tr)
-    item = Item(main_item_id, content=content)
+    # the comment tree stays on the Page, since the interned Item is
+    # shared with every other Page the comment is on
+    item = item_db.intern(Item(main_item_id, content=content))
 
     # extract comment tree
     comment_tree = None
-    if comment_tree_table is not None:
-        comment_tree_ds = extract_comment_tree_ds(comment_tree_table)
+    if comment_rows is not None:
+        comment_tree_ds = extract_streamed_tree_ds(comment_rows)
         comment_tree = extract_comment_tree(main_item_id, comment_tree_ds)
-    item.content.update({'kids': comment_tree})
 
     return item, comment_tree 
 
+@timed()
 def extract_post_page(fatitem_table: bs4.Tag, post_tr: bs4.Tag, post_td: bs4.Tag,
-    comment_tree_table: bs4.Tag) -> Tuple[Item, Dict]:
+    comment_rows: deque) -> Tuple[Item, Dict]:
     """Process HTML for a post page."""
     
     # extract main post info
     main_item_id = int(post_tr['id'])
     content = extract_post_item_main(post_tr)
-    item = Item(main_item_id, content=content)
 
     # extract subtext info
     _, subtext_info = extract_post_item_subtext(post_td)
-    item.content.update(subtext_info)
+    content.update(subtext_info)
 
     # extract text content of the post based on the type
     # of the post (Story, Job, Poll)
-    text, pollopts = extract_post_item_text(item.content['type'], fatitem_table)
-    item.content.update({'text' : text})
+    text, pollopts = extract_post_item_text(content['type'], fatitem_table)
+    content.update({'text' : text})
     # add polloptions to the 'parts' member of this item
     if pollopts:
-        item.content.update({'parts': pollopts})
+        content.update({'parts': pollopts})
+
+    # the content is complete, so intern it in one go (the comment tree
+    # stays on the Page, as in extract_comment_page)
+    item = item_db.intern(Item(main_item_id, content=content))
 
     # extract comment tree, if applicable
     comment_tree = None
-    if item.content['type'] != ITEM_TYPE['JOB'] and comment_tree_table is not None:
-        comment_tree_ds = extract_comment_tree_ds(comment_tree_table)
+    if content['type'] != ITEM_TYPE['JOB'] and comment_rows is not None:
+        comment_tree_ds = extract_streamed_tree_ds(comment_rows)
         comment_tree = extract_comment_tree(main_item_id, comment_tree_ds)
-        item.content.update({'kids': comment_tree})
 
     return item, comment_tree
 
-def extract_news_page(t: bs4.Tag) -> Tuple[Dict, Dict]:
-    """Process HTML for a news page."""
+@timed()
+def extract_news_page(t: bs4.Tag, resolve_types: bool = True,
+    with_subtext: bool = True, intern: bool = True) -> Tuple[Dict, Dict]:
+    """Process HTML for a news page (interning its Items unless intern is False)."""
     items = OrderedDict()
     ranks = dict()
-
+    # Items extracted without their types or subtext are missing fields,
+    # and interning them would drop those fields from the live Items, so
+    # they're only interned when asked for
+    finish = item_db.intern if intern else (lambda item: item)
+
+    # Walk the rows of the itemlist once. Each post is a <tr> with class
+    # 'athing', and the <tr> right after it holds that post's subtext, so
+    # the two can be paired up as we go instead of matching them by ID.
+    # A post's content is only complete after its subtext row, so that's
+    # when it's interned (or when the next post starts, if it has none).
+    pending = None
     for child in t.children:
-        if child == '\n' or bool(child.contents) is False:
+        if not isinstance(child, bs4.Tag) or bool(child.contents) is False:
             continue
-        # <tr> tags with class 'athing' are posts
-        if child.has_attr('class') and child['class'][0] == 'athing':
+        child_class = child.get('class')
+        if child_class is not None and child_class[0] == 'athing':
+            if pending is not None:
+                items[pending[0]] = finish(Item(*pending))
             # post title with story URL, rank, and site string
             item_id = int(child['id'])
-            content = extract_post_item_main(child)
-            ranks[item_id] = extract_rank(child)
-            items[item_id] = Item(item_id, content=content)
-        else:
-            # most of the other <tr> tags are subtexts under the post
-            subtext_td = child.find('td', attrs={'class' : 'subtext'})
+            ranks[item_id], content = extract_post_item_row(child, resolve_types)
+            pending = (item_id, content)
+        elif pending is not None and with_subtext:
+            # the subtext <td> is a direct child of the subtext row
+            subtext_td = child.find('td', attrs={'class' : 'subtext'}, recursive=False)
             if subtext_td is not None:
-                item_id, subtext_info = extract_post_item_subtext(subtext_td)
-                # find the appropriate Item and update its content
-                i = items[item_id]
-                i.content.update(subtext_info)
+                _, subtext_info = extract_post_item_subtext(subtext_td)
+                pending[1].update(subtext_info)
+            items[pending[0]] = finish(Item(*pending))
+            pending = None
+    if pending is not None:
+        items[pending[0]] = finish(Item(*pending))
 
     return ranks, items
 
+@timed()
 def extract_ranks(html_or_tag: Any) -> Dict[int, Tuple[int, str]]:
     """Extracts all of the ranks for the Items on a given News Page."""
     # this way, we can pass in pre-bs4'd stuff or raw stuff
     if type(html_or_tag) is str:
-        itemlist_table = bs4.BeautifulSoup(html_or_tag, 'html.parser')
+        soup = bs4.BeautifulSoup(html_or_tag, 'html.parser')
     else:
-        itemlist_table = html_or_tag
+        soup = html_or_tag
 
-    ranks = {}
-    # get all <tr> with class 'id' and class 'athing'
-    athing_trs = itemlist_table.find_all('tr', attrs={'class': 'athing'})
-    for tr in athing_trs:
-        item_id = int(tr['id'])
-
-        # extract text of <span> element with class of "rank"
-        rank_span = tr.find('span', attrs={'class': 'rank'})
-        rank_text = rank_span.text
-        rank = int(rank_text[0:len(rank_text) - 1])
+    if soup.name == 'table' and 'itemlist' in soup.get('class', []):
+        itemlist_table = soup
+    else:
+        itemlist_table = soup.find('table', attrs={'class': 'itemlist'})
 
-        storylink_a = tr.find('a', attrs={'class': 'storylink'})
-        title = storylink_a.text
+    # only the ranks and titles are needed here, so skip the rest
+    item_ranks, items = extract_news_page(itemlist_table, resolve_types=False,
+        with_subtext=False, intern=False)
+    ranks = {}
+    for item_id, rank in item_ranks.items():
+        ranks[rank] = (item_id, items[item_id].get_title())
 
-        ranks[rank] = (item_id, title)
+    if type(html_or_tag) is str:
+        soup.decompose()
     return ranks
-
-def extract_rank(t: bs4.Tag) -> int:
-    """Extract rank from an Item on a news page."""
-    # get rank, if it exists
-    rank_span = t.find('span', attrs={'class': 'rank'})
-    rank = int(rank_span.string.split('.')[0]) if rank_span.string else ''
-    return rank
@@ -1,10 +1,19 @@
-from typing import List, Tuple
+from typing import Callable, Dict, Iterator, List, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import math
+import threading
 
-from page import Page, NewsPage, PostPage, CommentPage, extract_page, extract_ranks, DEFAULT_PAGE_NUM
-from common import get_html, HN_ITEMS_URL, HN_NEWS_URL
+from page import Page, NewsPage, PostPage, CommentPage, extract_page, extract_ranks, DEFAULT_PAGE_NUM, \
+    DEFAULT_WIDTH
+import common
+from common import get_html
+from profiler import profiler, timed
+from scheduler import scheduler
 
 ITEMS_PER_NEWS_PAGE = 30
+# number of already-read pages a LazyPages object keeps around
+# behind its cursor before dropping them (they're refetched on demand)
+PAGES_KEPT_BEHIND = 2
 
 class Pages(object):
     """Represents a collection of Pages on HN."""
@@ -18,11 +27,24 @@ class Pages(object):
         self.page_type = type(self.pages[0])
 
     def __str__(self):
+        return self.render()
+
+    @timed()
+    def render(self, width: int = DEFAULT_WIDTH) -> str:
+        """Render every Page as text wrapped to width."""
         s = ''
-        for p in self.pages:
-            s += '(page {}):\n{}\n'.format(p.pg_number, p)
+        for p in self.iter_pages():
+            s += self.render_page(p, width)
         return s
 
+    def render_page(self, pg: Page, width: int = DEFAULT_WIDTH) -> str:
+        """Render one of the Pages as text wrapped to width, headed by its page number."""
+        return '(page {}):\n{}\n'.format(pg.pg_number, pg.render(width))
+
+    def iter_pages(self) -> Iterator[Page]:
+        """Get the Pages one at a time."""
+        return iter(self.pages)
+
     def get_current_page(self):
         """Get the current Page."""
         return self.pages[self.current_page - 1]
@@ -48,15 +70,134 @@ class Pages(object):
         else:
             return None
 
-def get_post_pages_by_id(item_id: int) -> Pages:
+class LazyPages(Pages):
+    """Represents a collection of Pages on HN that are fetched and parsed on demand."""
+    page_url: Callable[[int], str] = None
+    keep_behind: int = None
+
+    def __init__(self, page_url: Callable[[int], str], current_page: int = DEFAULT_PAGE_NUM,
+        keep_behind: int = PAGES_KEPT_BEHIND):
+        # page_url maps a page number to the URL of that page on HN
+        self.page_url = page_url
+        self.current_page = current_page
+        self.keep_behind = keep_behind
+        self._cache: Dict[int, Page] = {}
+        self._prefetches: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        # a single worker is enough to stay one page ahead of the reader
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.page_type = type(self.get_current_page())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        # the worker thread outlives this object unless it's stopped
+        if getattr(self, '_executor', None) is not None:
+            self.close()
+
+    @property
+    def pages(self) -> List[Page]:
+        """Get all of the Pages, fetching any that haven't been loaded yet."""
+        return list(self.iter_pages())
+
+    def iter_pages(self) -> Iterator[Page]:
+        """Get the Pages one at a time, fetching each when it's needed and prefetching the one after it."""
+        pg_num = DEFAULT_PAGE_NUM
+        while True:
+            pg = self._load_page(pg_num)
+            # only the pages around the cursor and around this iteration
+            # are kept, so rendering a whole thread doesn't keep it all
+            self._evict_behind(pg_num)
+            if pg.has_next:
+                self._prefetch(pg_num + 1)
+            yield pg
+            if not pg.has_next:
+                return
+            pg_num += 1
+
+    def get_current_page(self):
+        """Get the current Page, fetching it if necessary."""
+        pg = self._load_page(self.current_page)
+        self._evict_behind()
+        if pg.has_next:
+            self._prefetch(self.current_page + 1)
+        return pg
+
+    def close(self):
+        """Cancel any outstanding prefetches and stop the background worker."""
+        with self._lock:
+            self._closed = True
+            for future in self._prefetches.values():
+                future.cancel()
+            self._prefetches.clear()
+        self._executor.shutdown(wait=False)
+
+    def _fetch_page(self, pg_num: int) -> Page:
+        return fetch_page(self.page_url(pg_num))
+
+    def _load_page(self, pg_num: int) -> Page:
+        with self._lock:
+            pg = self._cache.get(pg_num, None)
+            future = self._prefetches.pop(pg_num, None)
+        if pg is not None:
+            return pg
+
+        # use the prefetched copy if there is one, even if it's still
+        # in flight, instead of requesting the same page twice
+        if future is not None:
+            # the reader is waiting on it now, so stop treating it as a
+            # prefetch that can wait for the interactive requests
+            scheduler.promote(self.page_url(pg_num))
+            pg = future.result()
+        else:
+            pg = self._fetch_page(pg_num)
+        with self._lock:
+            self._cache[pg_num] = pg
+        return pg
+
+    def _prefetch(self, pg_num: int):
+        with self._lock:
+            if self._closed or pg_num in self._cache or pg_num in self._prefetches:
+                return
+            self._prefetches[pg_num] = self._executor.submit(self._prefetch_page, pg_num)
+
+    def _prefetch_page(self, pg_num: int) -> Page:
+        with scheduler.background():
+            return self._fetch_page(pg_num)
+
+    def _evict_behind(self, iter_page: int = None):
+        # only keep a bounded number of pages behind the cursor (and
+        # behind the page being iterated over, if any) so memory doesn't
+        # grow with how far into a thread the reader has gone
+        def kept(n: int) -> bool:
+            return self.current_page - self.keep_behind <= n <= self.current_page or \
+                (iter_page is not None and iter_page - self.keep_behind <= n <= iter_page)
+        with self._lock:
+            for pg_num in [n for n in self._cache if not kept(n)]:
+                del self._cache[pg_num]
+
+def fetch_page(url: str) -> Page:
+    """Fetch and extract the Page at the given URL."""
+    with profiler.page(url):
+        return extract_page(get_html(url))
+
+def get_post_pages_by_id(item_id: int, lazy: bool = False) -> Pages:
     """Get Post Pages based on an Item ID."""
+    url = common.HN_ITEMS_URL + '?id={}'.format(item_id)
+    if lazy:
+        return LazyPages(lambda pg_num: url if pg_num == DEFAULT_PAGE_NUM else url + '&p={}'.format(pg_num))
+
     pages = []
-    url = HN_ITEMS_URL + '?id={}'.format(item_id)
-    pg = extract_page(get_html(url))
+    pg = fetch_page(url)
     pages.append(pg)
     while(pg.has_next):
         newurl = url + '&p={}'.format(pg.pg_number + 1)
-        pg = extract_page(get_html(newurl))
+        pg = fetch_page(newurl)
         pages.append(pg)
 
     return Pages(pages)
@@ -68,16 +209,17 @@ def get_post_by_rank(rank: int) -> Tuple[int, str]:
     page_num = rank / ITEMS_PER_NEWS_PAGE
     page_num = int(math.ceil(page_num))
 
-    url = HN_NEWS_URL + '?p={}'.format(page_num)
-    ranks = extract_ranks(get_html(url))
+    url = common.HN_NEWS_URL + '?p={}'.format(page_num)
+    with profiler.page(url):
+        ranks = extract_ranks(get_html(url))
     return ranks[rank]
 
 def get_news_pages_by_num(page_nums: List[int]) -> Pages:
     """Get News Pages indicated by a list of numbers."""
     pages = []
     for page_num in page_nums:
-        url = HN_NEWS_URL + '?p={}'.format(page_num)
-        pg = extract_page(get_html(url))
+        url = common.HN_NEWS_URL + '?p={}'.format(page_num)
+        pg = fetch_page(url)
         pages.append(pg)
 
     return Pages(pages)
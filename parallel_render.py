@@ -0,0 +1,94 @@
+"""Rendering very large Pages on a pool of processes.
+
+Formatting comments (wrapping, indenting and styling them in
+prettify_string) is CPU bound, so threads don't speed it up. Instead,
+the comments of every Page are split into chunks of plain (user, text,
+depth) tuples, each chunk is formatted by render_comment_text in a
+worker process, and the chunks are joined back together in order, giving
+exactly what Pages.render would have.
+"""
+from typing import List, Tuple, Union
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+import os
+
+from page import NewsPage, DEFAULT_WIDTH, render_comment_text
+from pages import Pages
+from profiler import timed
+
+# comments formatted by a worker at a time
+DEFAULT_CHUNK_SIZE = 250
+# Pages with fewer comments than this in total are rendered in this
+# process, since it's quicker than sending them to the workers
+DEFAULT_MIN_COMMENTS = 1000
+
+def render_chunk(comments: List[Tuple[str, str, int]], width: int) -> str:
+    """Render a chunk of (user, text, depth) comments as text wrapped to width."""
+    return ''.join(render_comment_text(user, text, depth, width) for user, text, depth in comments)
+
+def count_comments(pgs: Pages) -> int:
+    return sum(len(getattr(pg, 'comments', None) or {}) for pg in pgs.pages)
+
+class ParallelRenderer(object):
+    """Renders Pages with their comments formatted a chunk at a time on a pool of worker processes."""
+    workers: int = None
+    chunk_size: int = None
+    min_comments: int = None
+
+    def __init__(self, workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+        min_comments: int = DEFAULT_MIN_COMMENTS):
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.min_comments = min_comments
+        self._executor: ProcessPoolExecutor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        """Start the worker processes (which is otherwise done by the first parallel render)."""
+        if self._executor is None:
+            # workers are spawned rather than forked, since forking while
+            # the scheduler's and watcher's threads hold locks can leave
+            # those locks held forever in the workers
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'))
+            # wait for the workers to have imported what they need, so
+            # the first render doesn't pay for it
+            list(self._executor.map(render_chunk, [[]] * self.workers, [DEFAULT_WIDTH] * self.workers))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @timed()
+    def render(self, pgs: Pages, width: int = DEFAULT_WIDTH) -> str:
+        """Render every Page as text wrapped to width, exactly as Pages.render would."""
+        if count_comments(pgs) < self.min_comments:
+            return pgs.render(width)
+        self.start()
+        # the chunks are sent off first, and everything else is rendered
+        # here while they're being formatted
+        parts: List[Union[str, Future]] = []
+        for pg in pgs.pages:
+            parts.append('(page {}):\n'.format(pg.pg_number))
+            if isinstance(pg, NewsPage):
+                parts.append(pg.render(width))
+            else:
+                parts.append(pg.render_item(width))
+                if pg.comments is not None:
+                    parts.extend(self._submit(list(pg.comments.values()), width))
+            parts.append('\n')
+        return ''.join(part if isinstance(part, str) else part.result() for part in parts)
+
+    def _submit(self, lineages: List, width: int) -> List[Future]:
+        futures = []
+        for start in range(0, len(lineages), self.chunk_size):
+            chunk = [(lineage[-1][1].get_user(), lineage[-1][1].get_text(), len(lineage))
+                for lineage in lineages[start:start + self.chunk_size]]
+            futures.append(self._executor.submit(render_chunk, chunk, width))
+        return futures
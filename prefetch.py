@@ -0,0 +1,186 @@
+"""Predictive prefetching of the threads most likely to be read next from a news page.
+
+While a news page is being looked at, the threads of its top K posts (by
+rank or by number of comments) are fetched and parsed in the background,
+within budgets on how many requests are in flight, how many bytes are
+fetched and how much memory the prefetched Pages may take up. Moving on
+to anything else cancels whatever hasn't been fetched yet.
+"""
+from typing import Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+
+from page import Page, NewsPage, extract_page
+from pages import Pages
+import common
+from common import get_html
+from profiler import profiler
+from scheduler import scheduler
+
+DEFAULT_K = 3
+# what the top K posts are picked by
+BY_RANK = 'rank'
+BY_COMMENTS = 'comments'
+DEFAULT_CONCURRENCY = 2
+# HTML fetched per news page looked at
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+# memory the prefetched Pages may take up, estimated from their HTML
+DEFAULT_MAX_MEMORY = 32 * 1024 * 1024
+# a parsed Page holds on to about twice the size of its HTML (see the
+# retained memory budget in benchmarks/memory.py)
+MEMORY_PER_HTML_BYTE = 2
+
+class PrefetchCancelled(Exception):
+    """Raised inside of a prefetch that's been cancelled or has run out of budget."""
+    pass
+
+class Prefetcher(object):
+    """Prefetches the threads of the top k posts on the news page being looked at."""
+    k: int = None
+    by: str = None
+
+    def __init__(self, k: int = DEFAULT_K, by: str = BY_RANK, concurrency: int = DEFAULT_CONCURRENCY,
+        max_bytes: int = DEFAULT_MAX_BYTES, max_memory: int = DEFAULT_MAX_MEMORY):
+        if by not in (BY_RANK, BY_COMMENTS):
+            raise ValueError("Can't pick posts by {!r}, expected {!r} or {!r}".format(by, BY_RANK, BY_COMMENTS))
+        self.k = k
+        self.by = by
+        self.max_bytes = max_bytes
+        self.max_memory = max_memory
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._lock = threading.Lock()
+        # each news page looked at starts a new generation, and prefetches
+        # from older ones stop at their next request
+        self._generation = 0
+        self._futures: Dict[int, Future] = {}
+        self._ranks: Dict[int, int] = {}
+        self._bytes = 0
+        # estimated memory held by each prefetched thread
+        self._held: Dict[int, int] = {}
+        # how well the predictions are doing
+        self.predicted = 0
+        self.prefetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.over_budget = 0
+
+    def predict(self, pg: NewsPage) -> List[int]:
+        """Get the IDs of the k posts on a news page most likely to be read next."""
+        if self.by == BY_COMMENTS:
+            ids = sorted(pg.ranks, key=lambda item_id: pg.items[item_id].get_total_comments() or 0, reverse=True)
+        else:
+            ids = sorted(pg.ranks, key=lambda item_id: pg.ranks[item_id])
+        return ids[:self.k]
+
+    def start(self, pg: NewsPage):
+        """Cancel any prefetches in progress and start prefetching for a news page."""
+        self.cancel()
+        with self._lock:
+            generation = self._generation
+            self._ranks = {rank: item_id for item_id, rank in pg.ranks.items()}
+            self._bytes = 0
+            for item_id in self.predict(pg):
+                self._futures[item_id] = self._executor.submit(self._prefetch, item_id, generation)
+                self.predicted += 1
+
+    def cancel(self):
+        """Stop prefetching, and drop whatever's been prefetched."""
+        with self._lock:
+            self._generation += 1
+            futures, self._futures = self._futures, {}
+            self._ranks = {}
+            self._held = {}
+        for future in futures.values():
+            # prefetches that haven't started never will, and those that
+            # have stop before their next request
+            if future.cancel() or not future.done():
+                self.cancelled += 1
+
+    def show(self, pgs: Pages):
+        """Prefetch for the Pages being looked at if they're news pages, and stop prefetching if not."""
+        pg = pgs.get_current_page() if pgs is not None else None
+        if isinstance(pg, NewsPage):
+            self.start(pg)
+        else:
+            self.cancel()
+
+    def close(self):
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+    def id_by_rank(self, rank: int) -> Optional[int]:
+        """Get the ID of the post at a rank on the news page being looked at, if it's on it."""
+        with self._lock:
+            return self._ranks.get(rank, None)
+
+    def take(self, item_id: int) -> Optional[Pages]:
+        """Get the prefetched Pages of a thread (waiting for them if they're in flight), or None."""
+        with self._lock:
+            future = self._futures.pop(item_id, None)
+            self._held.pop(item_id, None)
+        pgs = None
+        if future is not None:
+            # the reader is waiting on it now, so stop treating it as a
+            # prefetch that can wait for the interactive requests
+            scheduler.promote(self.thread_url(item_id))
+            try:
+                pgs = future.result()
+            except Exception:
+                pgs = None
+        if pgs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return pgs
+
+    def thread_url(self, item_id: int, pg_num: int = 1) -> str:
+        url = common.HN_ITEMS_URL + '?id={}'.format(item_id)
+        return url if pg_num == 1 else url + '&p={}'.format(pg_num)
+
+    def _check(self, generation: int):
+        if generation != self._generation:
+            raise PrefetchCancelled()
+
+    def _prefetch(self, item_id: int, generation: int) -> Pages:
+        pages: List[Page] = []
+        memory = 0
+        pg_num = 1
+        try:
+            while True:
+                with self._lock:
+                    self._check(generation)
+                    if self._bytes >= self.max_bytes or sum(self._held.values()) + memory >= self.max_memory:
+                        self.over_budget += 1
+                        raise PrefetchCancelled()
+                url = self.thread_url(item_id, pg_num)
+                with scheduler.background():
+                    html = get_html(url)
+                with self._lock:
+                    self._bytes += len(html)
+                with profiler.page(url):
+                    pg = extract_page(html)
+                memory += len(html) * MEMORY_PER_HTML_BYTE
+                pages.append(pg)
+                if not pg.has_next:
+                    break
+                pg_num += 1
+            with self._lock:
+                self._check(generation)
+                # it may have been taken while it was being fetched
+                if item_id in self._futures:
+                    self._held[item_id] = memory
+            self.prefetched += 1
+            return Pages(pages)
+        except PrefetchCancelled:
+            # only whole threads are kept, so a partial one is dropped
+            return None
+
+    def report(self) -> str:
+        """Get a summary of how often the prefetched threads were the ones read next."""
+        taken = self.hits + self.misses
+        hit_rate = self.hits / taken if taken else 0.0
+        return ('Prefetch (top {} by {}): {} predicted, {} prefetched, {} cancelled, {} over budget\n'
+            '{} of {} threads read were prefetched ({:.0%} hit rate), {:.0%} of predictions were read').format(
+            self.k, self.by, self.predicted, self.prefetched, self.cancelled, self.over_budget,
+            self.hits, taken, hit_rate, self.hits / self.predicted if self.predicted else 0.0)
@@ -0,0 +1,188 @@
+"""Stage-level profiling of the fetch -> parse -> build -> render pipeline."""
+from typing import Callable, Dict, List, Tuple
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+class Profiler(object):
+    """Collects how long each stage of the pipeline takes, page by page."""
+    enabled: bool = None
+    # whether to run each operation under cProfile, keeping the slowest one
+    cprofile: bool = None
+    # (page, stage, duration) for every timed call, in the order they finished
+    records: List[Tuple[str, str, float]] = None
+    # callables taking a stage name and a duration in seconds, called
+    # every time a stage finishes
+    hooks: List[Callable[[str, float], None]] = None
+
+    def __init__(self):
+        self.enabled = False
+        self.cprofile = False
+        self.records = []
+        self.hooks = []
+        self.slowest_operation = None
+        self.slowest_duration = 0.0
+        self.slowest_stats = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        """Whether timings are being collected by anything at all."""
+        return self.enabled or bool(self.hooks)
+
+    def add_hook(self, hook: Callable[[str, float], None]):
+        """Call hook with the name and duration of every stage that finishes."""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook: Callable[[str, float], None]):
+        """Stop calling a previously added hook."""
+        self.hooks.remove(hook)
+
+    def record(self, stage_name: str, duration: float):
+        """Record that a stage took duration seconds."""
+        if self.enabled:
+            page = getattr(self._local, 'page', None)
+            with self._lock:
+                self.records.append((page, stage_name, duration))
+        for hook in self.hooks:
+            hook(stage_name, duration)
+
+    @contextmanager
+    def stage(self, stage_name: str):
+        """Time the code run inside of the with block as a stage."""
+        if not self.active:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage_name, time.perf_counter() - start)
+
+    @contextmanager
+    def page(self, label: str):
+        """Attribute every stage run inside of the with block to a page."""
+        previous = getattr(self._local, 'page', None)
+        self._local.page = label
+        try:
+            yield
+        finally:
+            self._local.page = previous
+
+    @contextmanager
+    def operation(self, name: str):
+        """Time a whole operation, keeping cProfile stats for the slowest one."""
+        if not self.enabled:
+            yield
+            return
+        prof = None
+        if self.cprofile:
+            import cProfile
+            prof = cProfile.Profile()
+            prof.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            if prof is not None:
+                prof.disable()
+            if duration > self.slowest_duration:
+                self.slowest_operation = name
+                self.slowest_duration = duration
+                self.slowest_stats = prof
+
+    def reset(self):
+        """Forget everything that's been recorded so far."""
+        with self._lock:
+            self.records = []
+        self.slowest_operation = None
+        self.slowest_duration = 0.0
+        self.slowest_stats = None
+
+    def get_stage_totals(self) -> Dict[str, Tuple[int, float, float]]:
+        """Get the number of calls, total and maximum duration of each stage."""
+        totals = OrderedDict()
+        with self._lock:
+            records = list(self.records)
+        for _, stage_name, duration in records:
+            calls, total, longest = totals.get(stage_name, (0, 0.0, 0.0))
+            totals[stage_name] = (calls + 1, total + duration, max(longest, duration))
+        return totals
+
+    def get_page_totals(self) -> Dict[str, Dict[str, float]]:
+        """Get the total duration of each stage, page by page."""
+        totals = OrderedDict()
+        with self._lock:
+            records = list(self.records)
+        for page, stage_name, duration in records:
+            if page is None:
+                continue
+            stages = totals.setdefault(page, OrderedDict())
+            stages[stage_name] = stages.get(stage_name, 0.0) + duration
+        return totals
+
+    def report(self) -> str:
+        """Get a table breaking down the time spent in each stage."""
+        s = 'Stage breakdown (times are inclusive of any stages nested inside):\n'
+        s += '{:<40} {:>8} {:>12} {:>10} {:>10}\n'.format('stage', 'calls', 'total (ms)', 'mean (ms)', 'max (ms)')
+        stage_totals = sorted(self.get_stage_totals().items(), key=lambda st: st[1][1], reverse=True)
+        for stage_name, (calls, total, longest) in stage_totals:
+            s += '{:<40} {:>8} {:>12.2f} {:>10.3f} {:>10.2f}\n'.format(stage_name, calls, total * 1000,
+                total * 1000 / calls, longest * 1000)
+
+        page_totals = self.get_page_totals()
+        if page_totals:
+            s += '\nPer-page breakdown:\n'
+            s += '{:<60} {:>12} {:>12} {:>12}\n'.format('page', 'fetch (ms)', 'parse (ms)', 'slowest stage')
+            for page, stages in page_totals.items():
+                slowest = max((st for st in stages if st not in PAGE_STAGES), key=stages.get, default='')
+                s += '{:<60} {:>12.2f} {:>12.2f} {:>12}\n'.format(page, stages.get('get_html', 0.0) * 1000,
+                    stages.get('extract_page', 0.0) * 1000, slowest)
+
+        if self.slowest_operation is not None:
+            s += '\nSlowest operation: {!r} ({:.2f} ms)\n'.format(self.slowest_operation,
+                self.slowest_duration * 1000)
+        return s
+
+    def dump_slowest(self, path: str, limit: int = 20) -> str:
+        """Dump the cProfile stats of the slowest operation to path, returning a summary of them."""
+        if self.slowest_stats is None:
+            return ''
+        import io
+        import pstats
+        self.slowest_stats.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(self.slowest_stats, stream=out).sort_stats('cumulative').print_stats(limit)
+        return out.getvalue()
+
+# stages that make up a whole page, rather than some part of one
+PAGE_STAGES = ('get_html', 'extract_page')
+
+# The Profiler used throughout the application
+profiler = Profiler()
+
+def stage(stage_name: str):
+    """Time the code run inside of the with block as a stage of the global Profiler."""
+    return profiler.stage(stage_name)
+
+def timed(stage_name: str = None):
+    """Decorate a function so that every call of it is timed as a stage."""
+    def decorator(fn: Callable) -> Callable:
+        name = stage_name if stage_name is not None else fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            # keep the cost of an untimed call down to a single check
+            if not profiler.active:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
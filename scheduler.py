@@ -0,0 +1,196 @@
+"""A fetch scheduler shared by everything that makes requests to HN."""
+from typing import Any, Callable, Dict, List, Optional
+from concurrent.futures import Future
+from contextlib import contextmanager
+import asyncio
+import os
+import threading
+import time
+
+# priorities of requests, where lower numbers go first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+def check_rate(rate: Optional[float]) -> Optional[float]:
+    """Check that a rate limit is above 0 requests per second (or None, for no limit), returning it."""
+    # written so that NaN fails too
+    if rate is not None and not rate > 0:
+        raise ValueError('A rate limit has to be above 0 requests per second, not {}'.format(rate))
+    return rate
+
+def rate_from_env() -> Optional[float]:
+    """Get the rate limit set by the RICH_HN_RATE_LIMIT environment variable, or None if it isn't set."""
+    value = os.environ.get('RICH_HN_RATE_LIMIT', None)
+    if value is None:
+        return None
+    try:
+        return check_rate(float(value))
+    except ValueError as e:
+        raise ValueError('Invalid RICH_HN_RATE_LIMIT {!r}: {}'.format(value, e)) from None
+
+# requests per second made to HN (and the HN API) in total, and how
+# many can be made at once after a quiet spell, or unlimited if not set
+DEFAULT_RATE = rate_from_env()
+DEFAULT_BURST = 5
+# seconds between checks of whether it's an async request's turn to go
+ASYNC_POLL_INTERVAL = 0.01
+
+class Request(object):
+    """A request being made, shared by every caller waiting on its result."""
+    key: str = None
+    priority: int = None
+    future: Future = None
+
+    def __init__(self, key: str, priority: int):
+        self.key = key
+        self.priority = priority
+        self.future = Future()
+
+class FetchScheduler(object):
+    """De-duplicates in-flight requests and rate limits requests with a token bucket.
+
+    Interactive requests are given tokens before background ones (i.e.
+    prefetches), and a background request that an interactive caller
+    starts waiting on is promoted to interactive.
+    """
+    # tokens added to the bucket per second, or None for no rate limit
+    rate: float = None
+    # the most tokens the bucket holds
+    burst: int = None
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST):
+        self.rate = check_rate(rate)
+        self.burst = burst
+        self.requests_made = 0
+        self.requests_coalesced = 0
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._in_flight: Dict[str, Request] = {}
+        self._waiting: List[Request] = []
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def configure(self, rate: float = None, burst: int = DEFAULT_BURST):
+        """Change the rate limit, where a rate of None means no limit."""
+        check_rate(rate)
+        with self._cond:
+            self.rate = rate
+            self.burst = burst
+            self._tokens = min(self._tokens, float(burst))
+            self._cond.notify_all()
+
+    @property
+    def priority(self) -> int:
+        """The priority of requests made from the current thread."""
+        return getattr(self._local, 'priority', INTERACTIVE)
+
+    @contextmanager
+    def background(self):
+        """Make every request made inside of the with block (on this thread) a background request."""
+        previous = self.priority
+        self._local.priority = BACKGROUND
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def fetch(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Return fn(), unless a request for key is already in flight, in which case wait for its result."""
+        priority = self.priority
+        with self._cond:
+            request = self._in_flight.get(key, None)
+            if request is not None:
+                self.requests_coalesced += 1
+                if priority < request.priority:
+                    request.priority = priority
+                    self._cond.notify_all()
+                owner = False
+            else:
+                request = self._in_flight[key] = Request(key, priority)
+                owner = True
+        if not owner:
+            return request.future.result()
+
+        try:
+            self._acquire(request)
+            result = fn()
+        except BaseException as e:
+            request.future.set_exception(e)
+            raise
+        else:
+            request.future.set_result(result)
+            return result
+        finally:
+            with self._cond:
+                del self._in_flight[key]
+
+    def acquire(self):
+        """Wait for the rate limit to allow a request that can't be shared (i.e. a streamed one)."""
+        self._acquire(Request(None, self.priority))
+
+    def promote(self, key: str):
+        """Make an in-flight request for key interactive, if there is one."""
+        with self._cond:
+            request = self._in_flight.get(key, None)
+            if request is not None and request.priority > INTERACTIVE:
+                request.priority = INTERACTIVE
+                self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _try_take(self, request: Request) -> float:
+        """Take a token for request if it's its turn, returning 0, or else how long to wait for one."""
+        self._refill()
+        first = min(r.priority for r in self._waiting)
+        if self._tokens >= 1 and request.priority <= first:
+            self._tokens -= 1
+            return 0.0
+        # wait until the next token is due, or until a request ahead
+        # of this one has taken its token
+        return (1 - self._tokens) / self.rate if self._tokens < 1 else None
+
+    def _acquire(self, request: Request):
+        with self._cond:
+            if self.rate is None:
+                self.requests_made += 1
+                return
+            self._waiting.append(request)
+            try:
+                while self.rate is not None:
+                    timeout = self._try_take(request)
+                    if timeout == 0.0:
+                        break
+                    self._cond.wait(timeout)
+                self.requests_made += 1
+            finally:
+                self._waiting.remove(request)
+                self._cond.notify_all()
+
+    async def acquire_async(self, priority: int = INTERACTIVE):
+        """Wait, without blocking the event loop, for the rate limit to allow a request."""
+        request = Request(None, priority)
+        with self._cond:
+            if self.rate is None:
+                self.requests_made += 1
+                return
+            self._waiting.append(request)
+        try:
+            while True:
+                with self._cond:
+                    timeout = self._try_take(request) if self.rate is not None else 0.0
+                    if timeout == 0.0:
+                        self.requests_made += 1
+                        return
+                # there's no condition to wait on from the event loop,
+                # so check back in on requests ahead of this one often
+                await asyncio.sleep(timeout if timeout is not None else ASYNC_POLL_INTERVAL)
+        finally:
+            with self._cond:
+                self._waiting.remove(request)
+                self._cond.notify_all()
+
+# The FetchScheduler used throughout the application
+scheduler = FetchScheduler()
@@ -0,0 +1,134 @@
+from typing import Iterable, Iterator, List, Tuple
+from collections import deque
+from html.parser import HTMLParser
+
+import common
+from common import stream_html
+from items import Item, extract_comment_row
+from profiler import timed
+
+import bs4
+
+class CommentRowParser(HTMLParser):
+    """An incremental parser that collects the raw HTML of comment rows as it's fed."""
+    rows: deque = None
+    # the HTML of everything on the page other than the comment rows,
+    # which is only collected if keep_skeleton is set
+    skeleton: List[str] = None
+
+    def __init__(self, keep_skeleton: bool = False):
+        # keep character references as they are, so the collected
+        # HTML is the same as what was sent by HN
+        super().__init__(convert_charrefs=False)
+        self.rows = deque()
+        self.skeleton = [] if keep_skeleton else None
+        self._row = None
+        self._tr_depth = 0
+
+    def get_skeleton(self) -> str:
+        """Get the HTML of the page without its comment rows."""
+        return ''.join(self.skeleton)
+
+    def _append(self, markup: str):
+        if self._row is not None:
+            self._row.append(markup)
+        elif self.skeleton is not None:
+            self.skeleton.append(markup)
+
+    def handle_starttag(self, tag, attrs):
+        if self._row is None:
+            # comment rows are <tr> tags with the classes 'athing' and 'comtr'
+            if tag != 'tr' or 'comtr' not in (dict(attrs).get('class') or '').split():
+                self._append(self.get_starttag_text())
+                return
+            self._row = []
+            self._tr_depth = 0
+        if tag == 'tr':
+            # comment rows have their own nested <table>s, so track how
+            # deep we are to know which </tr> closes the row
+            self._tr_depth += 1
+        self._row.append(self.get_starttag_text())
+
+    def handle_startendtag(self, tag, attrs):
+        self._append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self._row is None:
+            self._append('</{}>'.format(tag))
+            return
+        self._row.append('</{}>'.format(tag))
+        if tag == 'tr':
+            self._tr_depth -= 1
+            if self._tr_depth == 0:
+                self.rows.append(''.join(self._row))
+                self._row = None
+
+    def handle_data(self, data):
+        self._append(data)
+
+    def handle_entityref(self, name):
+        self._append('&{};'.format(name))
+
+    def handle_charref(self, name):
+        self._append('&#{};'.format(name))
+
+def stream_comment_items(chunks: Iterable[str]) -> Iterator[Tuple[int, Item]]:
+    """Extract the indent and Item of each comment as the HTML of a page arrives."""
+    parser = CommentRowParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+        # only the (small) HTML of a single row is ever turned into
+        # a soup, rather than the whole page
+        while parser.rows:
+            yield extract_streamed_row(parser.rows.popleft())
+    parser.close()
+    while parser.rows:
+        yield extract_streamed_row(parser.rows.popleft())
+
+@timed()
+def extract_streamed_row(row_html: str) -> Tuple[int, Item]:
+    """Extract the indent and Item from the HTML of a single comment row."""
+    row_soup = bs4.BeautifulSoup(row_html, 'html.parser')
+    try:
+        return extract_comment_row(row_soup.tr)
+    finally:
+        row_soup.decompose()
+
+@timed()
+def extract_streamed_tree_ds(rows: deque) -> Tuple[List[int], List[int],
+    List[int], List[Item]]:
+    """Generate data structures representing a comment tree from the HTML of its rows."""
+    indents = list()
+    ids = list()
+    items = list()
+    # pop the rows off as we go so their HTML can be freed
+    while rows:
+        indent, i = extract_streamed_row(rows.popleft())
+        indents.append(indent)
+        ids.append(i.get_id())
+        items.append(i)
+
+    sorted_indents = sorted(list(set(indents)))
+
+    return ids, indents, sorted_indents, items
+
+def stream_lineage(comments: Iterable[Tuple[int, Item]]) -> Iterator[Tuple[int, List]]:
+    """Extract the lineage of each comment as the comments arrive."""
+    # Unlike extract_lineage, we can't know every indent on the page
+    # up front, so keep a stack of the indents of the comments in the
+    # current lineage instead. A comment's ancestors are exactly the
+    # comments on the stack that are less indented than it is.
+    lineage = []
+    indents = []
+    for indent, item in comments:
+        while indents and indents[-1] >= indent:
+            indents.pop()
+            lineage.pop()
+        lineage.append((item.get_id(), item))
+        indents.append(indent)
+        yield item.get_id(), lineage.copy()
+
+def stream_comments_by_id(item_id: int, pg_num: int = 1) -> Iterator[Tuple[int, List]]:
+    """Stream the comment lineages on a page of the item with the given ID."""
+    url = common.HN_ITEMS_URL + '?id={}&p={}'.format(item_id, pg_num)
+    return stream_lineage(stream_comment_items(stream_html(url)))
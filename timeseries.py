@@ -0,0 +1,166 @@
+"""Histories of the score and number of comments of Items, kept in typed arrays.
+
+Each sample is a timestamp, a score and a number of comments, appended
+to three arrays per Item (16 bytes a sample, rather than the hundreds a
+dict or tuple per sample would take). Old samples can be downsampled to
+one per interval, and the arrays are saved to SQLite as blobs.
+"""
+from typing import Dict, List, Optional, Tuple
+from array import array
+import bisect
+import sqlite3
+import sys
+import threading
+import time
+
+from page import NewsPage
+
+# typecodes of the arrays of timestamps (in seconds since the epoch),
+# scores and numbers of comments
+TIME_TYPECODE = 'd'
+COUNT_TYPECODE = 'i'
+# samples older than this many seconds are downsampled to one per interval
+DOWNSAMPLE_AGE = 24 * 60 * 60
+DOWNSAMPLE_INTERVAL = 60 * 60
+# window, in seconds, over which how fast Items are rising is measured
+RISING_WINDOW = 60 * 60
+
+def to_blob(a: array) -> bytes:
+    """Get the bytes of an array, little-endian whatever the platform."""
+    if sys.byteorder == 'big':
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+def from_blob(typecode: str, blob: bytes) -> array:
+    a = array(typecode)
+    a.frombytes(blob)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+class ItemSeries(object):
+    """The samples of the score and number of comments of one Item, oldest first."""
+    times: array = None
+    scores: array = None
+    comments: array = None
+
+    def __init__(self, times: array = None, scores: array = None, comments: array = None):
+        self.times = times if times is not None else array(TIME_TYPECODE)
+        self.scores = scores if scores is not None else array(COUNT_TYPECODE)
+        self.comments = comments if comments is not None else array(COUNT_TYPECODE)
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, timestamp: float, score: int, comments: int):
+        """Add a sample, which has to be at least as recent as the last one."""
+        self.times.append(timestamp)
+        self.scores.append(score)
+        self.comments.append(comments)
+
+    def downsample(self, before: float, interval: float):
+        """Keep only the last sample of each interval of the samples older than before."""
+        end = bisect.bisect_left(self.times, before)
+        keep = [i for i in range(end)
+            if i == end - 1 or self.times[i] // interval != self.times[i + 1] // interval]
+        if len(keep) == end:
+            return
+        keep.extend(range(end, len(self.times)))
+        self.times = array(TIME_TYPECODE, (self.times[i] for i in keep))
+        self.scores = array(COUNT_TYPECODE, (self.scores[i] for i in keep))
+        self.comments = array(COUNT_TYPECODE, (self.comments[i] for i in keep))
+
+    def rise(self, since: float) -> Optional[Tuple[int, int, float]]:
+        """Get the change in score and comments since a time, and the seconds it took, or None if unknown."""
+        if len(self.times) < 2 or self.times[-1] < since:
+            return None
+        # measure from the last sample before the window if there is
+        # one, and the first sample in it if not
+        start = max(bisect.bisect_right(self.times, since) - 1, 0)
+        elapsed = self.times[-1] - self.times[start]
+        if elapsed <= 0:
+            return None
+        return self.scores[-1] - self.scores[start], self.comments[-1] - self.comments[start], elapsed
+
+class SeriesStore(object):
+    """The score and comment histories of many Items, which can be saved to and loaded from SQLite."""
+    series: Dict[int, ItemSeries] = None
+
+    def __init__(self):
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.series)
+
+    def get(self, item_id: int) -> Optional[ItemSeries]:
+        return self.series.get(item_id, None)
+
+    def record(self, item_id: int, score: Optional[int], comments: Optional[int], timestamp: float = None):
+        """Add a sample for an Item (those without a score, like jobs, whose score is '', are skipped)."""
+        if not isinstance(score, int):
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            item_series = self.series.get(item_id, None)
+            if item_series is None:
+                item_series = self.series[item_id] = ItemSeries()
+            item_series.append(timestamp, score, comments or 0)
+
+    def record_page(self, pg: NewsPage, timestamp: float = None):
+        """Add a sample for every Item on a news page."""
+        timestamp = time.time() if timestamp is None else timestamp
+        for item in pg.items.values():
+            self.record(item.get_id(), item.get_score(), item.get_total_comments(), timestamp)
+
+    def downsample(self, age: float = DOWNSAMPLE_AGE, interval: float = DOWNSAMPLE_INTERVAL, now: float = None):
+        """Keep only one sample per interval of those older than age."""
+        before = (time.time() if now is None else now) - age
+        with self._lock:
+            for item_series in self.series.values():
+                item_series.downsample(before, interval)
+
+    def fastest_rising(self, n: int = 10, window: float = RISING_WINDOW, now: float = None,
+        by_comments: bool = False) -> List[Tuple[int, float]]:
+        """Get the IDs of the n Items gaining points (or comments) fastest over the window, with their gains per hour."""
+        since = (time.time() if now is None else now) - window
+        rates = []
+        with self._lock:
+            items = list(self.series.items())
+        for item_id, item_series in items:
+            rise = item_series.rise(since)
+            if rise is not None:
+                points, comments, elapsed = rise
+                rates.append((item_id, (comments if by_comments else points) * 3600 / elapsed))
+        rates.sort(key=lambda rate: rate[1], reverse=True)
+        return rates[:n]
+
+    def save(self, path: str):
+        """Save every history to the SQLite DB at path, as one row of blobs per Item."""
+        with self._lock:
+            rows = [(item_id, to_blob(s.times), to_blob(s.scores), to_blob(s.comments))
+                for item_id, s in self.series.items()]
+        con = sqlite3.connect(path)
+        try:
+            with con:
+                con.execute(''' CREATE TABLE IF NOT EXISTS series
+                    (id INTEGER PRIMARY KEY, times BLOB, scores BLOB, comments BLOB) ''')
+                con.executemany(''' INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?) ''', rows)
+        finally:
+            con.close()
+
+    @classmethod
+    def load(cls, path: str) -> 'SeriesStore':
+        """Load the histories saved to the SQLite DB at path (if there are any)."""
+        store = cls()
+        con = sqlite3.connect(path)
+        try:
+            con.execute(''' CREATE TABLE IF NOT EXISTS series
+                (id INTEGER PRIMARY KEY, times BLOB, scores BLOB, comments BLOB) ''')
+            for item_id, times, scores, comments in con.execute(''' SELECT * FROM series '''):
+                store.series[item_id] = ItemSeries(from_blob(TIME_TYPECODE, times),
+                    from_blob(COUNT_TYPECODE, scores), from_blob(COUNT_TYPECODE, comments))
+        finally:
+            con.close()
+        return store
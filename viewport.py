@@ -0,0 +1,228 @@
+"""Rendering a window onto a Page, without rendering the whole Page.
+
+A Page is split into blocks (its main Item, then each of its comments).
+Each block's height in lines at the current width starts out as an
+estimate based on its length, and is replaced by its exact height once
+it's rendered. The heights are kept in a Fenwick tree, so the block
+holding any line can be found in O(log n). Only the blocks that
+intersect the window (plus a margin on either side) are rendered, and
+only those blocks' rendered lines are kept.
+"""
+from typing import Dict, List, Optional, Tuple
+import math
+
+from page import Page, NewsPage, DEFAULT_WIDTH, render_comment
+from pages import Pages
+
+DEFAULT_HEIGHT = 24
+# lines rendered above and below the window, so that short scrolls
+# don't have to render anything
+DEFAULT_MARGIN = 24
+# wrapped lines fall short of the width by about half a word, which
+# estimates take into account
+WRAP_FILL = 0.9
+
+class FenwickTree(object):
+    """Prefix sums over a list of numbers, which can each be changed, in O(log n)."""
+
+    def __init__(self, values: List[int]):
+        # built in place in O(n), rather than with n additions
+        self._tree = [0] + list(values)
+        for i in range(1, len(self._tree)):
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def add(self, i: int, delta: int):
+        """Add delta to the ith number."""
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, i: int) -> int:
+        """Get the sum of the first i numbers."""
+        s = 0
+        while i > 0:
+            s += self._tree[i]
+            i -= i & -i
+        return s
+
+    def total(self) -> int:
+        return self.prefix_sum(len(self))
+
+    def find(self, value: int) -> int:
+        """Get the index of the number whose span (of the running sum) holds value."""
+        i = 0
+        step = 1 << len(self).bit_length()
+        while step:
+            j = i + step
+            if j < len(self._tree) and self._tree[j] <= value:
+                i = j
+                value -= self._tree[j]
+            step >>= 1
+        return i
+
+def estimate_lines(text: Optional[str], width: int) -> int:
+    """Estimate the number of lines a comment's text takes up, wrapped to width."""
+    if not text:
+        return 2
+    paragraphs = text.count('<p>') + 1
+    wrapped = math.ceil(len(text) / max(width * WRAP_FILL, 1))
+    # a line for the user, then each paragraph followed by a blank line
+    return 1 + max(paragraphs, wrapped) + paragraphs
+
+class PageView(object):
+    """The wrapped-line index of a Page at a width, with the rendered lines of some of its blocks."""
+    pg: Page = None
+    width: int = None
+
+    def __init__(self, pg: Page, width: int = DEFAULT_WIDTH):
+        self.pg = pg
+        # the first block is the main Item (or, for news pages, the
+        # whole page, which is always short)
+        comments = getattr(pg, 'comments', None)
+        self.lineages: List = [None] + (list(comments.values()) if comments else [])
+        self._lines: Dict[int, List[str]] = {}
+        self.resize(width)
+
+    def __len__(self):
+        """Get the number of blocks."""
+        return len(self.lineages)
+
+    def resize(self, width: int):
+        """Re-estimate the height of every block at a new width, forgetting what's been rendered."""
+        self.width = width
+        # the main Item is rendered up front, since it's needed first
+        self._lines = {0: self.render_block(0).split('\n')[:-1]}
+        self._exact = {0}
+        self._heights = [len(self._lines[0])]
+        self._heights += [estimate_lines(lineage[-1][1].get_text(), width) for lineage in self.lineages[1:]]
+        self._tree = FenwickTree(self._heights)
+
+    @property
+    def num_lines(self) -> int:
+        """Get the number of lines of the whole Page (exact once every block's been rendered)."""
+        return self._tree.total()
+
+    def render_block(self, block: int) -> str:
+        if block == 0:
+            return self.pg.render(self.width) if isinstance(self.pg, NewsPage) else self.pg.render_item(self.width)
+        return render_comment(self.lineages[block], self.width)
+
+    def get_lines(self, block: int) -> List[str]:
+        """Get the rendered lines of a block, correcting its height in the index."""
+        lines = self._lines.get(block, None)
+        if lines is None:
+            lines = self._lines[block] = self.render_block(block).split('\n')[:-1]
+            if block not in self._exact:
+                self._exact.add(block)
+                self._tree.add(block, len(lines) - self._heights[block])
+                self._heights[block] = len(lines)
+        return lines
+
+    def locate(self, line: int) -> Tuple[int, int]:
+        """Get the block holding a line of the Page, and the line within that block."""
+        line = max(0, min(line, self.num_lines - 1))
+        block = self._tree.find(line)
+        return block, line - self._tree.prefix_sum(block)
+
+    def line_of(self, block: int) -> int:
+        """Get the line of the Page a block starts on."""
+        return self._tree.prefix_sum(block)
+
+    def keep_only(self, first: int, last: int):
+        """Forget the rendered lines of the blocks outside of first to last."""
+        for block in [b for b in self._lines if b < first or b > last]:
+            del self._lines[block]
+
+class Viewport(object):
+    """A window of height lines onto the current Page of some Pages, wrapped to width."""
+    pgs: Pages = None
+    width: int = None
+    height: int = None
+    margin: int = None
+
+    def __init__(self, pgs: Pages, width: int = DEFAULT_WIDTH, height: int = DEFAULT_HEIGHT,
+        margin: int = DEFAULT_MARGIN):
+        self.pgs = pgs
+        self.width = width
+        self.height = height
+        self.margin = margin
+        self._views: Dict[int, PageView] = {}
+        # the top of the window, as a block and a line within it, so that
+        # it stays put while the estimates of the blocks above it change
+        self._top = (0, 0)
+
+    @property
+    def view(self) -> PageView:
+        """Get the line index of the current Page."""
+        pg_num = self.pgs.get_current_page_num()
+        view = self._views.get(pg_num, None)
+        if view is None or view.pg is not self.pgs.get_current_page():
+            view = self._views[pg_num] = PageView(self.pgs.get_current_page(), self.width)
+        elif view.width != self.width:
+            view.resize(self.width)
+        return view
+
+    @property
+    def top(self) -> int:
+        """Get the line of the current Page at the top of the window."""
+        block, offset = self._top
+        return self.view.line_of(block) + offset
+
+    def jump_to_line(self, line: int):
+        """Move the top of the window to a line of the current Page."""
+        self._top = self.view.locate(line)
+
+    def scroll(self, lines: int):
+        """Move the window down (or, with a negative number, up) by a number of lines."""
+        self.jump_to_line(self.top + lines)
+
+    def resize(self, width: int, height: int = None):
+        """Change the size of the window, keeping the block at its top in place."""
+        self.width = width
+        if height is not None:
+            self.height = height
+        self._top = (self._top[0], 0)
+
+    def next_page(self) -> bool:
+        """Move to the top of the next Page, returning False if there isn't one."""
+        if self.pgs.next_page() is None:
+            return False
+        self._top = (0, 0)
+        return True
+
+    def prev_page(self) -> bool:
+        """Move to the top of the previous Page, returning False if there isn't one."""
+        if self.pgs.prev_page() is None:
+            return False
+        self._top = (0, 0)
+        return True
+
+    def render(self) -> str:
+        """Render the lines in the window."""
+        view = self.view
+        block, offset = self._top
+        # render the margin above the window first, so that the heights
+        # of the blocks just above it are exact when scrolling back up
+        first = block
+        above = offset
+        while first > 0 and above < self.margin:
+            first -= 1
+            above += len(view.get_lines(first))
+
+        lines = []
+        last = block
+        wanted = offset + self.height + self.margin
+        while last < len(view) and len(lines) < wanted:
+            lines.extend(view.get_lines(last))
+            last += 1
+        # the block at the top may have turned out shorter than estimated
+        offset = min(offset, max(len(view.get_lines(block)) - 1, 0))
+        self._top = (block, offset)
+        view.keep_only(first, last - 1)
+        return '\n'.join(lines[offset:offset + self.height])
@@ -0,0 +1,211 @@
+"""Watching the front pages of HN in the background, as diffs between polls."""
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+
+from page import NewsPage
+import pages
+from itemdb import ItemDB
+from items import Item
+from timeseries import SeriesStore
+import common
+from scheduler import scheduler
+
+# seconds between polls, which start at the default and then move
+# between the minimum and maximum depending on how much is changing
+DEFAULT_INTERVAL = 60.0
+MIN_INTERVAL = 15.0
+MAX_INTERVAL = 300.0
+# fraction of the Items on the watched pages that have to change between
+# polls for polling to speed up (below it, polling slows down)
+CHURN_THRESHOLD = 0.1
+SPEED_UP = 0.5
+SLOW_DOWN = 1.5
+
+# the rank, score and number of comments of an Item on a news page
+Snapshot = Tuple[int, Optional[int], Optional[int]]
+
+class NewsDiff(object):
+    """The changes to the Items on news pages between two polls."""
+    moved: Dict[int, Tuple[int, int]] = None
+    score_deltas: Dict[int, int] = None
+    comment_deltas: Dict[int, int] = None
+    added: List[int] = None
+    dropped: List[int] = None
+    titles: Dict[int, str] = None
+
+    def __init__(self):
+        # Item ID -> (old rank, new rank)
+        self.moved = {}
+        # Item ID -> change in score, or in number of comments
+        self.score_deltas = {}
+        self.comment_deltas = {}
+        self.added = []
+        self.dropped = []
+        self.titles = {}
+
+    def __len__(self):
+        """Get the number of Items that changed."""
+        return len(set(self.moved) | set(self.score_deltas) | set(self.comment_deltas)
+            | set(self.added) | set(self.dropped))
+
+    def __str__(self):
+        s = ''
+        for item_id in self.added:
+            s += '+ {}\n'.format(self.titles.get(item_id))
+        for item_id in self.dropped:
+            s += '- {}\n'.format(self.titles.get(item_id))
+        for item_id in sorted(set(self.moved) | set(self.score_deltas) | set(self.comment_deltas)):
+            changes = []
+            if item_id in self.moved:
+                changes.append('rank {} -> {}'.format(*self.moved[item_id]))
+            if item_id in self.score_deltas:
+                changes.append('{:+d} points'.format(self.score_deltas[item_id]))
+            if item_id in self.comment_deltas:
+                changes.append('{:+d} comments'.format(self.comment_deltas[item_id]))
+            s += '~ {} ({})\n'.format(self.titles.get(item_id), ', '.join(changes))
+        return s
+
+def snapshot(pg: NewsPage) -> Dict[int, Snapshot]:
+    """Get the rank, score and number of comments of every Item on a news page."""
+    return {item_id: (rank, pg.items[item_id].get_score(), pg.items[item_id].get_total_comments())
+        for item_id, rank in pg.ranks.items()}
+
+def diff_news(old: Dict[int, Snapshot], new: Dict[int, Snapshot], titles: Dict[int, str]) -> NewsDiff:
+    """Get the changes between two snapshots of news pages."""
+    diff = NewsDiff()
+    for item_id, (rank, score, comments) in new.items():
+        if item_id not in old:
+            diff.added.append(item_id)
+            continue
+        old_rank, old_score, old_comments = old[item_id]
+        if rank != old_rank:
+            diff.moved[item_id] = (old_rank, rank)
+        if score is not None and old_score is not None and score != old_score:
+            diff.score_deltas[item_id] = score - old_score
+        if comments is not None and old_comments is not None and comments != old_comments:
+            diff.comment_deltas[item_id] = comments - old_comments
+    diff.dropped = [item_id for item_id in old if item_id not in new]
+    diff.added.sort(key=lambda item_id: new[item_id][0])
+    diff.dropped.sort(key=lambda item_id: old[item_id][0])
+    diff.titles = {item_id: titles.get(item_id) for item_id in
+        set(diff.added) | set(diff.dropped) | set(diff.moved) | set(diff.score_deltas) | set(diff.comment_deltas)}
+    return diff
+
+class FrontPageWatcher(object):
+    """Polls the first num_pages news pages in the background, applying what changes to an ItemDB.
+
+    Polling speeds up while ranks, scores and comment counts are churning
+    and slows down while they're stable. Each poll's NewsDiff is passed
+    to on_diff (if given) and kept until it's taken with take_diffs, and
+    the scores and comment counts it saw are added to series (if given).
+    """
+    item_db: ItemDB = None
+    num_pages: int = None
+    interval: float = None
+    on_diff: Callable[[NewsDiff], None] = None
+    series: SeriesStore = None
+
+    def __init__(self, item_db: ItemDB = None, num_pages: int = 1, on_diff: Callable[[NewsDiff], None] = None,
+        interval: float = DEFAULT_INTERVAL, min_interval: float = MIN_INTERVAL, max_interval: float = MAX_INTERVAL,
+        series: SeriesStore = None):
+        self.item_db = item_db if item_db is not None else ItemDB()
+        self.num_pages = num_pages
+        self.on_diff = on_diff
+        self.series = series
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.polls = 0
+        self.last_error: Exception = None
+        self._snapshot: Dict[int, Snapshot] = {}
+        self._titles: Dict[int, str] = {}
+        self._diffs: List[NewsDiff] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread = None
+
+    def start(self):
+        """Start polling on a daemon thread."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='front-page-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop polling, waiting for a poll in progress to finish."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def refresh(self):
+        """Poll now rather than waiting out the interval."""
+        self._wake.set()
+
+    def take_diffs(self) -> List[NewsDiff]:
+        """Get (and forget) the diffs of the polls since the last time they were taken."""
+        with self._lock:
+            diffs, self._diffs = self._diffs, []
+        return diffs
+
+    def poll(self) -> NewsDiff:
+        """Fetch the watched pages once, apply the changes to item_db and return them."""
+        new: Dict[int, Snapshot] = {}
+        items: Dict[int, Item] = {}
+        for pg_num in range(1, self.num_pages + 1):
+            with scheduler.background():
+                pg = pages.fetch_page(common.HN_NEWS_URL + '?p={}'.format(pg_num))
+            new.update(snapshot(pg))
+            items.update(pg.items)
+            if self.series is not None:
+                self.series.record_page(pg)
+        self._titles.update((item_id, item.get_title()) for item_id, item in items.items())
+        diff = diff_news(self._snapshot, new, self._titles)
+        # the diff has its own copy of the titles it shows, so the titles
+        # of Items that dropped off the watched pages can go
+        for item_id in diff.dropped:
+            self._titles.pop(item_id, None)
+        self._apply(diff, items, new)
+        self._snapshot = new
+        self.polls += 1
+        return diff
+
+    def _apply(self, diff: NewsDiff, items: Dict[int, Item], new: Dict[int, Snapshot]):
+        # new Items are added whole, and the others only get the fields
+        # that changed
+        updates = [items[item_id] for item_id in diff.added]
+        for item_id in set(diff.score_deltas) | set(diff.comment_deltas):
+            _, score, comments = new[item_id]
+            updates.append(Item(item_id, content={'score': score, 'total_comments': comments}))
+        self.item_db.add_all_items(updates)
+
+    def adapt(self, diff: NewsDiff):
+        """Poll faster if enough changed in diff, and slower if not."""
+        churn = len(diff) / max(len(self._snapshot), 1)
+        if churn >= CHURN_THRESHOLD:
+            self.interval = max(self.min_interval, self.interval * SPEED_UP)
+        else:
+            self.interval = min(self.max_interval, self.interval * SLOW_DOWN)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                first = self.polls == 0
+                diff = self.poll()
+                self.last_error = None
+                # everything is new on the first poll, which says nothing
+                # about how fast things are changing
+                if not first:
+                    self.adapt(diff)
+                with self._lock:
+                    self._diffs.append(diff)
+                if self.on_diff is not None:
+                    self.on_diff(diff)
+            except Exception as e:
+                # keep watching through errors, but back off
+                self.last_error = e
+                self.interval = self.max_interval
+            self._wake.wait(self.interval)